@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""Benchmark the hot paths of the ubuntu scripts.
+
+Commands are never executed: a RecordingBackend stands in for process
+creation, and remote downloads are served from local files. Everything
+that touches the filesystem does so under a temporary HOME, and system
+files are patched under a scratch UBUNTU_ROOT inside it.
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+
+BENCHMARKS = Path(__file__).resolve().parent
+BASELINE = BENCHMARKS / "baseline.json"
+SCRIPTS = BENCHMARKS.parent / "scripts"
+
+# A result is flagged when it is this much slower than the baseline.
+THRESHOLD = 0.25
+
+# System files the scripts patch, and what they hold on a fresh install.
+SYSTEM_FILES = {
+    "etc/fstab": "# /etc/fstab: static file system information.\n",
+    "etc/fuse.conf": "#user_allow_other\n",
+    "etc/apt/apt.conf.d/20auto-upgrades": (
+        'APT::Periodic::Update-Package-Lists "1";\n'
+        'APT::Periodic::Unattended-Upgrade "1";\n'
+    ),
+    "etc/sudoers.d/README": "",
+}
+
+
+def measure(func: Callable[[], Any], repeat: int, number: int = 1) -> dict[str, float]:
+    """Time a function.
+
+    Parameters
+    ----------
+    func : Callable[[], Any]
+        The code to time.
+    repeat : int
+        Number of timed samples.
+    number : int, optional
+        Calls per sample, by default 1.
+
+    Returns
+    -------
+    dict[str, float]
+        Best and median time per call, in milliseconds.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) * 1000 / number)
+    return {"min": min(samples), "median": statistics.median(samples)}
+
+
+def library_benchmarks(repeat: int) -> dict[str, dict[str, float]]:
+    """Benchmark the functions and classes in scripts/library.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of timed samples per benchmark.
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        Results keyed by benchmark name.
+    """
+    from library.classes import Labels
+    from library.classes import RecordingBackend
+    from library.environment import SHELL
+    from library.utilities import copy_files
+    from library.utilities import lean_text
+    from library.utilities import run_many_arguments
+    from library.utilities import set_backend
+
+    results: dict[str, dict[str, float]] = {}
+
+    text = "\n".join(p.read_text() for p in sorted(SHELL.glob("*.conf")))
+    results["lean_text"] = measure(lambda: lean_text(text), repeat, 20)
+
+    doc = "\n".join(f"    Step number {i}" for i in range(200))
+    results["Labels.__init__"] = measure(lambda: Labels(doc), repeat, 20)
+
+    def cycle() -> None:
+        labels = Labels(doc)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(50):
+                labels.next()
+        for _ in range(50):
+            labels.pop_first()
+            labels.pop_last()
+        labels.pop_item(10)
+        labels.dump(40)
+
+    results["Labels.next/pop/dump"] = measure(cycle, repeat, 20)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dest = Path(tmp) / "src", Path(tmp) / "dest"
+        src.mkdir()
+        dest.mkdir()
+        for i in range(2000):
+            (src / f"file{i:04}.txt").write_bytes(os.urandom(4096))
+        targets = [(src / "*", dest)]
+
+        def cold() -> None:
+            for file in dest.iterdir():
+                file.unlink()
+            copy_files(targets=targets, exclude=None)
+
+        results["copy_files cold (2000 files)"] = measure(cold, repeat)
+        results["copy_files warm (2000 files)"] = measure(
+            lambda: copy_files(targets=targets, exclude=None), repeat
+        )
+
+    set_backend(RecordingBackend())
+    try:
+        names = [f"package{i}" for i in range(100)]
+        results["run_many_arguments (100)"] = measure(
+            lambda: run_many_arguments("sudo apt -y install TARGET", names), repeat
+        )
+    finally:
+        set_backend(None)
+
+    return results
+
+
+def script_benchmarks(repeat: int) -> dict[str, dict[str, float]]:
+    """Benchmark full task_runner() executions of each script.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of timed samples per script.
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        Results keyed by benchmark name.
+    """
+    from library import utilities
+    from library.classes import RecordingBackend
+    from library.downloads import DownloadCache
+    from library.environment import FAIL
+
+    class CloningBackend(RecordingBackend):
+        """Also leave behind the directory a git clone would create."""
+
+        def __call__(self, args: list[str], **kwargs: object) -> int:
+            if args[:2] == ["git", "clone"]:
+                Path(args[-1]).mkdir(parents=True, exist_ok=True)
+            return super().__call__(args, **kwargs)
+
+    stand_in = Path(os.environ["HOME"]) / "stand-in.sh"
+    stand_in.write_text("#!/bin/sh\n")
+
+    def fake_fetch(self: DownloadCache, url: str) -> Path:
+        return stand_in
+
+    def fake_download(targets: list[tuple[str, Path]], **_: Any) -> tuple:
+        return {dest: utilities.PASS for _, dest in targets}, []
+
+    # desktop_setup fixes the permissions of the repo's scripts, so give
+    # it a copy to work on.
+    scripts_copy = Path(os.environ["HOME"]) / "ubuntu/scripts"
+    shutil.copytree(SCRIPTS, scripts_copy, ignore=shutil.ignore_patterns("__pycache__"))
+
+    args = argparse.Namespace(
+        bundle=None,
+        converge=False,
+        eager=False,
+        performance=False,
+        resume=False,
+        timing=False,
+        user="bench",
+        passwd="bench",
+    )
+    scripts = [
+        "desktop_setup",
+        "server_initialize",
+        "server_configure",
+        "pyenv_setup",
+        "docker_setup",
+        "vim_setup",
+    ]
+    results: dict[str, dict[str, float]] = {}
+    backend = CloningBackend()
+    utilities.set_backend(backend)
+    original_fetch = DownloadCache.fetch
+    DownloadCache.fetch = fake_fetch  # type: ignore[method-assign]
+    try:
+        for name in scripts:
+            module: Any = importlib.import_module(name)
+            module.clear = lambda: None
+            if hasattr(module, "download_files"):
+                module.download_files = fake_download
+            if hasattr(module, "SCRIPTS"):
+                module.SCRIPTS = scripts_copy
+
+            def run(module: Any = module, name: str = name) -> None:
+                with contextlib.redirect_stdout(out := io.StringIO()):
+                    module.task_runner(args)
+                # Timing a run that failed part way would be meaningless.
+                if FAIL in out.getvalue():
+                    print(out.getvalue())
+                    raise RuntimeError(f"{name} had failing steps")
+
+            backend.commands.clear()
+            results[f"task_runner {name}"] = measure(run, repeat)
+            results[f"task_runner {name}"]["commands"] = len(backend.commands) / repeat
+    finally:
+        DownloadCache.fetch = original_fetch  # type: ignore[method-assign]
+        utilities.set_backend(None)
+    return results
+
+
+def shell_benchmarks(repeat: int, pyenv: Path | None) -> dict[str, dict[str, float]]:
+    """Benchmark bash startup with the eager and the lazy pyenv setup.
+
+    Unlike the other benchmarks, this starts real shells, which run the
+    real pyenv. It's skipped if pyenv isn't installed.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of timed samples per benchmark.
+    pyenv : Path | None
+        Root of the pyenv installation, or None if there isn't one.
+
+    Returns
+    -------
+    dict[str, dict[str, float]]
+        Results keyed by benchmark name.
+    """
+    from library.environment import SHELL
+    from library.shell_profile import available
+    from library.shell_profile import time_startup
+
+    if pyenv is None or "bash" not in available():
+        return {}
+    home = Path(os.environ["HOME"])
+    (home / ".pyenv").symlink_to(pyenv)
+    results: dict[str, dict[str, float]] = {}
+    try:
+        for name, conf in (("eager", "pyenvsupport.conf"), ("lazy", "pyenvlazy.conf")):
+            (home / ".bashrc").write_text((SHELL / conf).read_text())
+            times = time_startup("bash", runs=repeat)
+            results[f"bash startup, pyenv {name}"] = {
+                "min": min(times.warm) * 1000,
+                "median": statistics.median(times.warm) * 1000,
+            }
+    finally:
+        (home / ".bashrc").write_text("")
+        (home / ".pyenv").unlink()
+    return results
+
+
+def compare(
+    current: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    """Compare results with a baseline.
+
+    Parameters
+    ----------
+    current : dict[str, dict[str, float]]
+        Results from this run.
+    baseline : dict[str, dict[str, float]]
+        Saved results.
+    threshold : float
+        Relative slowdown (e.g. 0.25 for 25%) that counts as a
+        regression.
+
+    Returns
+    -------
+    list[str]
+        Names of the benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in current.items():
+        if (old := baseline.get(name)) is None:
+            continue
+        if result["median"] > old["median"] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    msg = """
+    Benchmark the ubuntu script library and full script runs. Commands
+    are recorded by a fake backend rather than executed, so this is
+    safe to run anywhere. Results are compared with a saved JSON
+    baseline to catch regressions between versions.
+    """
+
+    epi = "Latest update: 10/18/26"
+
+    parser = argparse.ArgumentParser(description=msg, epilog=epi)
+
+    msg = """number of timed samples per benchmark (default 5)."""
+    parser.add_argument("-n", "--repeat", type=int, default=5, help=msg)
+
+    msg = f"""baseline file to compare against or save to (default
+    {BASELINE.relative_to(BENCHMARKS.parent)})."""
+    parser.add_argument("-b", "--baseline", type=Path, default=BASELINE, help=msg)
+
+    msg = """save the results as the new baseline."""
+    parser.add_argument("-s", "--save", action="store_true", help=msg)
+
+    msg = f"""relative slowdown flagged as a regression (default
+    {THRESHOLD})."""
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help=msg)
+
+    args = parser.parse_args()
+
+    pyenv: Path | None = Path(os.environ.get("PYENV_ROOT", Path.home() / ".pyenv"))
+    if not (pyenv / "bin/pyenv").exists():
+        pyenv = None
+
+    with tempfile.TemporaryDirectory() as home:
+        # Paths in library.environment are resolved at import time, so
+        # the sandbox has to be in place first.
+        os.environ["HOME"] = home
+        os.environ["UBUNTU_CACHE"] = str(Path(home) / ".cache/ubuntu")
+        os.environ["UBUNTU_ROOT"] = str(root := Path(home) / "root")
+        for rc in (".bashrc", ".zshrc"):
+            (Path(home) / rc).touch()
+        for name, content in SYSTEM_FILES.items():
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(content)
+        sys.path.insert(0, str(SCRIPTS))
+        results = library_benchmarks(args.repeat)
+        results.update(shell_benchmarks(args.repeat, pyenv))
+        results.update(script_benchmarks(args.repeat))
+
+    baseline: dict[str, Any] = {}
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())["results"]
+    regressions = compare(results, baseline, args.threshold)
+
+    pad = len(max(results, key=len)) + 3
+    print(f"{'Benchmark':<{pad}}{'min(ms)':>10}{'median(ms)':>12}{'baseline':>10}")
+    for name, result in results.items():
+        old = f"{baseline[name]['median']:.3f}" if name in baseline else "-"
+        flag = "  <-- slower" if name in regressions else ""
+        print(
+            f"{name:.<{pad}}{result['min']:>10.3f}{result['median']:>12.3f}"
+            f"{old:>10}{flag}"
+        )
+
+    if args.save:
+        data = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results,
+        }
+        args.baseline.write_text(json.dumps(data, indent=2) + "\n")
+        print(f"\nBaseline saved to: {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed.")
+        sys.exit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Build an offline bundle of everything the setup scripts download.
+
+Raises
+------
+RuntimeError
+    If Python is not at the minimum required version.
+"""
+
+import argparse
+import tempfile
+import textwrap
+from pathlib import Path
+from typing import Text
+
+from library.artifacts import DOWNLOADS
+from library.artifacts import PACKAGES
+from library.artifacts import REPOS
+from library.bundler import BundleBuilder
+from library.environment import PASS
+from library.runner import StepRunner
+from library.runner import print_timing
+from library.utilities import clear
+from library.utilities import min_python_version
+from library.utilities import privileged_session
+from library.utilities import run_one_command
+
+
+def task_runner(args: argparse.Namespace) -> None:
+    """Gather the artifacts and write the bundle."""
+    clear()
+
+    # ------------------------------------------
+
+    # Artifacts are gathered in a scratch directory next to the archive,
+    # so the final copy into the archive stays on the same disk. Files,
+    # repos and packages are fetched at the same time.
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    staging = tempfile.TemporaryDirectory(dir=args.output, prefix=".bundle-")
+    builder = BundleBuilder(Path(staging.name))
+    runner = StepRunner()
+    archive: list[Path] = []
+
+    # ------------------------------------------
+
+    # Step 1: System initialization.
+
+    def initialize() -> Text:
+        return PASS
+
+    runner.add("System initialization", initialize)
+
+    # ------------------------------------------
+
+    # Step 2: Update package index, so packages are bundled at their
+    # current versions.
+
+    def update_index() -> Text:
+        return run_one_command(cmd="sudo apt update")
+
+    runner.add(
+        "Updating package index",
+        update_index,
+        needs=["System initialization"],
+    )
+
+    # ------------------------------------------
+
+    # Step 3: Fetch remote scripts and files.
+
+    def fetch_files() -> Text:
+        return builder.add_files(DOWNLOADS)
+
+    runner.add(
+        "Fetching scripts and fonts",
+        fetch_files,
+        needs=["System initialization"],
+    )
+
+    # ------------------------------------------
+
+    # Step 4: Mirror git repos.
+
+    def mirror_repos() -> Text:
+        return builder.add_repos(REPOS)
+
+    runner.add(
+        "Mirroring git repos",
+        mirror_repos,
+        needs=["System initialization"],
+    )
+
+    # ------------------------------------------
+
+    # Step 5: Download packages and their dependencies.
+
+    def download_packages() -> Text:
+        return builder.add_packages(PACKAGES)
+
+    runner.add(
+        "Downloading packages",
+        download_packages,
+        needs=["Updating package index"],
+    )
+
+    # ------------------------------------------
+
+    # Step 6: Write the manifest and the archive.
+
+    def write_bundle() -> Text:
+        archive.append(builder.write(args.output))
+        return PASS
+
+    runner.add("Writing bundle", write_bundle, needs=list(runner.steps))
+
+    # ------------------------------------------
+
+    print("\nPlease enter your password if prompted.\n")
+    # Push a dummy sudo command just to force password entry before
+    # first command. This will avoid having the password prompt come in
+    # the middle of a label when providing status
+
+    run_one_command(cmd="sudo ls")
+
+    with staging, privileged_session():
+        runner.run()
+    if args.timing:
+        print_timing("bundle")
+
+    # ------------------------------------------
+
+    # Done
+
+    if archive:
+        msg = f"""
+        The bundle is at {archive[0]}. Copy it to each VM and pass it to
+        the setup scripts with --bundle.
+        """
+    else:
+        msg = """
+        The bundle was not written, since some artifacts could not be
+        fetched. Check the steps above marked with a red \"X\".
+        """
+    print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+
+    return
+
+
+def main():
+    if result := min_python_version():
+        raise RuntimeError(result)
+
+    msg = """
+    This script downloads everything the setup scripts would otherwise
+    fetch from the internet (installer scripts, fonts, git repos, and
+    apt packages with their dependencies) into a single archive, with a
+    manifest and hashes. Build it once on a machine with network access,
+    running the same Ubuntu release as the VMs, then install from it on
+    as many VMs as needed with --bundle.
+    """
+
+    epi = "Latest update: 10/18/26"
+
+    parser = argparse.ArgumentParser(description=msg, epilog=epi)
+
+    msg = """directory to write the bundle to (default: the current
+    directory)."""
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path.cwd(),
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    task_runner(args)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
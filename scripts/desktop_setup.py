@@ -8,97 +8,123 @@ RuntimeError
 """
 
 import argparse
+import os
 import textwrap
 from pathlib import Path
 from typing import Any
-
-from library.classes import Labels
+from typing import Text
+
+from library.artifacts import AUTOUPDATE_REPO
+from library.artifacts import DEV_TOOLS
+from library.artifacts import FONTS
+from library.artifacts import OHMYZSH_INSTALLER
+from library.artifacts import POWERLEVEL10K_REPO
+from library.bundle import Bundle
+from library.bundle import set_bundle
+from library.classes import PermissionRule
+from library.engine import ENGINE
 from library.environment import DEBUG
 from library.environment import FAIL
 from library.environment import HOME
+from library.environment import OHMYZSH
 from library.environment import PASS
+from library.environment import ROOT
 from library.environment import SCRIPTS
 from library.environment import SHELL
 from library.environment import SYSTEM
 from library.environment import VIM
+from library.journal import Journal
+from library.mirrors import MirrorStore
+from library.mounts import mount_shares
+from library.mounts import share_edits
+from library.mounts import shares_active
+from library.packages import PackageIndex
+from library.packages import download_packages
+from library.packages import install_packages
+from library.packages import report_failures
+from library.packages import summarize
+from library.patches import Edit
+from library.patches import pending
+from library.runner import StepRunner
+from library.runner import print_plan
+from library.runner import print_timing
+from library.settings import DconfSettings
+from library.shell_profile import drop_compiled
+from library.tuning import REPORT
+from library.tuning import ZRAM_PACKAGE
+from library.tuning import apply_profile
+from library.tuning import is_applied
+from library.tuning import profile_edits
 from library.utilities import clear
 from library.utilities import copy_files
+from library.utilities import download_files
+from library.utilities import fix_permissions
 from library.utilities import min_python_version
-from library.utilities import run_many_arguments
+from library.utilities import patch_files
+from library.utilities import privileged_session
 from library.utilities import run_one_command
 from library.utilities import run_shell_script
 
 
-def task_runner() -> None:
+def task_runner(args: argparse.Namespace) -> None:
     """Perform tool installation and setup."""
     clear()
 
     # ------------------------------------------
 
-    # Setup status labels
-
-    labels = Labels(
-        """
-        System initialization
-        Creating new directories
-        Copying files
-        Adjusting file permissions
-        Setting terminal profile
-        Installing developer tools
-        Installing zsh
-        Installing OhMyZsh
-        Installing OhMyZsh Full-autoupdate
-        Installing powerlevel10k theme
-        Installing Nerd Fonts
-        Setting Text Editor profile
-        Refreshing snaps (please be patient)
-        Configuring favorites
-        Disabling auto screen lock
-        Setting idle timeout to \"never\"
-        Disabling auto updates
-        Patching fuse.conf
-        Tidying icons
-        Cleaning up
-        """
-    )
+    # Steps are registered with a runner, along with the steps they
+    # depend on. Independent steps (e.g. downloads and local dconf work)
+    # run at the same time. Anything that uses apt is chained so only
+    # one step holds the dpkg lock at a time. Each step also lists its
+    # inputs, so a resumed run can skip steps that already passed, and a
+    # probe, so a converge run can skip steps with nothing to change.
+
+    journal = Journal("desktop_setup")
+    runner = StepRunner(journal=journal, resume=args.resume, converge=args.converge)
+    apt_report: dict[str, Text] = {}
+    index = PackageIndex()
+    zsh_home = HOME / ".oh-my-zsh/custom"
+    mirrors = MirrorStore()
 
     # ------------------------------------------
 
-    # Step 1: Initialize lists for running many arguments. When running
-    # commands with generic string targets, the "targets" array will be
-    # used. Commands with special target-types are shown below.
+    # Step 1: System initialization.
 
-    labels.next()
-    dir_targets: list[Path] = []
-    file_targets: list[tuple[Any, Any]] = []
-    targets: list[str] = []
-    src: str | Path = ""
-    dest: str | Path = ""
-    print(PASS)
+    def initialize() -> Text:
+        return PASS
+
+    runner.add("System initialization", initialize)
 
     # ------------------------------------------
 
     # Step 2: Create new directories
 
-    labels.next()
-    dir_targets = [
+    dir_targets: list[Path] = [
         HOME / ".fonts",
         HOME / ".vim/colors",
         HOME / "shares",
     ]
-    for target in dir_targets:
-        if DEBUG:
-            print(f"\nMaking: {target}")
-        else:
-            target.mkdir(parents=True, exist_ok=True)
-    print(PASS)
+
+    def make_directories() -> Text:
+        for target in dir_targets:
+            if DEBUG:
+                print(f"\nMaking: {target}")
+            else:
+                target.mkdir(parents=True, exist_ok=True)
+        return PASS
+
+    runner.add(
+        "Creating new directories",
+        make_directories,
+        needs=["System initialization"],
+        probe=lambda: all(target.is_dir() for target in dir_targets),
+    )
 
     # ------------------------------------------
 
     # Step 3: Copy files
 
-    labels.next()
-    file_targets = [
+    dot_files: list[tuple[Any, Any]] = [
         (SHELL / "bashrc.conf", HOME / ".bashrc"),
         (SHELL / "dircolors.conf", HOME / ".dircolors"),
         (SHELL / "p10k.conf", HOME / ".p10k.zsh"),
@@ -107,165 +133,277 @@ def task_runner() -> None:
         (VIM / "vimcolors/*", HOME / ".vim/colors"),
         (VIM / "vimrc.conf", HOME / ".vimrc"),
     ]
-    copy_files(targets=file_targets)
-    print(PASS)
 
-    # ------------------------------------------
+    def copy_dot_files() -> Text:
+        report = copy_files(targets=dot_files)
+        drop_compiled([dest for src, dest in dot_files if src in report.copied])
+        return report.result()
+
+    runner.add(
+        "Copying files",
+        copy_dot_files,
+        needs=["Creating new directories"],
+        inputs=[src for src, _ in dot_files],
+        probe=lambda: not copy_files(targets=dot_files, dry_run=True).copied,
+    )
 
-    # Step 4: Adjust file permissions on scripts just to make sure
-    # they're correct. It may not be absolutely necessary, but it won't
-    # hurt.
+    # ------------------------------------------
 
-    labels.next()
-    cmd = f"find {SCRIPTS} -name *.py -exec chmod 754 {{}} ;"
-    print(run_one_command(cmd=cmd))
+    # Step 4: Download every package installed below, in the
+    # background, while the local steps run. The installs wait for it
+    # and then only have to unpack. A failed download is not an error,
+    # since apt simply downloads at install time instead.
+
+    packages = [*DEV_TOOLS, "zsh"]
+    if args.performance:
+        packages.append(ZRAM_PACKAGE)
+
+    def prefetch_packages() -> Text:
+        download_packages(targets=packages, index=index)
+        return PASS
+
+    runner.add(
+        "Downloading packages",
+        prefetch_packages,
+        needs=["System initialization"],
+        probe=lambda: not index.missing(packages),
+        background=True,
+    )
 
     # ------------------------------------------
 
-    # Step 5: Setting terminal profile. Need a little special handling
-    # here, because we're redirecting stdin.
-
-    labels.next()
-    cmd = "dconf reset -f /org/gnome/terminal/legacy"
-    result = run_one_command(cmd=cmd)
-    if result == PASS:
-        cmd = "dconf load /org/gnome/terminal/legacy/profiles:/"
-        path = SYSTEM / "terminal_settings.txt"
-        if DEBUG:
-            print(f"Opening: {path}")
-        with open(path, "r") as f:
-            result = run_one_command(cmd=cmd, std_in=f)
-    print(result)
+    # Step 5: Some baseline packages from the ppa.
+
+    def install_developer_tools() -> Text:
+        apt_report.update(report := install_packages(targets=DEV_TOOLS, index=index))
+        return summarize(report)
+
+    runner.add(
+        "Installing developer tools",
+        install_developer_tools,
+        needs=["Downloading packages"],
+        inputs=list(DEV_TOOLS),
+        probe=lambda: not index.missing(DEV_TOOLS),
+    )
 
     # ------------------------------------------
 
-    msg = """
-    Installing additional software. Please enter your password if
-    prompted.
-    """
-    print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+    # Step 6: Install zsh.
 
-    # Push a dummy sudo command just to force password entry before
-    # first ppa pull. This will avoid having the password prompt come in
-    # the middle of a label when providing status
+    def install_zsh() -> Text:
+        apt_report.update(report := install_packages(targets=["zsh"], index=index))
+        return summarize(report)
 
-    run_one_command(cmd="sudo ls")
+    runner.add(
+        "Installing zsh",
+        install_zsh,
+        needs=["Installing developer tools"],
+        inputs=["zsh"],
+        probe=lambda: not index.missing(["zsh"]),
+    )
 
     # ------------------------------------------
 
-    # Step 6: Some baseline packages from the ppa.
-
-    labels.next()
-    cmd = "sudo apt -y install TARGET"
-    targets = [
-        "build-essential",
-        "ccache",
-        "gnome-text-editor",
-        "open-vm-tools-desktop",
-        "seahorse",
-        "tree",
-        "vim",
-    ]
-    print(run_many_arguments(cmd=cmd, targets=targets))
+    # Step 7: Install OhMyZsh.
+
+    zshrc = [(SHELL / "zshrc.conf", HOME / ".zshrc")]
+
+    def install_ohmyzsh() -> Text:
+        result = run_shell_script(
+            shell="sh", script=OHMYZSH_INSTALLER, options='"" --unattended'
+        )
+        # After zsh installation, copy over new .zshrc file
+        if result == PASS:
+            report = copy_files(targets=zshrc)
+            drop_compiled([dest for src, dest in zshrc if src in report.copied])
+            result = report.result()
+        return result
+
+    runner.add(
+        "Installing OhMyZsh",
+        install_ohmyzsh,
+        needs=["Installing zsh"],
+        inputs=[OHMYZSH_INSTALLER, SHELL / "zshrc.conf"],
+        probe=lambda: OHMYZSH.is_dir()
+        and not copy_files(targets=zshrc, dry_run=True).copied,
+    )
 
     # ------------------------------------------
 
-    # Step 7: Install zsh.
+    # Step 8: Install OhMyZsh Full-autoupdate. This and the theme below
+    # are cloned from mirrors in the local cache, so GitHub is only
+    # contacted when a mirror is created or due for a refresh. Re-runs
+    # update the existing checkout instead of failing.
 
-    labels.next()
-    targets = ["zsh"]
-    print(run_many_arguments(cmd=cmd, targets=targets))
+    autoupdate_dest = zsh_home / "plugins/ohmyzsh-full-autoupdate"
+
+    def install_autoupdate() -> Text:
+        return mirrors.install(url=AUTOUPDATE_REPO, dest=autoupdate_dest)
+
+    runner.add(
+        "Installing OhMyZsh Full-autoupdate",
+        install_autoupdate,
+        needs=["Installing OhMyZsh"],
+        inputs=[AUTOUPDATE_REPO],
+        probe=lambda: mirrors.is_current(AUTOUPDATE_REPO, autoupdate_dest),
+    )
 
     # ------------------------------------------
 
-    # Step 8: Install OhMyZsh.
+    # Step 9: Install powerlevel10k theme
 
-    labels.next()
-    src = "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/"
-    cmd = f"{src}install.sh"
-    result = run_shell_script(shell="sh", script=cmd, options='"" --unattended')
-    # After zsh installation, copy over new .zshrc file
-    if result == PASS:
-        file_targets = [(SHELL / "zshrc.conf", HOME / ".zshrc")]
-        copy_files(targets=file_targets)
-    print(result)
+    powerlevel10k_dest = zsh_home / "themes/powerlevel10k"
 
-    # ------------------------------------------
+    def install_powerlevel10k() -> Text:
+        return mirrors.install(url=POWERLEVEL10K_REPO, dest=powerlevel10k_dest)
 
-    # Step 9: Install OhMyZsh Full-autoupdate
+    runner.add(
+        "Installing powerlevel10k theme",
+        install_powerlevel10k,
+        needs=["Installing OhMyZsh"],
+        inputs=[POWERLEVEL10K_REPO],
+        probe=lambda: mirrors.is_current(POWERLEVEL10K_REPO, powerlevel10k_dest),
+    )
 
-    labels.next()
-    zsh_home = HOME / ".oh-my-zsh/custom"
-    src = "https://github.com/Pilaton/OhMyZsh-full-autoupdate.git"
-    dest = f"{zsh_home}/plugins/ohmyzsh-full-autoupdate"
-    cmd = f"git clone --depth=1 {src} {dest}"
-    print(run_one_command(cmd=cmd))
+    # ------------------------------------------
+
+    # Step 10: Install Nerd Fonts
+
+    font_dir = HOME / ".fonts"
+    font_targets = [(url, font_dir / name) for url, name in FONTS]
+
+    def install_fonts() -> Text:
+        results, changed = download_files(targets=font_targets)
+        if FAIL in results.values():
+            return FAIL
+        # Only rebuild the font cache for our own font directory, and
+        # only when a font was actually added or updated.
+        if changed:
+            return run_one_command(cmd=f"fc-cache -f {font_dir}")
+        return PASS
+
+    runner.add(
+        "Installing Nerd Fonts",
+        install_fonts,
+        needs=["Creating new directories"],
+        inputs=[url for url, _ in font_targets],
+        probe=lambda: all(dest.exists() for _, dest in font_targets),
+    )
 
     # ------------------------------------------
 
-    # Step 10: Install powerlevel10k theme
+    # Step 11: Make sure permissions are right on the scripts and on
+    # everything installed above. OhMyZsh refuses to load completions
+    # from group or world writable directories, so those bits are
+    # cleared on its trees. This runs in-process and only touches
+    # entries that are wrong.
+
+    permissions = [
+        (SCRIPTS, [PermissionRule("*.py", mode=0o754)]),
+        (HOME / ".vim/colors", [PermissionRule("*.vim", mode=0o644)]),
+        (font_dir, [PermissionRule("*", mode=0o644)]),
+        (
+            OHMYZSH,
+            [
+                PermissionRule("*", strip=0o022, dirs=True),
+                PermissionRule("*", strip=0o022),
+            ],
+        ),
+    ]
 
-    labels.next()
-    src = "https://github.com/romkatv/powerlevel10k.git"
-    dest = f"{zsh_home}/themes/powerlevel10k"
-    cmd = f"git clone --depth=1 {src} {dest}"
-    print(run_one_command(cmd=cmd))
+    def adjust_permissions() -> Text:
+        return fix_permissions(targets=permissions).result()
+
+    runner.add(
+        "Adjusting file permissions",
+        adjust_permissions,
+        needs=[
+            "Copying files",
+            "Installing OhMyZsh Full-autoupdate",
+            "Installing powerlevel10k theme",
+            "Installing Nerd Fonts",
+        ],
+        inputs=[str(SCRIPTS)],
+        probe=lambda: not fix_permissions(targets=permissions, dry_run=True).changed,
+    )
 
     # ------------------------------------------
 
-    # Step 11: Install Nerd Fonts
-
-    labels.next()
-    base = "https://github.com/romkatv/powerlevel10k-media/raw/master/"
-    fonts: list[str] = [
-        "MesloLGS%20NF%20Bold.ttf",
-        "MesloLGS%20NF%20Bold%20Italic.ttf",
-        "MesloLGS%20NF%20Italic.ttf",
-        "MesloLGS%20NF%20Regular.ttf",
-    ]
-    for font in fonts:
-        f_name = "\\ ".join(font.split("%20"))
-        cmd = f"curl -sL {base}{font} -o {HOME}/.fonts/{f_name}"
-        if (result := run_one_command(cmd=cmd)) == FAIL:
-            break
-    if result == PASS:
-        cmd = "fc-cache -vf"
-        result = run_one_command(cmd=cmd)
-    print(result)
+    # Step 12: Refresh snaps. This can take a while, so it runs in the
+    # background, and a refresh that hangs (e.g. on a stalled download)
+    # is stopped after half an hour rather than holding up the run.
+    # There's no cheap way to ask if a refresh is due, so a converge run
+    # only refreshes once a day. Snaps can't be refreshed offline, so
+    # this is skipped when installing from a bundle.
+
+    async def refresh_snaps() -> Text:
+        if args.bundle is not None:
+            return PASS
+        cmd = "sudo snap refresh"
+        return await ENGINE.run_one_command(cmd=cmd)
+
+    snaps = "Refreshing snaps (please be patient)"
+    runner.add(
+        snaps,
+        refresh_snaps,
+        needs=["System initialization"],
+        timeout=30 * 60,
+        probe=lambda: journal.passed_within(snaps, 24 * 60 * 60),
+        background=True,
+    )
 
     # ------------------------------------------
 
-    # Step 12: Setting Text Editor profile. Again, need special handling
-    # here, because we're redirecting stdin.
+    # Step 13: Disable auto updates.
+
+    auto_upgrades = "/etc/apt/apt.conf.d/20auto-upgrades"
+    auto_update_edits = [
+        Edit.set(auto_upgrades, "APT::Periodic::Update-Package-Lists", '"0";'),
+        Edit.set(auto_upgrades, "APT::Periodic::Unattended-Upgrade", '"0";'),
+    ]
 
-    labels.next()
-    cmd = "dconf reset -f /org/gnome/TextEditor/"
-    if (result := run_one_command(cmd=cmd)) == PASS:
-        cmd = "dconf load /org/gnome/TextEditor/"
-        path = SYSTEM / "text_editor_settings.txt"
-        if DEBUG:
-            print(f"Opening: {path}")
-        with open(path, "r") as f:
-            result = run_one_command(cmd=cmd, std_in=f)
-    print(result)
+    def disable_auto_updates() -> Text:
+        return patch_files(auto_update_edits)
+
+    runner.add(
+        "Disabling auto updates",
+        disable_auto_updates,
+        needs=["System initialization"],
+        probe=lambda: not pending(auto_update_edits, root=ROOT),
+    )
 
     # ------------------------------------------
 
-    # Step 13: Refresh snaps
+    # Step 14: Mount the VMware shared folders at ~/shares. The share
+    # goes in /etc/fstab as an automount, so it's mounted once, the
+    # first time it's used after boot, rather than by every login.
+    # fuse.conf is also patched to un-comment 'user_allow_other'. The
+    # file comes from fuse3, which is pulled in by open-vm-tools-desktop.
 
-    labels.next()
-    cmd = "sudo snap refresh"
-    print(run_one_command(cmd=cmd))
+    shares = HOME / "shares"
+    share_probe = share_edits(shares, os.getuid(), os.getgid())
+
+    def configure_shares() -> Text:
+        return mount_shares(shares)
+
+    runner.add(
+        "Mounting shared folders",
+        configure_shares,
+        needs=["Creating new directories", "Installing developer tools"],
+        probe=lambda: not pending(share_probe, root=ROOT)
+        and shares_active(shares, root=ROOT),
+    )
 
     # ------------------------------------------
 
-    # Step 14: Configure favorites. NOTE: To get the information needed
-    # for the code below, setup desired favorites, then run this
+    # Step 15: GNOME settings. Everything is gathered into one set of
+    # dconf keys, compared with the current database, and only what
+    # differs is written in a single dconf load. The terminal profile
+    # and Text Editor settings are dumps saved with dconf dump. To get
+    # the favorites below, set them up as desired, then run this
     # command: gsettings get org.gnome.shell favorite-apps
 
-    labels.next()
-    cmd = "gsettings set org.gnome.shell favorite-apps \"['"
-    targets = [
+    favorites = [
         "firefox_firefox.desktop",
         "org.gnome.TextEditor.desktop",
         "org.gnome.Terminal.desktop",
@@ -275,74 +413,101 @@ def task_runner() -> None:
         "org.gnome.Settings.desktop",
         "org.gnome.seahorse.Application.desktop",
     ]
-    cmd += "','".join(targets) + "']\""
-    print(run_one_command(cmd=cmd))
 
-    # ------------------------------------------
+    extensions = "org.gnome.shell.extensions."
+    gnome = DconfSettings()
+    gnome.load(
+        "/org/gnome/terminal/legacy/profiles:/",
+        SYSTEM / "terminal_settings.txt",
+        reset="/org/gnome/terminal/legacy/",
+    )
+    gnome.load(
+        "/org/gnome/TextEditor/",
+        SYSTEM / "text_editor_settings.txt",
+        reset="/org/gnome/TextEditor/",
+    )
+    gnome.set("org.gnome.shell", "favorite-apps", repr(favorites))
+    gnome.set("org.gnome.desktop.screensaver", "lock-enabled", "false")
+    gnome.set("org.gnome.desktop.session", "idle-delay", "uint32 0")
+    gnome.set(f"{extensions}dash-to-dock", "show-trash", "false")
+    gnome.set(f"{extensions}dash-to-dock", "show-mounts", "false")
+    gnome.set(f"{extensions}ding", "start-corner", "'bottom-left'")
+    gnome.set(f"{extensions}ding", "show-trash", "true")
+    gnome.set(f"{extensions}ding", "show-home", "false")
+
+    def apply_gnome_settings() -> Text:
+        return gnome.apply()
+
+    runner.add(
+        "Applying GNOME settings",
+        apply_gnome_settings,
+        needs=["Installing developer tools"],
+        inputs=[repr(gnome.keys)],
+        probe=gnome.is_current,
+    )
 
-    # Step 15: Disable auto screen lock
+    # ------------------------------------------
 
-    labels.next()
-    cmd = "gsettings set org.gnome.desktop.screensaver lock-enabled false"
-    print(run_one_command(cmd=cmd))
+    # Step 16: Optionally, apply the VM performance profile (see
+    # library/tuning.py). It waits for the other apt steps, since it
+    # installs the zram generator.
 
-    # ------------------------------------------
+    if args.performance:
 
-    # Step 16: Set idle timeout to 'never'.
+        def apply_performance_profile() -> Text:
+            report = install_packages(targets=[ZRAM_PACKAGE], index=index)
+            apt_report.update(report)
+            results = [summarize(report), apply_profile()]
+            return FAIL if FAIL in results else PASS
 
-    labels.next()
-    cmd = "gsettings set org.gnome.desktop.session idle-delay 0"
-    print(run_one_command(cmd=cmd))
+        runner.add(
+            "Applying performance profile",
+            apply_performance_profile,
+            needs=["Installing zsh", "Disabling auto updates"],
+            inputs=[ZRAM_PACKAGE, *(edit.key for edit in profile_edits())],
+            probe=lambda: is_applied() and not index.missing([ZRAM_PACKAGE]),
+        )
 
     # ------------------------------------------
 
-    # Step 17: Disable auto updates.
+    # Step 17: Cleanup any unused files. This waits on every other step,
+    # apart from background jobs.
 
-    labels.next()
-    dest = "/etc/apt/apt.conf.d/20auto-upgrades"
-    argument = r"s+Update-Package-Lists\ \"1\"+Update-Package-Lists\ \"0\"+"
-    cmd = f"sudo sed -i {argument} {dest}"
-    result = run_one_command(cmd=cmd)
-    if result == PASS:
-        argument = r"s+Unattended-Upgrade\ \"1\"+Unattended-Upgrade\ \"0\"+"
-        cmd = f"sudo sed -i {argument} {dest}"
-        result = run_one_command(cmd=cmd)
-    print(result)
+    def clean_up() -> Text:
+        return PASS
+
+    foreground = [label for label, step in runner.steps.items() if not step.background]
+    runner.add("Cleaning up", clean_up, needs=foreground)
 
     # ------------------------------------------
 
-    # Step 18: Patch /etc/fuse.conf to un-comment 'user_allow_other'.
-    # This allows users to start programs from the command line when
-    # their current working directory is inside the share.
+    # In converge mode, show what's out of date and stop early if
+    # nothing is, before asking for a password.
 
-    labels.next()
-    argument = r"s+\#user_allow_other+user_allow_other+"
-    dest = "/etc/fuse.conf"
-    cmd = f"sudo sed -i {argument} {dest}"
-    print(run_one_command(cmd=cmd))
+    if args.converge:
+        print_plan(plan := runner.plan())
+        if not plan:
+            return
 
     # ------------------------------------------
 
-    # Step 19: Arrange icons.
-
-    labels.next()
-    base = "org.gnome.shell.extensions."
-    targets = [
-        f"{base}dash-to-dock show-trash false",
-        f"{base}dash-to-dock show-mounts false",
-        f"{base}ding start-corner bottom-left",
-        f"{base}ding show-trash true",
-        f"{base}ding show-home false",
-    ]
-    cmd = "gsettings set TARGET"
-    print(run_many_arguments(cmd=cmd, targets=targets))
+    msg = """
+    Installing additional software. Please enter your password if
+    prompted.
+    """
+    print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
 
-    # ------------------------------------------
+    # Push a dummy sudo command just to force password entry before any
+    # steps start. This will avoid having the password prompt come in
+    # the middle of a label when providing status
 
-    # Step 20: Cleanup any unused files.
+    run_one_command(cmd="sudo ls")
 
-    labels.next()
-    print(PASS)
+    with privileged_session():
+        runner.run()
+    report_failures(apt_report)
+    if args.timing:
+        print_timing("desktop_setup")
 
     # ------------------------------------------
 
@@ -355,6 +520,8 @@ def task_runner() -> None:
     there was an error during installation.
     """
     print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+    if args.performance:
+        print(f"Performance profile settings, before and after: {REPORT}\n")
 
     return
 
@@ -375,8 +542,60 @@ def main():
     epi = "Latest update: 11/27/24"
 
     parser = argparse.ArgumentParser(description=msg, epilog=epi)
-    parser.parse_args()
-    task_runner()
+
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """check the current state first, then run only the steps that
+    would change something (e.g. from cron, to correct drift)."""
+    parser.add_argument(
+        "-c",
+        "--converge",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """also apply the VM performance profile: kernel memory and
+    writeback settings, zram swap, pass-through I/O scheduling for
+    virtual disks, and fewer background services."""
+    parser.add_argument(
+        "-p",
+        "--performance",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """install from an offline bundle made with bundle.py, instead
+    of downloading from the internet."""
+    parser.add_argument(
+        "-b",
+        "--bundle",
+        type=Path,
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    if args.bundle is not None:
+        try:
+            set_bundle(Bundle.open(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
+    task_runner(args)
 
     return
 
@@ -10,67 +10,93 @@ RuntimeError
 import argparse
 import getpass
 import textwrap
+from pathlib import Path
+from typing import Text
 
-from library.classes import Labels
+from library.artifacts import DOCKER_INSTALLER
+from library.bundle import Bundle
+from library.bundle import set_bundle
 from library.environment import PASS
+from library.journal import Journal
+from library.runner import StepRunner
+from library.runner import print_timing
 from library.utilities import clear
 from library.utilities import min_python_version
+from library.utilities import privileged_session
 from library.utilities import run_one_command
 from library.utilities import run_shell_script
 
 
-def task_runner() -> None:
+def task_runner(args: argparse.Namespace) -> None:
     """Install docker engine."""
     clear()
 
     # ------------------------------------------
 
-    # Setup status labels
+    # Steps are registered with a runner, along with the steps they
+    # depend on. Each step also lists its inputs, so a resumed run can
+    # skip steps that already passed.
 
-    labels = Labels(
-        """
-        System initialization
-        Installing docker components
-        Adding user to Docker group
-        """
-    )
-
-    # ------------------------------------------
-
-    # Step 0: Capture sudo permissions
-
-    print("\nPlease enter your password if prompted.\n")
-    # Push a dummy sudo command just to force password entry before
-    # first command. This will avoid having the password prompt come in
-    # the middle of a label when providing status
-
-    run_one_command(cmd="sudo ls")
+    runner = StepRunner(journal=Journal("docker_setup"), resume=args.resume)
 
     # ------------------------------------------
 
     # Step 1: System initialization.
 
-    labels.next()
-    print(PASS)
+    def initialize() -> Text:
+        return PASS
+
+    runner.add("System initialization", initialize)
 
     # ------------------------------------------
 
     # Step 2: Install docker components
 
-    labels.next()
-    print(
-        run_shell_script(
-            script="https://get.docker.com",
+    def install_docker() -> Text:
+        return run_shell_script(
+            script=DOCKER_INSTALLER,
             shell="sh",
             as_sudo=True,
         )
+
+    runner.add(
+        "Installing docker components",
+        install_docker,
+        needs=["System initialization"],
+        inputs=[DOCKER_INSTALLER],
     )
 
-    # Step 3: Add user to docker group.
+    # ------------------------------------------
 
-    labels.next()
-    cmd = f"sudo usermod -aG docker {getpass.getuser()}"
-    print(run_one_command(cmd=cmd))
+    # Step 3: Add user to docker group. The group is created by the
+    # docker install.
+
+    def add_docker_group() -> Text:
+        cmd = f"sudo usermod -aG docker {getpass.getuser()}"
+        return run_one_command(cmd=cmd)
+
+    runner.add(
+        "Adding user to Docker group",
+        add_docker_group,
+        needs=["Installing docker components"],
+        inputs=[getpass.getuser()],
+    )
+
+    # ------------------------------------------
+
+    # Capture sudo permissions before any steps start.
+
+    print("\nPlease enter your password if prompted.\n")
+    # Push a dummy sudo command just to force password entry before
+    # first command. This will avoid having the password prompt come in
+    # the middle of a label when providing status
+
+    run_one_command(cmd="sudo ls")
+
+    with privileged_session():
+        runner.run()
+    if args.timing:
+        print_timing("docker_setup")
 
     msg = """
     Setup script is complete. You must reboot your VM now for the
@@ -98,8 +124,41 @@ def main():
     epi = "Latest update: 11/27/24"
 
     parser = argparse.ArgumentParser(description=msg, epilog=epi)
-    parser.parse_args()
-    task_runner()
+
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """install from an offline bundle made with bundle.py, instead
+    of downloading from the internet."""
+    parser.add_argument(
+        "-b",
+        "--bundle",
+        type=Path,
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    if args.bundle is not None:
+        try:
+            set_bundle(Bundle.open(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
+    task_runner(args)
 
     return
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Run server_initialize or server_configure on many servers at once.
+
+Raises
+------
+RuntimeError
+    If Python is not at the minimum required version.
+"""
+
+import argparse
+import sys
+import textwrap
+from pathlib import Path
+
+from library.fleet import JOBS
+from library.fleet import Fleet
+from library.fleet import FleetState
+from library.fleet import LocalTransport
+from library.fleet import SshTransport
+from library.fleet import Transport
+from library.fleet import load_inventory
+from library.fleet import print_matrix
+from library.utilities import min_python_version
+
+
+def task_runner(args: argparse.Namespace) -> None:
+    """Run the script across the inventory."""
+    hosts = load_inventory(args.inventory)
+    # Stand-in hosts keep their own state, so a local run never hides
+    # real hosts from a later --retry.
+    if args.local is not None:
+        state = FleetState(args.script, root=args.local / ".fleet")
+    else:
+        state = FleetState(args.script)
+    script_args = list(args.script_args)
+    if args.retry:
+        # Failed hosts pick up where they left off.
+        hosts = state.failed(hosts)
+        if "-r" not in script_args and "--resume" not in script_args:
+            script_args.append("--resume")
+    if not hosts:
+        print("Nothing to do. Every host passed last time.")
+        return
+
+    transport: Transport
+    if args.local is not None:
+        transport = LocalTransport(root=args.local)
+        for url in transport.seed():
+            print(f"Could not fetch {url}, so the local hosts can't use it.")
+    else:
+        transport = SshTransport(repo=args.repo)
+
+    print(f"Running {args.script} on {len(hosts)} host(s).\n")
+    fleet = Fleet(transport, jobs=args.jobs, timeout=args.timeout)
+    results = fleet.run(hosts, args.script, script_args)
+    state.save(results)
+    print_matrix(results)
+
+    failed = state.failed(hosts)
+    if failed:
+        msg = f"""
+        {len(failed)} of {len(hosts)} host(s) failed. Run again with
+        --retry to try just those, resuming where they left off.
+        """
+    else:
+        msg = f"""All {len(hosts)} host(s) passed."""
+    print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+
+    return
+
+
+def main():
+    if result := min_python_version():
+        raise RuntimeError(result)
+
+    msg = """
+    This script runs server_initialize.py or server_configure.py on many
+    servers at the same time over ssh, and reports the outcome of every
+    step on every host. Each server needs the repo cloned in its home
+    directory, ssh key access, and (for server_configure.py) sudo
+    without a password. Arguments for the script go after a -- at the
+    end of the command line, e.g. fleet.py hosts.txt server_configure
+    -- --converge.
+    """
+
+    epi = "Latest update: 10/18/26"
+
+    usage = "%(prog)s [options] inventory script [-- script arguments]"
+    parser = argparse.ArgumentParser(description=msg, epilog=epi, usage=usage)
+
+    msg = """text file with one host per line, as [user@]host[:port]."""
+    parser.add_argument("inventory", type=Path, help=msg)
+
+    msg = """the script to run on each host."""
+    parser.add_argument(
+        "script",
+        choices=["server_initialize", "server_configure"],
+        help=msg,
+    )
+
+    msg = f"""maximum number of hosts to run at the same time (default:
+    {JOBS})."""
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=JOBS,
+        help=msg,
+    )
+
+    msg = """only run the hosts that failed (or never ran) last time,
+    resuming each one where it left off."""
+    parser.add_argument(
+        "-r",
+        "--retry",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """seconds each host gets to finish before it is stopped and
+    marked failed (default: no limit)."""
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help=msg,
+    )
+
+    msg = """where the repo is cloned on each host, relative to the home
+    directory (default: ubuntu)."""
+    parser.add_argument(
+        "--repo",
+        default="ubuntu",
+        help=msg,
+    )
+
+    msg = """instead of using ssh, run each host as a local process with
+    its own home directory under LOCAL (for testing)."""
+    parser.add_argument(
+        "--local",
+        type=Path,
+        default=None,
+        help=msg,
+    )
+
+    # Everything after -- belongs to the script, so options for this
+    # script can go anywhere before it.
+    argv = sys.argv[1:]
+    script_args: list[str] = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, script_args = argv[:split], argv[split + 1 :]
+    args = parser.parse_args(argv)
+    args.script_args = script_args
+    task_runner(args)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
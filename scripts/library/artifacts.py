@@ -0,0 +1,73 @@
+"""Everything the ubuntu scripts fetch from the internet.
+
+The scripts take their URLs and package lists from here, so that the
+bundle command can gather the very same artifacts for offline use.
+"""
+
+# Installer scripts.
+OHMYZSH_INSTALLER = (
+    "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh"
+)
+DOCKER_INSTALLER = "https://get.docker.com"
+PYENV_INSTALLER = "https://pyenv.run"
+
+# Git repos. The OhMyZsh installer clones OHMYZSH_REPO itself, unless
+# it's pointed at another remote with the REMOTE environment variable.
+OHMYZSH_REPO = "https://github.com/ohmyzsh/ohmyzsh.git"
+AUTOUPDATE_REPO = "https://github.com/Pilaton/OhMyZsh-full-autoupdate.git"
+POWERLEVEL10K_REPO = "https://github.com/romkatv/powerlevel10k.git"
+
+# Nerd Fonts, as (url, file name) pairs.
+FONT_BASE = "https://github.com/romkatv/powerlevel10k-media/raw/master/"
+FONTS: list[tuple[str, str]] = [
+    (f"{FONT_BASE}{font}", font.replace("%20", " "))
+    for font in [
+        "MesloLGS%20NF%20Bold.ttf",
+        "MesloLGS%20NF%20Bold%20Italic.ttf",
+        "MesloLGS%20NF%20Italic.ttf",
+        "MesloLGS%20NF%20Regular.ttf",
+    ]
+]
+
+# Packages installed with apt.
+DEV_TOOLS: list[str] = [
+    "build-essential",
+    "ccache",
+    "gnome-text-editor",
+    "open-vm-tools-desktop",
+    "seahorse",
+    "tree",
+    "vim",
+]
+BUILD_DEPS: list[str] = [
+    "make",
+    "build-essential",
+    "libssl-dev",
+    "zlib1g-dev",
+    "libbz2-dev",
+    "libreadline-dev",
+    "libsqlite3-dev",
+    "wget",
+    "curl",
+    "libncursesw5-dev",
+    "xz-utils",
+    "tk-dev",
+    "libxml2-dev",
+    "libxmlsec1-dev",
+    "libffi-dev",
+    "liblzma-dev",
+]
+
+# Everything above, as gathered into a bundle.
+DOWNLOADS: list[str] = [
+    OHMYZSH_INSTALLER,
+    DOCKER_INSTALLER,
+    PYENV_INSTALLER,
+    *[url for url, _ in FONTS],
+]
+REPOS: list[str] = [OHMYZSH_REPO, AUTOUPDATE_REPO, POWERLEVEL10K_REPO]
+PACKAGES: list[str] = list(dict.fromkeys([*DEV_TOOLS, "zsh", *BUILD_DEPS]))
+
+
+if __name__ == "__main__":
+    pass
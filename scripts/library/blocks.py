@@ -0,0 +1,443 @@
+"""Managed blocks of lines in rc and config files.
+
+A block is a run of lines between a pair of markers:
+
+    # BEGIN ubuntu pyenv v2 1f3a9c0e5b7d
+    ...
+    # END ubuntu pyenv
+
+The BEGIN line records the block's version and a hash of its content,
+so a block can be found however the rest of the file is laid out, and
+checked against what it should be without comparing it line by line.
+A block whose lines no longer match its hash was edited by hand, and is
+put back the next time it's written.
+
+Each file is read once, into an index of its blocks. Any number of
+blocks can then be added, updated or removed in memory, and the file is
+written back once, atomically, only if something changed.
+"""
+
+import concurrent.futures as cf
+import hashlib
+import os
+import re
+from pathlib import Path
+from typing import Any
+from typing import Text
+
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import HOME
+from .environment import PASS
+from .environment import WORKERS
+from .patches import write_file
+
+BEGIN = re.compile(r"^# BEGIN ubuntu (\S+)(?: v(\d+))?(?: ([0-9a-f]{12}))?\s*$")
+
+
+def digest(lines: list[str]) -> str:
+    """Hash the content of a block.
+
+    Parameters
+    ----------
+    lines : list[str]
+        The lines between the markers.
+
+    Returns
+    -------
+    str
+        The first 12 hex digits of the sha256 of the lines.
+    """
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()[:12]
+
+
+def _content(text: str) -> list[str]:
+    """Split block content into lines, without leading or trailing blanks."""
+    return text.strip("\n").split("\n") if text.strip("\n") else []
+
+
+class Block:
+    """Where a block sits in a file, and what its BEGIN line says."""
+
+    def __init__(
+        self,
+        name: str,
+        version: int,
+        recorded: str | None,
+        start: int,
+        stop: int,
+    ) -> None:
+        """Create a new Block object.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block.
+        version : int
+            Version from the BEGIN line (0 if there isn't one).
+        recorded : str | None
+            Content hash from the BEGIN line, if there is one.
+        start : int
+            Index of the BEGIN line.
+        stop : int
+            Index of the line after the END line.
+        """
+        self.name = name
+        self.version = version
+        self.recorded = recorded
+        self.start = start
+        self.stop = stop
+        return
+
+
+class BlockFile:
+    """A file parsed into an index of its managed blocks."""
+
+    def __init__(self, path: Path) -> None:
+        """Read a file and index its blocks.
+
+        A file that doesn't exist is treated as empty, and is only
+        created if a block is added to it.
+
+        Parameters
+        ----------
+        path : Path
+            The file.
+
+        Raises
+        ------
+        OSError
+            If the file exists but can't be read.
+        """
+        self.path = path
+        try:
+            self.lines = path.read_text().splitlines()
+            self.exists = True
+        except FileNotFoundError:
+            self.lines = []
+            self.exists = False
+        self.changes: list[str] = []
+        self._index()
+        return
+
+    def _index(self) -> None:
+        """Find the blocks in the file. A BEGIN without an END is ignored."""
+        self.blocks: dict[str, Block] = {}
+        i = 0
+        while i < len(self.lines):
+            if (match := BEGIN.match(self.lines[i])) and match[1] not in self.blocks:
+                end = f"# END ubuntu {match[1]}"
+                try:
+                    stop = self.lines.index(end, i + 1) + 1
+                except ValueError:
+                    i += 1
+                    continue
+                version = int(match[2]) if match[2] else 0
+                self.blocks[match[1]] = Block(match[1], version, match[3], i, stop)
+                i = stop
+            else:
+                i += 1
+        return
+
+    def _find(self, lines: list[str]) -> int | None:
+        """Find where a run of lines starts in the file, if it's there."""
+        for i in range(len(self.lines) - len(lines) + 1 if lines else 0):
+            if self.lines[i : i + len(lines)] == lines:
+                return i
+        return None
+
+    def body(self, name: str) -> list[str]:
+        """Return the lines of a block, between its markers.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block.
+
+        Returns
+        -------
+        list[str]
+            The lines, or an empty list if the block isn't in the file.
+        """
+        if (block := self.blocks.get(name)) is None:
+            return []
+        return self.lines[block.start + 1 : block.stop - 1]
+
+    def current(self, name: str, content: str, version: int = 1) -> bool:
+        """Determine if a block is in the file, up to date and unedited.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block.
+        content : str
+            What the block should hold.
+        version : int, optional
+            What version the block should be, by default 1.
+
+        Returns
+        -------
+        bool
+            True if the block doesn't need to be written.
+        """
+        if (block := self.blocks.get(name)) is None or block.version != version:
+            return False
+        wanted = digest(_content(content))
+        return block.recorded == wanted == digest(self.body(name))
+
+    def set(
+        self,
+        name: str,
+        content: str,
+        version: int = 1,
+        replaces: str = "",
+    ) -> str | None:
+        """Add a block, or bring it up to date, in memory.
+
+        A block that's already in the file is rewritten where it is. A
+        new block takes the place of the replaces text, if that's in the
+        file (e.g. a copy of the same lines added before they were put
+        in a block), and is otherwise appended.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block.
+        content : str
+            What the block should hold.
+        version : int, optional
+            Version of the block, by default 1.
+        replaces : str, optional
+            Unmarked text that the block takes the place of, by default
+            "".
+
+        Returns
+        -------
+        str | None
+            A description of the change, or None if the block was
+            already up to date.
+        """
+        if self.current(name, content, version):
+            return None
+        body = _content(content)
+        lines = [f"# BEGIN ubuntu {name} v{version} {digest(body)}"]
+        lines += [*body, f"# END ubuntu {name}"]
+        old = _content(replaces)
+        if (block := self.blocks.get(name)) is not None:
+            self.lines[block.start : block.stop] = lines
+            change = f"updated block {name!r} to v{version}"
+        elif (i := self._find(old)) is not None:
+            self.lines[i : i + len(old)] = lines
+            change = f"replaced unmarked lines with block {name!r}"
+        else:
+            if self.lines and self.lines[-1].strip():
+                self.lines.append("")
+            self.lines.extend(lines)
+            change = f"added block {name!r}"
+        self.changes.append(change)
+        self._index()
+        return change
+
+    def remove(self, name: str) -> str | None:
+        """Remove a block, in memory.
+
+        Parameters
+        ----------
+        name : str
+            Name of the block.
+
+        Returns
+        -------
+        str | None
+            A description of the change, or None if there was no such
+            block.
+        """
+        if (block := self.blocks.get(name)) is None:
+            return None
+        start, stop = block.start, block.stop
+        # Take the blank line that set() put in front of it, too.
+        if start > 0 and not self.lines[start - 1].strip():
+            start -= 1
+        del self.lines[start:stop]
+        change = f"removed block {name!r}"
+        self.changes.append(change)
+        self._index()
+        return change
+
+    def save(self, mode: int = 0o644) -> bool:
+        """Write the file back, if anything changed.
+
+        A new file is given the owner of its directory, so files created
+        by root in other users' homes belong to those users. A symlinked
+        file (e.g. from a dotfile manager) is written through the link.
+
+        Parameters
+        ----------
+        mode : int, optional
+            Permissions for a new file, by default 0o644.
+
+        Returns
+        -------
+        bool
+            True if the file was written.
+        """
+        if not self.changes:
+            return False
+        if not self.exists and not self.lines:
+            return False
+        target = self.path.resolve()
+        write_file(target, "\n".join(self.lines) + "\n", mode)
+        if not self.exists and os.geteuid() == 0:
+            st = target.parent.stat()
+            os.chown(target, st.st_uid, st.st_gid)
+        self.exists = True
+        self.changes = []
+        return True
+
+
+class BlockEdit:
+    """A block to put in, or take out of, a file in each home."""
+
+    def __init__(
+        self,
+        file: str,
+        name: str,
+        content: str | None,
+        version: int = 1,
+        replaces: str = "",
+    ) -> None:
+        """Create a new BlockEdit object.
+
+        Parameters
+        ----------
+        file : str
+            Path of the file, relative to the home directory (e.g.
+            .zshrc).
+        name : str
+            Name of the block.
+        content : str | None
+            What the block should hold, or None to remove it.
+        version : int, optional
+            Version of the block, by default 1.
+        replaces : str, optional
+            Unmarked text the block takes the place of, see
+            BlockFile.set(), by default "".
+        """
+        self.file = file
+        self.name = name
+        self.content = content
+        self.version = version
+        self.replaces = replaces
+        return
+
+    def apply(self, target: BlockFile) -> str | None:
+        """Apply the edit to a file, in memory.
+
+        Parameters
+        ----------
+        target : BlockFile
+            The parsed file.
+
+        Returns
+        -------
+        str | None
+            A description of the change, or None if there was nothing to
+            do.
+        """
+        if self.content is None:
+            return target.remove(self.name)
+        return target.set(self.name, self.content, self.version, self.replaces)
+
+
+def _update(path: Path, edits: list[BlockEdit], dry_run: bool) -> list[str] | str:
+    """Apply the edits for one file, with one read and at most one write."""
+    try:
+        target = BlockFile(path)
+        changes = [c for edit in edits if (c := edit.apply(target)) is not None]
+        if not dry_run:
+            target.save()
+    except OSError as e:
+        return f"{type(e).__name__}: {e}"
+    return changes
+
+
+def update_blocks(
+    edits: list[BlockEdit],
+    homes: list[Path] | None = None,
+    dry_run: bool = False,
+    workers: int = WORKERS,
+) -> dict[str, Any]:
+    """Apply block edits to files in one or more home directories.
+
+    Edits are grouped by file, so each file is read once and written at
+    most once however many blocks change in it. Files are handled in
+    parallel, which adds up when there are many homes.
+
+    Parameters
+    ----------
+    edits : list[BlockEdit]
+        The edits, in order.
+    homes : list[Path] | None, optional
+        Home directories to apply them in, by default just HOME.
+    dry_run : bool, optional
+        Work out the changes without writing anything, by default False.
+    workers : int, optional
+        Number of files handled at the same time, by default WORKERS.
+
+    Returns
+    -------
+    dict[str, Any]
+        For each file, the list of changes made (empty if it was already
+        up to date), or an error message if it could not be updated.
+    """
+    files: dict[Path, list[BlockEdit]] = {}
+    for home in homes if homes is not None else [HOME]:
+        for edit in edits:
+            files.setdefault(home / edit.file, []).append(edit)
+    if DEBUG and not dry_run:
+        for path, group in files.items():
+            print(f"\nUpdating blocks: {path} {[edit.name for edit in group]}")
+        return {str(path): [] for path in files}
+    with cf.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            path: pool.submit(_update, path, group, dry_run)
+            for path, group in files.items()
+        }
+    return {str(path): future.result() for path, future in futures.items()}
+
+
+def pending(report: dict[str, Any]) -> list[str]:
+    """Pick out the files that changed, or would change, from a report.
+
+    Parameters
+    ----------
+    report : dict[str, Any]
+        A report from update_blocks().
+
+    Returns
+    -------
+    list[str]
+        Paths of the files that have changes, or errors.
+    """
+    return [path for path, changes in report.items() if changes]
+
+
+def summarize_blocks(report: dict[str, Any]) -> Text:
+    """Summarize a report from update_blocks().
+
+    Parameters
+    ----------
+    report : dict[str, Any]
+        The report.
+
+    Returns
+    -------
+    Text
+        PASS if every file was updated (or already up to date),
+        otherwise FAIL.
+    """
+    return FAIL if any(isinstance(r, str) for r in report.values()) else PASS
+
+
+if __name__ == "__main__":
+    pass
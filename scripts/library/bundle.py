@@ -0,0 +1,242 @@
+"""Offline bundles of everything the ubuntu scripts fetch.
+
+A bundle is a tar archive, built once by bundle.py, holding the remote
+scripts and files, bare git mirrors and apt packages (.deb files with
+their dependencies) the scripts would otherwise download. A manifest
+lists every artifact along with its sha256. Once a bundle is activated
+with set_bundle(), the download, git and apt helpers take artifacts
+from it and never go to the network.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+
+from .artifacts import OHMYZSH_INSTALLER
+from .artifacts import OHMYZSH_REPO
+from .environment import CACHE
+
+CHUNK = 64 * 1024
+
+# Version of the manifest layout.
+FORMAT = 1
+
+# Installers that clone a repo themselves, and the environment variable
+# that points them at another remote.
+REMOTES = {OHMYZSH_INSTALLER: ("REMOTE", OHMYZSH_REPO)}
+
+# The bundle in use, see set_bundle().
+_active: "Bundle | None" = None
+
+
+def sha256(path: Path) -> str:
+    """Return the sha256 of a file, as hex.
+
+    Parameters
+    ----------
+    path : Path
+        The file to hash.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Bundle:
+    """An unpacked bundle, ready to serve artifacts."""
+
+    def __init__(self, root: Path) -> None:
+        """Create a new Bundle object.
+
+        Parameters
+        ----------
+        root : Path
+            Directory the bundle was unpacked into.
+
+        Raises
+        ------
+        ValueError
+            If the directory doesn't hold a bundle this version of the
+            scripts can read.
+        """
+        self.root = root
+        try:
+            self.manifest = json.loads((root / "manifest.json").read_text())
+        except (OSError, ValueError) as e:
+            raise ValueError(f"Not a bundle: {root} ({e})") from e
+        if self.manifest.get("format") != FORMAT:
+            raise ValueError(f"Unsupported bundle format: {root}")
+        return
+
+    @classmethod
+    def open(cls, archive: Path, cache: Path = CACHE / "bundles") -> "Bundle":
+        """Unpack a bundle archive, or reuse an earlier unpacked copy.
+
+        The archive is unpacked once into the cache, and every artifact
+        is checked against its hash before the copy is used.
+
+        Parameters
+        ----------
+        archive : Path
+            The bundle archive.
+        cache : Path, optional
+            Where bundles are unpacked, by default CACHE/bundles.
+
+        Returns
+        -------
+        Bundle
+            The unpacked bundle.
+
+        Raises
+        ------
+        ValueError
+            If the archive can't be read or fails verification.
+        """
+        try:
+            st = archive.stat()
+        except OSError as e:
+            raise ValueError(f"Cannot read bundle: {archive} ({e})") from e
+        key = f"{archive.resolve()}:{st.st_size}:{st.st_mtime_ns}"
+        tag = hashlib.sha256(key.encode()).hexdigest()[:12]
+        dest = cache / f"{archive.name.split('.')[0]}-{tag}"
+        if dest.exists():
+            return cls(dest)
+        cache.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=cache, prefix=".unpack-"))
+        try:
+            with tarfile.open(archive) as tar:
+                tar.extractall(tmp, filter="data")
+            bundle = cls(tmp)
+            if bad := bundle.verify():
+                raise ValueError(f"Corrupt bundle: {archive} ({', '.join(bad)})")
+            if not dest.exists():
+                os.replace(tmp, dest)
+        except (OSError, tarfile.TarError) as e:
+            raise ValueError(f"Cannot unpack bundle: {archive} ({e})") from e
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls(dest)
+
+    def verify(self) -> list[str]:
+        """Check every file and package against its hash.
+
+        Returns
+        -------
+        list[str]
+            Paths (relative to the bundle) that are missing or don't
+            match the manifest.
+        """
+        entries = [*self.manifest["files"].values(), *self.manifest["debs"].values()]
+        bad = []
+        for entry in entries:
+            path = self.root / entry["path"]
+            if not path.is_file() or sha256(path) != entry["sha256"]:
+                bad.append(entry["path"])
+        return bad
+
+    def file(self, url: str) -> Path | None:
+        """Return the bundled copy of a remote file.
+
+        Parameters
+        ----------
+        url : str
+            URL the file would be downloaded from.
+
+        Returns
+        -------
+        Path | None
+            The file, or None if it isn't in the bundle.
+        """
+        if (entry := self.manifest["files"].get(url)) is None:
+            return None
+        return self.root / entry["path"]
+
+    def repo(self, url: str) -> Path | None:
+        """Return the bundled bare mirror of a git repo.
+
+        Parameters
+        ----------
+        url : str
+            Upstream URL of the repo.
+
+        Returns
+        -------
+        Path | None
+            The mirror, or None if it isn't in the bundle.
+        """
+        if (entry := self.manifest["repos"].get(url)) is None:
+            return None
+        return self.root / entry["path"]
+
+    def debs(self, name: str) -> dict[str, Path] | None:
+        """Return the .deb files needed to install a package offline.
+
+        Parameters
+        ----------
+        name : str
+            Name of the package.
+
+        Returns
+        -------
+        dict[str, Path] | None
+            The package and each of its dependencies, mapped to their
+            .deb file, or None if the package isn't in the bundle.
+        """
+        if (closure := self.manifest["packages"].get(name)) is None:
+            return None
+        debs = self.manifest["debs"]
+        return {dep: self.root / debs[dep]["path"] for dep in closure if dep in debs}
+
+    def env(self, url: str) -> dict[str, str]:
+        """Return the environment a bundled installer script needs.
+
+        Parameters
+        ----------
+        url : str
+            URL of the installer script.
+
+        Returns
+        -------
+        dict[str, str]
+            Variables that point the installer at bundled repos instead
+            of upstream. Empty if it needs none.
+        """
+        if url not in REMOTES:
+            return {}
+        var, repo = REMOTES[url]
+        if (mirror := self.repo(repo)) is None:
+            return {}
+        return {var: mirror.as_uri()}
+
+
+def set_bundle(bundle: Bundle | None) -> None:
+    """Take artifacts from a bundle instead of the network.
+
+    Parameters
+    ----------
+    bundle : Bundle | None
+        The bundle to use, or None to go back to the network.
+    """
+    global _active
+    _active = bundle
+    return
+
+
+def active() -> Bundle | None:
+    """Return the bundle in use, if any."""
+    return _active
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,246 @@
+"""Build offline bundles, see bundle.py for the format."""
+
+import json
+import shlex
+import shutil
+import subprocess as sp
+import tarfile
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+from typing import Any
+from typing import Text
+
+from .bundle import FORMAT
+from .bundle import sha256
+from .downloads import DownloadCache
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import PASS
+from .mirrors import MirrorStore
+from .mirrors import _head
+from .utilities import run_one_command
+from .utilities import spawn
+
+# Dependency types left out when resolving packages. Bundles only carry
+# what a package can't work without, and packages are installed from a
+# bundle without their recommends.
+SKIP_DEPENDS = [
+    "--no-recommends",
+    "--no-suggests",
+    "--no-conflicts",
+    "--no-breaks",
+    "--no-replaces",
+    "--no-enhances",
+]
+
+
+def _closure(name: str) -> list[str] | None:
+    """List a package and everything it depends on, recursively.
+
+    Parameters
+    ----------
+    name : str
+        Name of the package.
+
+    Returns
+    -------
+    list[str] | None
+        Names of real (not virtual) packages, starting with the package
+        itself, or None if apt doesn't know it.
+    """
+    cmd = ["apt-cache", "depends", "--recurse", *SKIP_DEPENDS, name]
+    with tempfile.TemporaryFile(mode="w+") as f:
+        returncode = spawn(cmd, std_out=f, std_err=sp.DEVNULL)
+        f.seek(0)
+        output = f.read()
+    # Each package in the tree shows up once on a line of its own, with
+    # its dependencies indented below it. Virtual packages are <quoted>.
+    names = [
+        line.strip()
+        for line in output.splitlines()
+        if line and not line[0].isspace() and not line.startswith("<")
+    ]
+    if returncode != 0 or name not in names:
+        return None
+    return list(dict.fromkeys([name, *names]))
+
+
+class BundleBuilder:
+    """Gather artifacts into a staging directory and archive them.
+
+    The add_*() methods can run at the same time (e.g. as independent
+    steps), since each one fills in its own part of the manifest.
+    """
+
+    def __init__(self, staging: Path) -> None:
+        """Create a new BundleBuilder object.
+
+        Parameters
+        ----------
+        staging : Path
+            An empty directory to gather the artifacts in.
+        """
+        self.staging = staging
+        self.manifest: dict[str, Any] = {
+            "format": FORMAT,
+            "version": time.strftime("%Y%m%d-%H%M%S"),
+            "files": {},
+            "repos": {},
+            "packages": {},
+            "debs": {},
+        }
+        return
+
+    def add_files(self, urls: list[str]) -> Text:
+        """Download remote files into the bundle.
+
+        Files are fetched through the download cache, so anything
+        already cached is only revalidated.
+
+        Parameters
+        ----------
+        urls : list[str]
+            URLs of the files.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            for url in urls:
+                print(f"\nBundling: {url}")
+            return PASS
+        files = self.staging / "files"
+        files.mkdir(parents=True, exist_ok=True)
+        result = PASS
+        for url in urls:
+            if (path := DownloadCache().fetch(url)) is None:
+                result = FAIL
+                continue
+            digest = sha256(path)
+            shutil.copyfile(path, files / digest)
+            self.manifest["files"][url] = {
+                "path": f"files/{digest}",
+                "sha256": digest,
+                "size": path.stat().st_size,
+            }
+        return result
+
+    def add_repos(self, urls: list[str]) -> Text:
+        """Mirror git repos into the bundle.
+
+        Parameters
+        ----------
+        urls : list[str]
+            Upstream URLs of the repos.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            for url in urls:
+                print(f"\nBundling: {url}")
+            return PASS
+        store = MirrorStore(root=self.staging / "git", refresh=0, offline=False)
+        result = PASS
+        for url in urls:
+            if (path := store.mirror(url)) is None:
+                result = FAIL
+                continue
+            path.with_suffix(".lock").unlink(missing_ok=True)
+            self.manifest["repos"][url] = {
+                "path": str(path.relative_to(self.staging)),
+                "head": _head(path),
+            }
+        return result
+
+    def add_packages(self, names: list[str]) -> Text:
+        """Download apt packages, with their dependencies, into the bundle.
+
+        Packages are downloaded for the release and architecture of the
+        machine building the bundle, which should match the VMs it's
+        used on.
+
+        Parameters
+        ----------
+        names : list[str]
+            Names of the packages.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            print(f"\nBundling: {names}")
+            return PASS
+        debs = self.staging / "debs"
+        debs.mkdir(parents=True, exist_ok=True)
+        result = PASS
+        closures = {}
+        for name in dict.fromkeys(names):
+            if (closure := _closure(name)) is None:
+                result = FAIL
+            else:
+                closures[name] = closure
+        wanted = list(dict.fromkeys(dep for deps in closures.values() for dep in deps))
+        script = 'cd "$0" && exec apt-get download "$@"'
+        cmd = shlex.join(["sh", "-c", script, str(debs), *wanted])
+        # One download for the lot. If it fails, go one at a time so a
+        # single unavailable package doesn't sink the others.
+        if wanted and run_one_command(cmd) == FAIL:
+            for dep in wanted:
+                run_one_command(shlex.join(["sh", "-c", script, str(debs), dep]))
+        for deb in sorted(debs.glob("*.deb")):
+            # Files are named package_version_arch.deb.
+            package = urllib.parse.unquote(deb.name).split("_")[0]
+            self.manifest["debs"][package] = {
+                "path": f"debs/{deb.name}",
+                "sha256": sha256(deb),
+            }
+        for name, closure in closures.items():
+            if name not in self.manifest["debs"]:
+                result = FAIL
+                continue
+            self.manifest["packages"][name] = closure
+        return result
+
+    def write(self, dest: Path) -> Path:
+        """Write the manifest and archive the bundle.
+
+        Parameters
+        ----------
+        dest : Path
+            Directory to put the archive in.
+
+        Returns
+        -------
+        Path
+            The archive, named after the bundle version.
+        """
+        manifest = json.dumps(self.manifest, indent=1)
+        (self.staging / "manifest.json").write_text(manifest)
+        archive = dest / f"ubuntu-bundle-{self.manifest['version']}.tar"
+        if DEBUG:
+            print(f"\nWriting: {archive}")
+            return archive
+        part = archive.with_name(f".{archive.name}.part")
+        # Most of the bundle (packages, git packs) is already compressed,
+        # so the archive isn't.
+        with tarfile.open(part, "w") as tar:
+            for path in sorted(self.staging.iterdir()):
+                tar.add(path, arcname=path.name)
+        part.replace(archive)
+        return archive
+
+
+if __name__ == "__main__":
+    pass
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 """Support classes for ubuntu setup scripts."""
 
+import fnmatch
+import pathlib
 import sys
+from typing import Text
+
+from .environment import FAIL
+from .environment import PASS
 
 
 class ExhaustedListError(Exception):
@@ -140,5 +146,180 @@ class Labels:
         return
 
 
+class CopyReport:
+    """Outcome of a copy_files run."""
+
+    def __init__(self) -> None:
+        """Create a new, empty CopyReport object.
+
+        Files are sorted into three lists: copied (the destination was
+        new or different), skipped (the destination was already
+        identical, or the source is excluded), and failed.
+        """
+        self.copied: list[pathlib.Path] = []
+        self.skipped: list[pathlib.Path] = []
+        self.failed: list[pathlib.Path] = []
+        return
+
+    def result(self) -> Text:
+        """Summarize the report.
+
+        Returns
+        -------
+        Text
+            PASS if no file failed to copy, otherwise FAIL.
+        """
+        return FAIL if self.failed else PASS
+
+
+class PermissionRule:
+    """Mode and owner that entries in a tree should have."""
+
+    def __init__(
+        self,
+        pattern: str,
+        mode: int | None = None,
+        strip: int = 0,
+        owner: str | None = None,
+        dirs: bool = False,
+    ) -> None:
+        """Create a new PermissionRule object.
+
+        Parameters
+        ----------
+        pattern : str
+            Shell-style pattern matched against the entry's name, or
+            against its path relative to the root of the tree if the
+            pattern contains a '/'.
+        mode : int | None, optional
+            Permission bits the entry should have (e.g. 0o754), or None
+            to leave the mode alone, by default None.
+        strip : int, optional
+            Permission bits the entry should not have (e.g. 0o022, for
+            no group or world write). Applied after mode, by default 0.
+        owner : str | None, optional
+            Owner the entry should have, as 'user' or 'user:group', or
+            None to leave it alone, by default None.
+        dirs : bool, optional
+            Match directories instead of files, by default False.
+        """
+        self.pattern = pattern
+        self.mode = mode
+        self.strip = strip
+        self.owner = owner
+        self.dirs = dirs
+        return
+
+    def matches(self, name: str, relative: str, is_dir: bool) -> bool:
+        """Determine if the rule applies to an entry.
+
+        Parameters
+        ----------
+        name : str
+            Name of the entry.
+        relative : str
+            Path of the entry relative to the root of the tree.
+        is_dir : bool
+            True if the entry is a directory.
+
+        Returns
+        -------
+        bool
+            True if the rule applies.
+        """
+        if is_dir != self.dirs:
+            return False
+        target = relative if "/" in self.pattern else name
+        return fnmatch.fnmatchcase(target, self.pattern)
+
+    def wanted(self, mode: int) -> int:
+        """Work out the permission bits an entry should have.
+
+        Parameters
+        ----------
+        mode : int
+            The entry's current permission bits.
+
+        Returns
+        -------
+        int
+            The bits the rule calls for.
+        """
+        if self.mode is not None:
+            mode = self.mode
+        return mode & ~self.strip
+
+
+class PermissionReport:
+    """Outcome of a fix_permissions run."""
+
+    def __init__(self) -> None:
+        """Create a new, empty PermissionReport object.
+
+        Entries are sorted into two lists: changed (the mode or owner
+        was changed, or would be on a dry run) and failed. Entries that
+        were already correct are only counted.
+        """
+        self.changed: list[pathlib.Path] = []
+        self.failed: list[pathlib.Path] = []
+        self.checked = 0
+        return
+
+    def result(self) -> Text:
+        """Summarize the report.
+
+        Returns
+        -------
+        Text
+            PASS if no entry failed to change, otherwise FAIL.
+        """
+        return FAIL if self.failed else PASS
+
+
+class RecordingBackend:
+    """Fake process backend that records commands instead of running them.
+
+    Install it with utilities.set_backend(). Every command is appended
+    to the commands list and reported as successful, unless it starts
+    with one of the prefixes passed as failures.
+    """
+
+    def __init__(self, failures: list[str] | None = None, clones: bool = False) -> None:
+        """Create a new RecordingBackend object.
+
+        Parameters
+        ----------
+        failures : list[str] | None, optional
+            Command prefixes (e.g. "sudo snap") that should exit with 1,
+            by default None.
+        clones : bool, optional
+            Leave behind the (empty) directory a git clone would create,
+            for steps that go on to use it, by default False.
+        """
+        self.commands: list[list[str]] = []
+        self.failures = failures if failures else []
+        self.clones = clones
+        return
+
+    def __call__(self, args: list[str], **_: object) -> int:
+        """Record a command and return its pretend exit code.
+
+        Parameters
+        ----------
+        args : list[str]
+            The program and its arguments.
+
+        Returns
+        -------
+        int
+            1 if the command matches a failure prefix, otherwise 0.
+        """
+        self.commands.append(list(args))
+        if self.clones and args[:2] == ["git", "clone"]:
+            pathlib.Path(args[-1]).mkdir(parents=True, exist_ok=True)
+        line = " ".join(args)
+        return 1 if any(line.startswith(f) for f in self.failures) else 0
+
+
 if __name__ == "__main__":
     pass
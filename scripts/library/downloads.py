@@ -0,0 +1,283 @@
+"""Download cache for remote scripts and files."""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import tempfile as tf
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any
+from typing import Iterator
+
+from .environment import CACHE
+from .environment import CACHE_LIMIT
+from .environment import OFFLINE
+from .output import OUTPUT
+
+CHUNK = 64 * 1024
+
+
+class DownloadCache:
+    """Content-addressed, on-disk cache of remote files.
+
+    Files are stored once under objects/, named by the sha256 of their
+    content. An index maps each URL to its object, along with the
+    validators (ETag / Last-Modified) needed to revalidate it and the
+    time it was last used, which drives LRU eviction.
+    """
+
+    # Serializes index updates between threads of the same process.
+    # Other processes sharing the cache are kept out with flock.
+    _mutex = threading.Lock()
+
+    def __init__(
+        self,
+        root: Path = CACHE / "downloads",
+        max_bytes: int = CACHE_LIMIT,
+        offline: bool = OFFLINE,
+        timeout: float = 60,
+    ) -> None:
+        """Create a new DownloadCache object.
+
+        Parameters
+        ----------
+        root : Path, optional
+            Directory holding the cache, by default CACHE/downloads.
+        max_bytes : int, optional
+            Size cap for cached objects. Least recently used entries are
+            evicted once it's exceeded, by default CACHE_LIMIT.
+        offline : bool, optional
+            Serve only from the cache and never touch the network, by
+            default OFFLINE.
+        timeout : float, optional
+            Network timeout in seconds, by default 60.
+        """
+        self.root = root
+        self.objects = root / "objects"
+        self.index_file = root / "index.json"
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.timeout = timeout
+        return
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[dict[str, Any]]:
+        """Lock the cache and yield its index for reading or updating.
+
+        Yields
+        ------
+        dict[str, Any]
+            The URL index. Changes made to it are saved on exit.
+        """
+        self.objects.mkdir(parents=True, exist_ok=True)
+        with self._mutex, open(self.root / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.index_file, "r") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+            yield index
+            with tf.NamedTemporaryFile(mode="w", dir=self.root, delete=False) as out:
+                json.dump(index, out, indent=1)
+            os.replace(out.name, self.index_file)
+        return
+
+    def _lookup(self, index: dict[str, Any], url: str) -> Path | None:
+        """Return the cached object for a URL if it's still on disk."""
+        if (entry := index.get(url)) is None:
+            return None
+        path = self.objects / entry["sha256"]
+        return path if path.exists() else None
+
+    def fetch(self, url: str) -> Path | None:
+        """Return a local path holding the content of a URL.
+
+        A cached copy is revalidated with the server using a conditional
+        request, and only downloaded again if it has changed. If the
+        network is unavailable (or the cache is offline), a cached copy
+        is served as is, with a warning in the step's output. If the
+        server answers with an error (e.g. 404), nothing is served,
+        since the cached copy may be for something that's gone.
+
+        Parameters
+        ----------
+        url : str
+            The URL to fetch.
+
+        Returns
+        -------
+        Path | None
+            Path to the cached content, or None if the URL could not be
+            fetched and there is no usable cached copy. The file belongs
+            to the cache and must not be modified.
+        """
+        with self._locked() as index:
+            cached = self._lookup(index, url)
+            entry = dict(index.get(url, {}))
+            if cached and self.offline:
+                index[url]["used"] = time.time()
+        if self.offline:
+            return cached
+
+        request = urllib.request.Request(url)
+        if cached:
+            if etag := entry.get("etag"):
+                request.add_header("If-None-Match", etag)
+            if modified := entry.get("modified"):
+                request.add_header("If-Modified-Since", modified)
+
+        tmp = ""
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                digest = hashlib.sha256()
+                with tf.NamedTemporaryFile(dir=self.objects, delete=False) as f:
+                    tmp = f.name
+                    while chunk := r.read(CHUNK):
+                        digest.update(chunk)
+                        f.write(chunk)
+                entry = {
+                    "sha256": digest.hexdigest(),
+                    "size": os.path.getsize(tmp),
+                    "etag": r.headers.get("ETag"),
+                    "modified": r.headers.get("Last-Modified"),
+                }
+        except urllib.error.HTTPError as e:
+            if e.code != 304 or not cached:
+                OUTPUT.write(f"\nCould not download {url}: HTTP {e.code}\n".encode())
+                return None
+            # Not modified, so the cached copy is still good.
+            with self._locked() as index:
+                if url in index:
+                    index[url]["used"] = time.time()
+            return cached
+        except (OSError, ValueError) as e:
+            # Network trouble (or a bad URL). Fall back to what we have.
+            if tmp:
+                Path(tmp).unlink(missing_ok=True)
+            msg = f"\nCould not reach {url} ({e})"
+            msg += ", using the cached copy\n" if cached else "\n"
+            OUTPUT.write(msg.encode())
+            return cached
+
+        return self._adopt(url, Path(tmp), entry)
+
+    def _adopt(self, url: str, tmp: Path, entry: dict[str, Any]) -> Path:
+        """Move a downloaded file into the store and index it under url."""
+        path = self.objects / entry["sha256"]
+        with self._locked() as index:
+            if path.exists():
+                os.unlink(tmp)
+            else:
+                os.replace(tmp, path)
+            index[url] = {**entry, "used": time.time()}
+            self._evict(index, keep=url)
+        return path
+
+    def lookup(self, url: str) -> tuple[Path | None, dict[str, Any]]:
+        """Find the cached copy of a URL, for callers that download it.
+
+        Parameters
+        ----------
+        url : str
+            The URL.
+
+        Returns
+        -------
+        tuple[Path | None, dict[str, Any]]
+            The cached content (or None if there isn't any) and its
+            index entry, which holds its ETag and Last-Modified.
+        """
+        with self._locked() as index:
+            if (cached := self._lookup(index, url)) is not None:
+                index[url]["used"] = time.time()
+            return cached, dict(index.get(url, {}))
+
+    def partial(self, url: str) -> Path:
+        """Return where an interrupted download of a URL is kept.
+
+        Parameters
+        ----------
+        url : str
+            The URL.
+
+        Returns
+        -------
+        Path
+            A file in the cache, which is on the same filesystem as the
+            store, so store() can move it in place.
+        """
+        folder = self.root / "partial"
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder / hashlib.sha256(url.encode()).hexdigest()
+
+    def store(
+        self,
+        url: str,
+        file: Path,
+        etag: str | None = None,
+        modified: str | None = None,
+    ) -> Path:
+        """Add a file downloaded by the caller to the cache.
+
+        Parameters
+        ----------
+        url : str
+            The URL it was downloaded from.
+        file : Path
+            The file. It is moved into the store.
+        etag : str | None, optional
+            The response's ETag, by default None.
+        modified : str | None, optional
+            The response's Last-Modified, by default None.
+
+        Returns
+        -------
+        Path
+            Path to the cached content.
+        """
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            while chunk := f.read(CHUNK):
+                digest.update(chunk)
+        entry = {
+            "sha256": digest.hexdigest(),
+            "size": file.stat().st_size,
+            "etag": etag,
+            "modified": modified,
+        }
+        return self._adopt(url, file, entry)
+
+    def _evict(self, index: dict[str, Any], keep: str) -> None:
+        """Drop least recently used entries until under the size cap.
+
+        Parameters
+        ----------
+        index : dict[str, Any]
+            The URL index, already locked by the caller.
+        keep : str
+            URL that must survive eviction (the one just fetched).
+        """
+        sizes = {e["sha256"]: e["size"] for e in index.values()}
+        total = sum(sizes.values())
+        for url in sorted(index, key=lambda u: index[u]["used"]):
+            if total <= self.max_bytes:
+                break
+            if url == keep:
+                continue
+            sha = index.pop(url)["sha256"]
+            # Objects are shared by identical content, so only delete
+            # one when no other URL still points at it.
+            if all(e["sha256"] != sha for e in index.values()):
+                (self.objects / sha).unlink(missing_ok=True)
+                total -= sizes[sha]
+        return
+
+
+if __name__ == "__main__":
+    pass
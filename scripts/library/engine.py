@@ -0,0 +1,372 @@
+"""Asynchronous command execution with timeouts and cancellation.
+
+These are the asyncio counterparts of run_one_command,
+run_many_arguments and run_shell_script in utilities, with the same
+PASS/FAIL contract. Every command runs in its own process group, so
+when it times out or its task is cancelled, everything it started is
+stopped along with it. Sudo commands go through the privileged helper
+when there is one, and it does the stopping for them.
+"""
+
+import asyncio
+import contextlib
+import os
+import shlex
+import signal
+import subprocess as sp
+import threading
+import time
+from typing import Any
+from typing import AsyncIterator
+from typing import Callable
+from typing import Text
+
+from . import utilities
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import PASS
+from .environment import WORKERS
+from .output import OUTPUT
+from .trace import TRACER
+
+CHUNK = 64 * 1024
+
+# Seconds a process group gets to exit after SIGTERM, before SIGKILL.
+GRACE = 5
+
+
+def _forward(loop: asyncio.AbstractEventLoop) -> Callable[[bytes], None]:
+    """Return a sink that writes to OUTPUT from the event loop's thread.
+
+    OUTPUT keeps one log per thread, and a step's log belongs to the
+    thread running its event loop, so output produced in a worker
+    thread has to be written from there.
+    """
+
+    def write(chunk: bytes) -> None:
+        loop.call_soon_threadsafe(OUTPUT.write, chunk)
+
+    return write
+
+
+async def _to_thread(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a function in a worker thread, keeping what it writes to OUTPUT.
+
+    Like asyncio.to_thread, except that the function's OUTPUT writes
+    still end up in the current step's log.
+    """
+    sink = _forward(asyncio.get_running_loop())
+
+    def call() -> Any:
+        with OUTPUT.tee(sink):
+            return func(*args)
+
+    return await asyncio.to_thread(call)
+
+
+def _signal_group(proc: asyncio.subprocess.Process, sig: int) -> None:
+    """Send a signal to a process group, if it's still around.
+
+    A group led by sudo can be left holding only root processes, which
+    we aren't allowed to signal. Then the signal goes to sudo itself,
+    which passes it on to its command.
+    """
+    try:
+        os.killpg(proc.pid, sig)
+    except ProcessLookupError:
+        pass
+    except PermissionError:
+        with contextlib.suppress(ProcessLookupError):
+            proc.send_signal(sig)
+    return
+
+
+async def terminate(proc: asyncio.subprocess.Process, grace: float = GRACE) -> None:
+    """Stop a process and every process it started.
+
+    Parameters
+    ----------
+    proc : asyncio.subprocess.Process
+        A process started as the leader of its own process group.
+    grace : float, optional
+        Seconds to wait after SIGTERM before sending SIGKILL, by default
+        GRACE.
+    """
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), grace)
+    except TimeoutError:
+        pass
+    # Clean up the leader if it ignored SIGTERM, and any stragglers
+    # left in the group after it exited.
+    _signal_group(proc, signal.SIGKILL)
+    await proc.wait()
+    return
+
+
+class CommandEngine:
+    """Run commands from asyncio code.
+
+    The number of commands running at the same time is capped, and
+    each command can be given a deadline. Commands that miss their
+    deadline, or whose task is cancelled (e.g. by a step timeout), are
+    terminated together with their children.
+    """
+
+    def __init__(self, limit: int = WORKERS, timeout: float | None = None) -> None:
+        """Create a new CommandEngine object.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Maximum number of commands running at once, by default
+            WORKERS.
+        timeout : float | None, optional
+            Default deadline for each command in seconds, or None for no
+            deadline, by default None.
+        """
+        self.limit = max(1, limit)
+        self.timeout = timeout
+        # Each worker thread of the step runner has its own event loop,
+        # so the limit is kept by a thread semaphore shared by all of
+        # them rather than an asyncio one.
+        self._slots = threading.BoundedSemaphore(self.limit)
+        return
+
+    @contextlib.asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Hold one of the engine's slots, waiting for it if need be."""
+        acquired = asyncio.get_running_loop().run_in_executor(
+            None, self._slots.acquire
+        )
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # The wait goes on in its thread. Hand the slot back as soon
+            # as it's been taken.
+            acquired.add_done_callback(lambda _: self._slots.release())
+            raise
+        try:
+            yield
+        finally:
+            self._slots.release()
+        return
+
+    async def _helper_spawn(self, args: list[str], capture: bool) -> int | None:
+        """Run a sudo command through the privileged helper.
+
+        Returns
+        -------
+        int | None
+            The exit code, or None if the helper has gone away.
+        """
+        assert utilities._helper is not None
+        helper = utilities._helper
+        if capture:
+            sink = _forward(asyncio.get_running_loop())
+        else:
+            sink = utilities._sink(None, None)
+        stop = threading.Event()
+        done = asyncio.ensure_future(
+            asyncio.to_thread(helper.run_stream, args[1:], sink, stop)
+        )
+        try:
+            return await asyncio.shield(done)
+        except OSError:
+            return None
+        finally:
+            if not done.done():
+                # We can't signal root processes, so the helper stops
+                # the command, and we wait for it to go.
+                stop.set()
+                with contextlib.suppress(OSError):
+                    await done
+
+    async def spawn(
+        self,
+        args: list[str],
+        capture: bool = True,
+        timeout: float | None = None,
+    ) -> int:
+        """Run a process to completion.
+
+        Parameters
+        ----------
+        args : list[str]
+            The program and its arguments.
+        capture : bool, optional
+            Stream output into the current step's OUTPUT log (True) or
+            let it go to the terminal (False), by default True.
+        timeout : float | None, optional
+            Deadline in seconds, by default the engine's timeout.
+
+        Returns
+        -------
+        int
+            The exit code of the process.
+
+        Raises
+        ------
+        TimeoutError
+            If the process missed its deadline. It has been terminated.
+        """
+        if utilities._backend is not None:
+            std_out = sp.DEVNULL if capture else None
+            return utilities.spawn(args, std_out=std_out, std_err=std_out)
+        timeout = self.timeout if timeout is None else timeout
+        async with self._slot():
+            start = time.perf_counter()
+            if utilities._privileged(args) and utilities._helper is not None:
+                try:
+                    async with asyncio.timeout(timeout):
+                        returncode = await self._helper_spawn(args, capture)
+                except TimeoutError:
+                    TRACER.command(shlex.join(args), start, None)
+                    raise
+                if returncode is not None:
+                    TRACER.command(shlex.join(args), start, None)
+                    return returncode
+                # The helper has gone away. Fall back to sudo.
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE if capture else None,
+                stderr=sp.STDOUT if capture else None,
+                process_group=0,
+            )
+            try:
+                async with asyncio.timeout(timeout):
+                    if proc.stdout is not None:
+                        while chunk := await proc.stdout.read(CHUNK):
+                            OUTPUT.write(chunk)
+                    return await proc.wait()
+            finally:
+                if proc.returncode is None:
+                    await terminate(proc)
+                TRACER.command(shlex.join(args), start, None)
+
+    async def run_one_command(
+        self,
+        cmd: str,
+        capture: bool = True,
+        timeout: float | None = None,
+    ) -> Text:
+        """Run a single command.
+
+        Parameters
+        ----------
+        cmd : str
+            A shell command (with potentially options) saved as a Python
+            string.
+        capture : bool, optional
+            Determine if output should be captured (True) or displayed
+            (False), by default True.
+        timeout : float | None, optional
+            Deadline in seconds, by default the engine's timeout.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL). A command that times
+            out is a FAIL.
+        """
+        if DEBUG:
+            print(f"\nRunning: {shlex.split(cmd)}")
+            return PASS
+        try:
+            returncode = await self.spawn(shlex.split(cmd), capture, timeout)
+        except TimeoutError:
+            OUTPUT.write(f"\nTimed out: {cmd}\n".encode())
+            return FAIL
+        return PASS if returncode == 0 else FAIL
+
+    async def run_many_arguments(
+        self,
+        cmd: str,
+        targets: list[str],
+        marker: str = "TARGET",
+        timeout: float | None = None,
+    ) -> Text:
+        """Run the same command with multiple arguments, one at a time.
+
+        Parameters
+        ----------
+        cmd : str
+            A shell command (with potentially options) saved as a Python
+            string.
+        targets : list[str]
+            The different arguments to be used on multiple runs of the
+            command.
+        marker : str, optional
+            Replacement marker in the command string, by default
+            'TARGET'.
+        timeout : float | None, optional
+            Deadline in seconds for each run, by default the engine's
+            timeout.
+
+        Returns
+        -------
+        Text
+            PASS, or FAIL as soon as one run fails.
+        """
+        result = PASS
+        for target in targets:
+            cmd_target = cmd.replace(marker, target)
+            result = await self.run_one_command(cmd_target, timeout=timeout)
+            if result == FAIL:
+                return result
+        return result
+
+    async def run_shell_script(
+        self,
+        script: str,
+        shell: str = "bash",
+        as_sudo: bool = False,
+        capture: bool = True,
+        options: str = "",
+        timeout: float | None = None,
+    ) -> Text:
+        """Run a remote shell script, fetched like run_shell_script does.
+
+        Parameters
+        ----------
+        script : str
+            URL of the remote script.
+        shell : str, optional
+            Shell to run (e.g. bash, sh, etc.), by default 'bash'.
+        as_sudo : bool, optional
+            Run the script as sudo, by default False.
+        capture : bool, optional
+            Capture output or not, by default True.
+        options : str, optional
+            Any additional options to be passed to the shell script.
+        timeout : float | None, optional
+            Deadline in seconds for running the script, by default the
+            engine's timeout.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            print(f"\nFetching: {script}")
+            return PASS
+        # Fetching reports its errors (e.g. a 404) to OUTPUT.
+        cmd = await _to_thread(
+            utilities._script_command, script, shell, as_sudo, options
+        )
+        if cmd is None:
+            return FAIL
+        return await self.run_one_command(cmd, capture=capture, timeout=timeout)
+
+
+# Shared by the scripts. The limit applies to the commands of every step
+# together, though each async step runs in its own event loop.
+ENGINE = CommandEngine()
+
+
+if __name__ == "__main__":
+    pass
@@ -4,6 +4,7 @@ All the paths, debugging flags, and pass/fail glyphs are created and
 initialized here.
 """
 
+import os
 from pathlib import Path
 
 # Minimum required python version for Ubuntu VM scripts.
@@ -18,6 +19,9 @@ PASS = f"{GREEN}\u2714{COLOR_END}"
 FAIL = f"{RED}\u2718{COLOR_END}"
 DEBUG = False
 
+# Maximum number of independent steps that may run at the same time.
+WORKERS = 4
+
 # Paths in the repo for installation files. Note: Ubuntu is resolved in
 # relation to this file (classes.py) to facilitate debugging. The repo
 # should still be cloned in ~ per the setup instructions.
@@ -28,3 +32,40 @@ SCRIPTS = UBUNTU / "scripts"
 SHELL = UBUNTU / "shell"
 SYSTEM = UBUNTU / "system"
 VIM = UBUNTU / "vim"
+
+# Root of the filesystem that system configuration files are patched
+# under. Point UBUNTU_ROOT at a scratch tree to try changes safely.
+ROOT = Path(os.environ.get("UBUNTU_ROOT", "/"))
+
+# dpkg database of installed packages, used to skip no-op apt installs.
+DPKG_STATUS = Path("/var/lib/dpkg/status")
+
+# Local cache for downloaded artifacts. Point UBUNTU_CACHE at a shared
+# mount to let several VMs reuse the same downloads. With UBUNTU_OFFLINE
+# set to 1, remote files are served only from the cache.
+CACHE = Path(os.environ.get("UBUNTU_CACHE", HOME / ".cache/ubuntu"))
+CACHE_LIMIT = 512 * 1024 * 1024
+OFFLINE = os.environ.get("UBUNTU_OFFLINE", "0") == "1"
+
+# Bytes of output kept per step, and the number of its last lines shown
+# when the step fails. With UBUNTU_LOGS set to 1, the full output of
+# every step is also saved, compressed, under CACHE/logs.
+OUTPUT_TAIL = 8 * 1024
+OUTPUT_LINES = 20
+KEEP_LOGS = os.environ.get("UBUNTU_LOGS", "0") == "1"
+
+# With UBUNTU_EVENTS set to 1, the step runner also prints a line of
+# JSON for each step outcome, prefixed with EVENT, for tools (like the
+# fleet driver) that run the scripts and follow their progress.
+EVENTS = os.environ.get("UBUNTU_EVENTS", "0") == "1"
+EVENT = "@ubuntu-step "
+
+# With UBUNTU_FAKE set to 1, commands are recorded by a stand-in rather
+# than run, so a script can be driven end to end (e.g. by the fleet
+# driver's local hosts) without changing the machine. Combine it with
+# UBUNTU_ROOT and HOME pointing at scratch directories.
+FAKE = os.environ.get("UBUNTU_FAKE", "0") == "1"
+
+# Git mirrors in the cache are refreshed from upstream at most this
+# often (in seconds).
+MIRROR_REFRESH = 3600
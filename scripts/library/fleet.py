@@ -0,0 +1,417 @@
+"""Run a setup script on many hosts at once.
+
+Each host runs the script itself, with UBUNTU_EVENTS set, so its step
+outcomes can be followed as they happen. How the script is started on
+a host is up to a transport: over ssh for real hosts, or as a local
+process in a scratch directory, with its commands faked, for testing.
+"""
+
+import asyncio
+import json
+import shlex
+import subprocess as sp
+import sys
+from pathlib import Path
+from typing import Any
+from typing import Text
+
+from .artifacts import OHMYZSH_INSTALLER
+from .downloads import DownloadCache
+from .engine import terminate
+from .environment import CACHE
+from .environment import EVENT
+from .environment import FAIL
+from .environment import OUTPUT_LINES
+from .environment import PASS
+from .environment import SCRIPTS
+from .output import TailBuffer
+
+# Hosts configured at the same time, unless told otherwise.
+JOBS = 10
+
+# What the server scripts download. Local stand-in hosts run offline,
+# from a cache that's filled with these once.
+DOWNLOADS = [OHMYZSH_INSTALLER]
+
+# Longest line of output read from a host, in bytes.
+LINE_LIMIT = 1024 * 1024
+
+
+def load_inventory(path: Path) -> list[str]:
+    """Read the hosts to configure.
+
+    Parameters
+    ----------
+    path : Path
+        A text file with one host per line, as [user@]host[:port].
+        Blank lines and anything after a '#' are ignored.
+
+    Returns
+    -------
+    list[str]
+        The hosts, in order, without duplicates.
+    """
+    hosts = []
+    for line in path.read_text().splitlines():
+        if host := line.split("#", 1)[0].strip():
+            hosts.append(host)
+    return list(dict.fromkeys(hosts))
+
+
+class Transport:
+    """How a script is started on a host.
+
+    Subclasses turn a script invocation into a local command line.
+    """
+
+    def command(self, host: str, script: str, args: list[str]) -> list[str]:
+        """Build the command that runs a script on a host.
+
+        Parameters
+        ----------
+        host : str
+            The host, as given in the inventory.
+        script : str
+            Name of the script, e.g. server_configure.
+        args : list[str]
+            Arguments for the script.
+
+        Returns
+        -------
+        list[str]
+            The program to run locally, and its arguments.
+        """
+        raise NotImplementedError
+
+
+class SshTransport(Transport):
+    """Run scripts on real hosts over ssh.
+
+    The repo is expected to be cloned on each host already. Since there
+    is no one to type a password, ssh runs in batch mode (so keys must
+    be set up), and sudo on the host must not ask for one either, which
+    server_initialize.py takes care of.
+    """
+
+    def __init__(self, repo: str = "ubuntu", options: list[str] | None = None) -> None:
+        """Create a new SshTransport object.
+
+        Parameters
+        ----------
+        repo : str, optional
+            Where the repo is cloned on each host, relative to the home
+            directory of the ssh user, by default 'ubuntu'.
+        options : list[str] | None, optional
+            Extra ssh options, by default None.
+        """
+        self.repo = repo
+        self.options = options if options else []
+        return
+
+    def command(self, host: str, script: str, args: list[str]) -> list[str]:
+        target, _, port = host.partition(":")
+        remote = ["env", "UBUNTU_EVENTS=1", "python3"]
+        remote += [f"{self.repo}/scripts/{script}.py", *args]
+        cmd = ["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=10"]
+        if port:
+            cmd += ["-p", port]
+        return [*cmd, *self.options, target, "--", shlex.join(remote)]
+
+
+class LocalTransport(Transport):
+    """Run scripts as local processes, one scratch directory per host.
+
+    Each stand-in host gets its own home, cache and root directory
+    under the given root, so runs can be tested without any servers.
+    Commands are recorded rather than run (see UBUNTU_FAKE), so nothing
+    like useradd or apt ever reaches the machine running the fleet.
+    Hosts also run offline (see UBUNTU_OFFLINE), sharing one download
+    cache that seed() fills, so the network is used once per file
+    rather than once per host.
+    """
+
+    def __init__(self, root: Path, scripts: Path = SCRIPTS) -> None:
+        """Create a new LocalTransport object.
+
+        Parameters
+        ----------
+        root : Path
+            Directory holding a subdirectory for each host.
+        scripts : Path, optional
+            Directory the scripts are run from, by default SCRIPTS.
+        """
+        self.root = root
+        self.scripts = scripts
+        self.downloads = root / ".downloads"
+        return
+
+    def seed(self, urls: list[str] = DOWNLOADS) -> list[str]:
+        """Fill the download cache shared by the stand-in hosts.
+
+        Parameters
+        ----------
+        urls : list[str], optional
+            What the hosts will download, by default DOWNLOADS.
+
+        Returns
+        -------
+        list[str]
+            The URLs that could not be fetched.
+        """
+        cache = DownloadCache(root=self.downloads)
+        return [url for url in urls if cache.fetch(url) is None]
+
+    def command(self, host: str, script: str, args: list[str]) -> list[str]:
+        home = self.root / host.replace("/", "_")
+        cache = home / ".cache/ubuntu"
+        cache.mkdir(parents=True, exist_ok=True)
+        if not (cache / "downloads").is_symlink():
+            (cache / "downloads").symlink_to(self.downloads.resolve())
+        env = [
+            f"HOME={home}",
+            f"UBUNTU_CACHE={cache}",
+            f"UBUNTU_ROOT={home}",
+            "UBUNTU_EVENTS=1",
+            "UBUNTU_FAKE=1",
+            "UBUNTU_OFFLINE=1",
+        ]
+        return ["env", *env, sys.executable, str(self.scripts / f"{script}.py"), *args]
+
+
+class HostResult:
+    """What happened when a script ran on one host."""
+
+    def __init__(self, host: str) -> None:
+        """Create a new HostResult object.
+
+        Parameters
+        ----------
+        host : str
+            The host.
+        """
+        self.host = host
+        self.steps: dict[str, Text] = {}
+        self.returncode: int | None = None
+        self.output = TailBuffer()
+        return
+
+    def result(self) -> Text:
+        """Summarize the run.
+
+        Returns
+        -------
+        Text
+            PASS if the script exited cleanly and no step failed,
+            otherwise FAIL.
+        """
+        if self.returncode != 0 or FAIL in self.steps.values():
+            return FAIL
+        return PASS
+
+
+class Fleet:
+    """Run a script on many hosts, a bounded number at a time."""
+
+    def __init__(
+        self,
+        transport: Transport,
+        jobs: int = JOBS,
+        timeout: float | None = None,
+    ) -> None:
+        """Create a new Fleet object.
+
+        Parameters
+        ----------
+        transport : Transport
+            How the script is started on each host.
+        jobs : int, optional
+            Maximum number of hosts running at once, by default JOBS.
+        timeout : float | None, optional
+            Seconds a host gets to finish before it's stopped and marked
+            FAIL, or None for no limit, by default None.
+        """
+        self.transport = transport
+        self.jobs = max(1, jobs)
+        self.timeout = timeout
+        self.pad = 0
+        return
+
+    def _progress(self, host: str, label: str, result: Text) -> None:
+        """Print one line of progress for a host."""
+        print(f"{host:.<{self.pad}}{label} {result}", flush=True)
+        return
+
+    async def _run_host(
+        self,
+        host: str,
+        script: str,
+        args: list[str],
+        slots: asyncio.Semaphore,
+    ) -> HostResult:
+        """Run the script on one host, following its step events."""
+        outcome = HostResult(host)
+        async with slots:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *self.transport.command(host, script, args),
+                    stdin=sp.DEVNULL,
+                    stdout=sp.PIPE,
+                    stderr=sp.STDOUT,
+                    process_group=0,
+                    limit=LINE_LIMIT,
+                )
+            except OSError as e:
+                outcome.output.write(f"{e}\n".encode())
+                outcome.returncode = -1
+                self._progress(host, "Could not start", FAIL)
+                return outcome
+            try:
+                async with asyncio.timeout(self.timeout):
+                    while proc.stdout and (line := await proc.stdout.readline()):
+                        text = line.decode(errors="replace")
+                        if not text.startswith(EVENT):
+                            outcome.output.write(line)
+                            continue
+                        try:
+                            event = json.loads(text.removeprefix(EVENT))
+                        except ValueError:
+                            continue
+                        result = PASS if event["ok"] else FAIL
+                        outcome.steps[event["label"]] = result
+                        self._progress(host, event["label"], result)
+                    outcome.returncode = await proc.wait()
+            except TimeoutError:
+                outcome.output.write(f"\nTimed out after {self.timeout}s\n".encode())
+            finally:
+                if proc.returncode is None:
+                    await terminate(proc)
+        self._progress(host, "Finished", outcome.result())
+        return outcome
+
+    async def _run(
+        self, hosts: list[str], script: str, args: list[str]
+    ) -> dict[str, HostResult]:
+        """Run the script on every host."""
+        slots = asyncio.Semaphore(self.jobs)
+        tasks = [self._run_host(host, script, args, slots) for host in hosts]
+        return {outcome.host: outcome for outcome in await asyncio.gather(*tasks)}
+
+    def run(
+        self, hosts: list[str], script: str, args: list[str]
+    ) -> dict[str, HostResult]:
+        """Run a script on every host, printing progress as steps finish.
+
+        Parameters
+        ----------
+        hosts : list[str]
+            The hosts to configure.
+        script : str
+            Name of the script, e.g. server_configure.
+        args : list[str]
+            Arguments for the script.
+
+        Returns
+        -------
+        dict[str, HostResult]
+            The outcome on each host, in the order given.
+        """
+        if not hosts:
+            return {}
+        self.pad = len(max(hosts, key=len)) + 3
+        return asyncio.run(self._run(hosts, script, args))
+
+
+def print_matrix(results: dict[str, HostResult]) -> None:
+    """Print a host by step grid of outcomes, then any failed output.
+
+    Steps are shown as numbered columns, with a key below the grid. A
+    '-' means the step never reported (e.g. the host was unreachable).
+
+    Parameters
+    ----------
+    results : dict[str, HostResult]
+        The outcome on each host, from Fleet.run().
+    """
+    if not results:
+        return
+    steps = list(dict.fromkeys(s for r in results.values() for s in r.steps))
+    pad = len(max(results, key=len)) + 3
+    width = len(str(len(steps))) + 1
+    header = "".join(f"{i:>{width}}" for i in range(1, len(steps) + 1))
+    print(f"\n{'Host':<{pad}}{header}{'All':>5}")
+    for host, outcome in results.items():
+        cells = "".join(
+            " " * (width - 1) + outcome.steps.get(step, "-") for step in steps
+        )
+        print(f"{host:.<{pad}}{cells}    {outcome.result()}")
+    print()
+    for i, step in enumerate(steps, start=1):
+        print(f"{i:>{width}}: {step}")
+    for host, outcome in results.items():
+        if outcome.result() == FAIL and (tail := outcome.output.text().strip()):
+            lines = tail.splitlines()[-OUTPUT_LINES:]
+            print(f"\nOutput from: {host}\n")
+            for line in lines:
+                print(f"    {line}")
+    return
+
+
+class FleetState:
+    """Outcome of the last fleet run of each script, per host.
+
+    Used to retry only the hosts that failed.
+    """
+
+    def __init__(self, script: str, root: Path = CACHE / "fleet") -> None:
+        """Create a new FleetState object.
+
+        Parameters
+        ----------
+        script : str
+            Name of the script. Each script has its own file,
+            root/<script>.json.
+        root : Path, optional
+            Directory holding the state files, by default CACHE/fleet.
+        """
+        self.path = root / f"{script}.json"
+        try:
+            self.hosts: dict[str, Any] = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.hosts = {}
+        return
+
+    def failed(self, hosts: list[str]) -> list[str]:
+        """Pick out the hosts that didn't pass last time.
+
+        Parameters
+        ----------
+        hosts : list[str]
+            Hosts from the inventory.
+
+        Returns
+        -------
+        list[str]
+            Hosts that failed, or have never been run, in order.
+        """
+        return [host for host in hosts if not self.hosts.get(host, {}).get("ok")]
+
+    def save(self, results: dict[str, HostResult]) -> None:
+        """Record the outcome of a run, keeping other hosts as they were.
+
+        Parameters
+        ----------
+        results : dict[str, HostResult]
+            The outcome on each host that ran.
+        """
+        for host, outcome in results.items():
+            self.hosts[host] = {
+                "ok": outcome.result() == PASS,
+                "steps": {step: r == PASS for step, r in outcome.steps.items()},
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.hosts, indent=1))
+        return
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,146 @@
+"""Persistent record of the steps run by ubuntu scripts."""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from .environment import CACHE
+
+
+def digest_inputs(label: str, inputs: list[str | Path]) -> str:
+    """Compute a hash of everything a step depends on.
+
+    Parameters
+    ----------
+    label : str
+        The step label, so steps with no declared inputs still get a
+        stable, distinct hash.
+    inputs : list[str | Path]
+        Strings are hashed as given. Paths are hashed by content, or
+        recorded as missing if they don't exist. A path with a '*' in
+        its name is expanded as a glob, the same way copy_files does.
+
+    Returns
+    -------
+    str
+        A sha256 hex digest.
+    """
+    digest = hashlib.sha256(label.encode())
+    for item in inputs:
+        if not isinstance(item, Path):
+            digest.update(f"\0str:{item}".encode())
+            continue
+        if "*" in item.name:
+            files = sorted(item.parent.resolve().glob(item.name))
+        else:
+            files = [item]
+        for file in files:
+            digest.update(f"\0path:{file}".encode())
+            try:
+                digest.update(file.read_bytes())
+            except OSError:
+                digest.update(b"\0missing")
+    return digest.hexdigest()
+
+
+class Journal:
+    """Append-only JSON-lines journal of step outcomes."""
+
+    def __init__(self, name: str, root: Path = CACHE / "journal") -> None:
+        """Create a new Journal object.
+
+        Parameters
+        ----------
+        name : str
+            Name of the script the journal belongs to. Each script has
+            its own file, root/<name>.jsonl.
+        root : Path, optional
+            Directory holding journals, by default CACHE/journal.
+        """
+        self.path = root / f"{name}.jsonl"
+        self.latest: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # A torn write from an interrupted run
+                    self.latest[entry["label"]] = entry
+        except OSError:
+            pass
+        return
+
+    def is_done(self, label: str, inputs: str) -> bool:
+        """Determine if a step already passed with the same inputs.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+        inputs : str
+            Digest of the step's current inputs.
+
+        Returns
+        -------
+        bool
+            True if the most recent run of the step passed and its
+            inputs have not changed since.
+        """
+        entry = self.latest.get(label)
+        return bool(entry and entry["ok"] and entry["inputs"] == inputs)
+
+    def passed_within(self, label: str, seconds: float) -> bool:
+        """Determine if a step passed recently, whatever its inputs.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+        seconds : float
+            How recent the pass has to be.
+
+        Returns
+        -------
+        bool
+            True if the most recent run of the step passed less than
+            the given number of seconds ago.
+        """
+        entry = self.latest.get(label)
+        return bool(entry and entry["ok"] and time.time() - entry["time"] < seconds)
+
+    def record(self, label: str, inputs: str, ok: bool, duration: float) -> None:
+        """Append the outcome of a step to the journal.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+        inputs : str
+            Digest of the step's inputs.
+        ok : bool
+            True if the step passed.
+        duration : float
+            Wall time of the step, in seconds.
+        """
+        entry = {
+            "label": label,
+            "inputs": inputs,
+            "ok": ok,
+            "duration": round(duration, 3),
+            "time": time.time(),
+        }
+        with self._lock:
+            self.latest[label] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(f"{json.dumps(entry)}\n")
+        return
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,206 @@
+"""Local git mirror store for repos cloned by ubuntu scripts."""
+
+import fcntl
+import hashlib
+import shlex
+import time
+from pathlib import Path
+from typing import Text
+
+from .bundle import active
+from .environment import CACHE
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import MIRROR_REFRESH
+from .environment import OFFLINE
+from .environment import PASS
+from .utilities import run_one_command
+
+
+def _head(git_dir: Path) -> str | None:
+    """Resolve HEAD of a repository without running git.
+
+    Parameters
+    ----------
+    git_dir : Path
+        The .git directory of a checkout, or a bare repo.
+
+    Returns
+    -------
+    str | None
+        The commit HEAD points at, or None if it can't be resolved.
+    """
+    try:
+        head = (git_dir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head.removeprefix("ref: ")
+        if (loose := git_dir / ref).exists():
+            return loose.read_text().strip()
+        for line in (git_dir / "packed-refs").read_text().splitlines():
+            if line.endswith(f" {ref}"):
+                return line.split()[0]
+    except OSError:
+        pass
+    return None
+
+
+class MirrorStore:
+    """Bare git mirrors that local checkouts are cloned from.
+
+    Each upstream repo is mirrored once into the store. Checkouts are
+    then cloned from the mirror, so upstream is contacted only when a
+    mirror is created or refreshed, no matter how many checkouts (or
+    VMs sharing the store) there are.
+    """
+
+    def __init__(
+        self,
+        root: Path = CACHE / "git",
+        refresh: float = MIRROR_REFRESH,
+        offline: bool = OFFLINE,
+    ) -> None:
+        """Create a new MirrorStore object.
+
+        Parameters
+        ----------
+        root : Path, optional
+            Directory holding the mirrors, by default CACHE/git.
+        refresh : float, optional
+            Minimum number of seconds between fetches of a mirror from
+            upstream, by default MIRROR_REFRESH.
+        offline : bool, optional
+            Never contact upstream; use mirrors as they are, by default
+            OFFLINE.
+        """
+        self.root = root
+        self.refresh = refresh
+        self.offline = offline
+        return
+
+    def path(self, url: str) -> Path:
+        """Return where the mirror of a URL lives.
+
+        Parameters
+        ----------
+        url : str
+            Upstream URL of the repo.
+
+        Returns
+        -------
+        Path
+            Path of the bare mirror. The name has a hash of the URL so
+            repos with the same basename don't collide.
+        """
+        name = url.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+        tag = hashlib.sha256(url.encode()).hexdigest()[:12]
+        return self.root / f"{name}-{tag}.git"
+
+    def mirror(self, url: str) -> Path | None:
+        """Create or refresh the mirror of a URL.
+
+        The mirror is locked while it is being updated, so concurrent
+        runs sharing the store don't fetch the same repo twice. With a
+        bundle active, its mirror is used as is.
+
+        Parameters
+        ----------
+        url : str
+            Upstream URL of the repo.
+
+        Returns
+        -------
+        Path | None
+            Path of the mirror, or None if there is no usable mirror.
+        """
+        if (bundle := active()) is not None:
+            return bundle.repo(url)
+        path = self.path(url)
+        stamp = path / "ubuntu-refreshed"
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                if self.offline:
+                    return None
+                cmd = f"git clone --quiet --mirror {url} {shlex.quote(str(path))}"
+                if run_one_command(cmd=cmd) == FAIL:
+                    return None
+                stamp.touch()
+            elif not self.offline and (
+                not stamp.exists() or time.time() - stamp.stat().st_mtime > self.refresh
+            ):
+                cmd = f"git -C {shlex.quote(str(path))} remote update --prune"
+                # A failed refresh still leaves a usable (if stale) mirror.
+                if run_one_command(cmd=cmd) == PASS:
+                    stamp.touch()
+        return path
+
+    def is_current(self, url: str, dest: Path) -> bool:
+        """Determine if a checkout matches its local mirror.
+
+        Refs are read straight from disk, so this doesn't run git or
+        contact upstream.
+
+        Parameters
+        ----------
+        url : str
+            Upstream URL of the repo.
+        dest : Path
+            Where the checkout should live.
+
+        Returns
+        -------
+        bool
+            True if the checkout exists and is at the mirror's HEAD.
+        """
+        if (bundle := active()) is not None:
+            source = bundle.repo(url)
+        else:
+            source = self.path(url)
+        mirror = None if source is None else _head(source)
+        return mirror is not None and _head(dest / ".git") == mirror
+
+    def install(self, url: str, dest: Path) -> Text:
+        """Clone a repo into place, or update an existing checkout.
+
+        New checkouts are cloned from the local mirror, which hardlinks
+        objects where possible, and origin is then pointed back at the
+        upstream URL. Hardlinks (rather than alternates) keep checkouts
+        working even if the store is later cleared. An existing checkout
+        is fast-forwarded from the mirror instead of failing.
+
+        Parameters
+        ----------
+        url : str
+            Upstream URL of the repo.
+        dest : Path
+            Where the checkout should live.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            print(f"\nMirroring: {url}\nTo: {dest}")
+            return PASS
+        if (mirror := self.mirror(url)) is None:
+            return FAIL
+        src, repo = shlex.quote(str(mirror)), shlex.quote(str(dest))
+        if (dest / ".git").exists():
+            cmd = f"git -C {repo} fetch --quiet {src} HEAD"
+            if (result := run_one_command(cmd=cmd)) == PASS:
+                cmd = f"git -C {repo} merge --quiet --ff-only FETCH_HEAD"
+                result = run_one_command(cmd=cmd)
+            return result
+        cmd = f"git clone --quiet {src} {repo}"
+        if (result := run_one_command(cmd=cmd)) == PASS:
+            cmd = f"git -C {repo} remote set-url origin {url}"
+            result = run_one_command(cmd=cmd)
+        return result
+
+
+if __name__ == "__main__":
+    pass
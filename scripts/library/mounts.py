@@ -0,0 +1,169 @@
+"""Mount the VMware shared folders once, at boot, through fstab.
+
+The share is listed in /etc/fstab with x-systemd.automount, so systemd
+sets up an automount point at boot and only starts vmhgfs-fuse when the
+share is first used. Logins no longer mount it themselves, and a VM
+without shared folders (or not on VMware) doesn't hold up the boot.
+"""
+
+import os
+import shlex
+import string
+import subprocess as sp
+from pathlib import Path
+from typing import Text
+
+from .environment import DEBUG
+from .environment import PASS
+from .environment import ROOT
+from .patches import Edit
+from .patches import pending
+from .utilities import patch_files
+from .utilities import run_one_command
+from .utilities import spawn
+
+# Options for vmhgfs-fuse. The kernel keeps file contents cached across
+# opens unless the host changed the file (auto_cache), and file
+# attributes and names are cached for a few seconds instead of one, which
+# cuts down on round trips to the host when listing and building. Files
+# belong to the user, and nofail keeps a missing share from failing the
+# boot.
+SHARE_OPTIONS = [
+    "allow_other",
+    "auto_cache",
+    "attr_timeout=5",
+    "entry_timeout=5",
+    "negative_timeout=5",
+    "nofail",
+    "x-systemd.automount",
+    "x-systemd.device-timeout=10s",
+]
+
+
+def unit_name(path: Path, suffix: str) -> str:
+    """Name the systemd unit for a mount point, as systemd-escape does.
+
+    Parameters
+    ----------
+    path : Path
+        Absolute path of the mount point.
+    suffix : str
+        Unit type, e.g. 'mount' or 'automount'.
+
+    Returns
+    -------
+    str
+        The unit name, e.g. home-zeke-shares.automount.
+    """
+    keep = set(string.ascii_letters + string.digits + ":_.")
+    parts = []
+    for part in str(path).strip("/").split("/"):
+        escaped = ""
+        for i, c in enumerate(part):
+            if c in keep and not (i == 0 and c == "."):
+                escaped += c
+            else:
+                escaped += "".join(f"\\x{b:02x}" for b in c.encode())
+        parts.append(escaped)
+    return f"{'-'.join(parts) or '-'}.{suffix}"
+
+
+def share_edits(where: Path, uid: int, gid: int) -> list[Edit]:
+    """Build the edits that mount the shared folders at a path.
+
+    Parameters
+    ----------
+    where : Path
+        The mount point, e.g. ~/shares.
+    uid : int
+        Owner of the files in the share.
+    gid : int
+        Group of the files in the share.
+
+    Returns
+    -------
+    list[Edit]
+        Edits to /etc/fuse.conf and /etc/fstab.
+    """
+    # fstab fields are split on whitespace, so spaces are escaped.
+    mount_point = str(where).replace(" ", "\\040")
+    options = ",".join([*SHARE_OPTIONS, f"uid={uid}", f"gid={gid}"])
+    return [
+        # Lets users run programs from a shell whose working directory
+        # is inside the share.
+        Edit.uncomment("/etc/fuse.conf", "user_allow_other"),
+        Edit.set(
+            "/etc/fstab",
+            f".host:/ {mount_point}",
+            f"fuse.vmhgfs-fuse {options} 0 0",
+        ),
+    ]
+
+
+def shares_active(where: Path, root: Path = ROOT) -> bool:
+    """Determine if systemd is looking after the share's mount point.
+
+    Parameters
+    ----------
+    where : Path
+        The mount point, e.g. ~/shares.
+    root : Path, optional
+        Root the system files are under, by default ROOT. Under any
+        root other than /, systemd isn't involved, so this is True.
+
+    Returns
+    -------
+    bool
+        True if something is mounted there (the automount point itself
+        shows up as a mount) or the automount unit is active.
+    """
+    if root != Path("/") or os.path.ismount(where):
+        return True
+    cmd = ["systemctl", "is-active", "--quiet", unit_name(where, "automount")]
+    return spawn(cmd, std_out=sp.DEVNULL, std_err=sp.DEVNULL) == 0
+
+
+def mount_shares(where: Path, root: Path = ROOT) -> Text:
+    """Add the shared folders to fstab and have systemd mount them.
+
+    Parameters
+    ----------
+    where : Path
+        The mount point, e.g. ~/shares. It should already exist.
+    root : Path, optional
+        Root the system files are under, by default ROOT. Under any
+        root other than /, the files are only written, and systemd is
+        left alone.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    edits = share_edits(where, os.getuid(), os.getgid())
+    changed = DEBUG or bool(pending(edits, root=root))
+    if (result := patch_files(edits, root=root)) != PASS:
+        return result
+    if root != Path("/"):
+        return PASS
+    # What systemd still needs is decided from its own state, not from
+    # whether fstab changed just now, so a run that wrote fstab but
+    # failed to reload or start the automount is finished off by the
+    # next one.
+    active = shares_active(where, root=root)
+    if changed or not active:
+        # Have systemd generate the units for the entry.
+        cmd = "sudo systemctl daemon-reload"
+        if (result := run_one_command(cmd=cmd)) != PASS:
+            return result
+    if active:
+        # New options (or an automount in place of something an older
+        # login script mounted) take effect the next time it's mounted.
+        return PASS
+    automount = unit_name(where, "automount")
+    return run_one_command(cmd=f"sudo systemctl restart {shlex.quote(automount)}")
+
+
+if __name__ == "__main__":
+    pass
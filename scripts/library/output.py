@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Bounded capture of command output, per step."""
+
+import collections
+import contextlib
+import gzip
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from typing import Iterator
+
+from .environment import CACHE
+from .environment import KEEP_LOGS
+from .environment import OUTPUT_TAIL
+
+
+class TailBuffer:
+    """Keep only the last few kilobytes written to it.
+
+    Memory stays flat no matter how much a command prints, while the
+    end of its output (usually where the error is) is kept.
+    """
+
+    def __init__(self, limit: int = OUTPUT_TAIL) -> None:
+        """Create a new TailBuffer object.
+
+        Parameters
+        ----------
+        limit : int, optional
+            Number of bytes to keep, by default OUTPUT_TAIL.
+        """
+        self.limit = limit
+        self.size = 0
+        self.dropped = False
+        self.chunks: collections.deque[bytes] = collections.deque()
+        return
+
+    def write(self, data: bytes) -> None:
+        """Add output, dropping the oldest bytes beyond the limit."""
+        if len(data) >= self.limit:
+            self.dropped = self.dropped or self.size > 0 or len(data) > self.limit
+            self.chunks.clear()
+            self.size = 0
+            data = data[-self.limit :]
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size - len(self.chunks[0]) >= self.limit:
+            self.size -= len(self.chunks.popleft())
+            self.dropped = True
+        return
+
+    def text(self) -> str:
+        """Return the kept output, starting at a whole line."""
+        data = b"".join(self.chunks)
+        if self.dropped and b"\n" in data:
+            data = data[data.index(b"\n") + 1 :]
+        return data.decode(errors="replace")
+
+
+class OutputLog:
+    """Route the output of commands to the step that ran them.
+
+    Each step gets a TailBuffer, and optionally a gzip log file with
+    its full output.
+    """
+
+    def __init__(self, root: Path | None = None) -> None:
+        """Create a new OutputLog object.
+
+        Parameters
+        ----------
+        root : Path | None, optional
+            Directory for per-step log files, or None to keep only the
+            tail of each step's output, by default None.
+        """
+        self.root = root
+        self.tails: dict[str, TailBuffer] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        return
+
+    @contextlib.contextmanager
+    def step(self, label: str) -> Iterator[None]:
+        """Capture output written while a step runs.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+        """
+        tail = TailBuffer()
+        with self._lock:
+            self.tails[label] = tail
+        with contextlib.ExitStack() as stack:
+            log: gzip.GzipFile | None = None
+            if self.root is not None:
+                name = re.sub(r"[^\w.-]+", "_", label).strip("_")
+                self.root.mkdir(parents=True, exist_ok=True)
+                path = self.root / f"{name}.log.gz"
+                log = stack.enter_context(gzip.GzipFile(path, "wb"))
+            self._local.sinks = (tail, log)
+            try:
+                yield
+            finally:
+                self._local.sinks = None
+        return
+
+    @contextlib.contextmanager
+    def tee(self, sink: Callable[[bytes], None]) -> Iterator[None]:
+        """Also hand output written by this thread to sink.
+
+        For callers that need to look at a command's output (e.g. for
+        error messages) as it streams into the step's log, without
+        keeping all of it.
+
+        Parameters
+        ----------
+        sink : Callable[[bytes], None]
+            Called with each chunk of output, while the block runs.
+        """
+        tees = getattr(self._local, "tees", ())
+        self._local.tees = (*tees, sink)
+        try:
+            yield
+        finally:
+            self._local.tees = tees
+        return
+
+    def write(self, data: bytes) -> None:
+        """Add output to the current step, if any.
+
+        Parameters
+        ----------
+        data : bytes
+            Output from a command.
+        """
+        for sink in getattr(self._local, "tees", ()):
+            sink(data)
+        if (sinks := getattr(self._local, "sinks", None)) is None:
+            return
+        tail, log = sinks
+        tail.write(data)
+        if log is not None:
+            log.write(data)
+        return
+
+    def tail(self, label: str) -> str:
+        """Return the end of a step's output.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+
+        Returns
+        -------
+        str
+            The last OUTPUT_TAIL bytes or so of output, or "" if the
+            step printed nothing.
+        """
+        if (tail := self.tails.get(label)) is None:
+            return ""
+        return tail.text()
+
+
+# Shared by the step runner and the command helpers in utilities. Full
+# logs are only kept when UBUNTU_LOGS is set.
+OUTPUT = OutputLog(
+    root=CACHE / "logs" / time.strftime("%Y%m%d-%H%M%S") if KEEP_LOGS else None
+)
+
+
+if __name__ == "__main__":
+    pass
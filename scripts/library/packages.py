@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Package management for ubuntu scripts."""
+
+import re
+import subprocess as sp
+from pathlib import Path
+from typing import Text
+
+from .bundle import active
+from .environment import DEBUG
+from .environment import DPKG_STATUS
+from .environment import FAIL
+from .environment import PASS
+from .output import OUTPUT
+from .utilities import spawn
+
+# Patterns apt uses to report packages it can't resolve. When one of
+# these shows up, the whole transaction is aborted before anything is
+# installed, so the offending names are dropped and the rest retried.
+APT_MISSING = [
+    re.compile(r"Unable to locate package (\S+)"),
+    re.compile(r"Package '?([^'\s]+)'? has no installation candidate"),
+    re.compile(r"Couldn't find any package by glob '([^']+)'"),
+]
+
+# Longest partial line of apt output held while waiting for its end.
+# Progress bars can redraw on one line for a long time.
+LINE_LIMIT = 4096
+
+
+class PackageIndex:
+    """In-memory index of the packages known to dpkg."""
+
+    def __init__(self, path: Path = DPKG_STATUS) -> None:
+        """Create a new PackageIndex object.
+
+        Parameters
+        ----------
+        path : Path, optional
+            The dpkg status database to read, by default DPKG_STATUS. It
+            is parsed once, here. If the file can't be read the index is
+            empty, which simply means nothing gets skipped.
+        """
+        self.packages: dict[str, tuple[str, str]] = {}
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError:
+            return
+        for stanza in text.split("\n\n"):
+            fields: dict[str, str] = {}
+            for line in stanza.split("\n"):
+                # Continuation lines (Description, Conffiles, etc.)
+                # start with whitespace and are never needed here.
+                if not line or line[0].isspace() or ":" not in line:
+                    continue
+                key, _, value = line.partition(":")
+                fields[key] = value.strip()
+            if not (name := fields.get("Package")):
+                continue
+            entry = (fields.get("Version", ""), fields.get("Status", ""))
+            # A multi-arch package can appear once per architecture. An
+            # installed entry always wins over one that isn't.
+            if name not in self.packages or self._ok(entry[1]):
+                self.packages[name] = entry
+            if arch := fields.get("Architecture"):
+                self.packages[f"{name}:{arch}"] = entry
+        return
+
+    @staticmethod
+    def _ok(status: str) -> bool:
+        """Determine if a dpkg status string means fully installed."""
+        return status.split()[-1:] == ["installed"]
+
+    def version(self, name: str) -> str | None:
+        """Return the version of an installed package.
+
+        Parameters
+        ----------
+        name : str
+            Package name, optionally qualified with an architecture
+            (e.g. zsh or libc6:amd64).
+
+        Returns
+        -------
+        str | None
+            The installed version, or None if the package is not fully
+            installed.
+        """
+        if (entry := self.packages.get(name)) and self._ok(entry[1]):
+            return entry[0]
+        return None
+
+    def is_installed(self, name: str) -> bool:
+        """Determine if a package is fully installed.
+
+        Parameters
+        ----------
+        name : str
+            Package name, optionally qualified with an architecture.
+
+        Returns
+        -------
+        bool
+            True if dpkg reports the package as installed.
+        """
+        return self.version(name) is not None
+
+    def missing(self, targets: list[str]) -> list[str]:
+        """Filter a list of packages down to those not installed.
+
+        Parameters
+        ----------
+        targets : list[str]
+            Package names.
+
+        Returns
+        -------
+        list[str]
+            The targets that still need to be installed, in order.
+        """
+        return [target for target in targets if not self.is_installed(target)]
+
+
+def _apt(args: list[str], as_sudo: bool) -> tuple[int, set[str]]:
+    """Run apt with the given arguments and capture its output.
+
+    The output streams into the current step's OUTPUT log as it comes.
+    It's scanned a line at a time on the way, so only the names of the
+    packages apt couldn't resolve are kept.
+
+    Parameters
+    ----------
+    args : list[str]
+        Arguments passed to apt.
+    as_sudo : bool
+        Run apt with sudo.
+
+    Returns
+    -------
+    tuple[int, set[str]]
+        The exit code, and the names apt reported it couldn't find.
+    """
+    cmd = ["sudo", "apt", *args] if as_sudo else ["apt", *args]
+    missing: set[str] = set()
+    partial = b""
+
+    def scan(chunk: bytes) -> None:
+        nonlocal partial
+        *lines, partial = (partial + chunk).split(b"\n")
+        partial = partial[-LINE_LIMIT:]
+        for line in lines:
+            text = line.decode(errors="replace")
+            for pattern in APT_MISSING:
+                missing.update(pattern.findall(text))
+
+    with OUTPUT.tee(scan):
+        returncode = spawn(cmd, std_out=sp.PIPE, std_err=sp.STDOUT)
+    scan(b"\n")
+    return returncode, missing
+
+
+def install_packages(
+    targets: list[str],
+    as_sudo: bool = True,
+    index: PackageIndex | None = None,
+) -> dict[str, Text]:
+    """Install packages with apt in a single transaction.
+
+    All targets are handed to one apt run, so the package cache is read,
+    the dpkg lock is taken and triggers are processed only once. If apt
+    rejects some of the names, those are marked FAIL and the remaining
+    packages are installed in one more transaction. If the transaction
+    still fails without apt naming a culprit, each package is installed
+    on its own so failures can be pinned to a specific package.
+
+    Packages that dpkg already reports as installed are marked PASS up
+    front. If every target is installed, apt (and sudo) never run. With
+    a bundle active, packages are installed from its .deb files, and
+    any that aren't bundled are marked FAIL.
+
+    Parameters
+    ----------
+    targets : list[str]
+        Names of the packages to install.
+    as_sudo : bool, optional
+        Run apt with sudo, by default True.
+    index : PackageIndex | None, optional
+        Index of installed packages to consult. By default a new one is
+        read from the dpkg status database.
+
+    Returns
+    -------
+    dict[str, Text]
+        Mapping of package name to PASS or FAIL.
+    """
+    if index is None:
+        index = PackageIndex()
+    report: dict[str, Text] = {}
+    pending = index.missing(list(dict.fromkeys(targets)))
+    report.update({target: PASS for target in targets if target not in pending})
+    if (bundle := active()) is not None:
+        report.update({name: FAIL for name in pending if bundle.debs(name) is None})
+        pending = [target for target in pending if target not in report]
+
+    def sources(names: list[str]) -> list[str]:
+        # With a bundle, apt is handed the .deb files of the packages
+        # and of whichever of their dependencies are still missing.
+        if bundle is None:
+            return names
+        # Recommends aren't bundled, and there's no network to get them.
+        debs: dict[str, Path] = {}
+        for name in names:
+            debs.update(bundle.debs(name) or {})
+        files = [str(deb) for dep, deb in debs.items() if not index.is_installed(dep)]
+        return ["--no-install-recommends", *files]
+
+    if DEBUG and pending:
+        cmd = ["apt", "-y", "install", *sources(pending)]
+        print(f"\nRunning: {['sudo', *cmd] if as_sudo else cmd}")
+        report.update({target: PASS for target in pending})
+        pending = []
+
+    while pending:
+        args = ["-y", "install", *sources(pending)]
+        returncode, missing = _apt(args, as_sudo=as_sudo)
+        if returncode == 0:
+            report.update({target: PASS for target in pending})
+            break
+        missing &= set(pending)
+        if missing:
+            report.update({name: FAIL for name in missing})
+            pending = [target for target in pending if target not in missing]
+            continue
+        # No way to tell which package broke the transaction, so fall
+        # back to installing them one at a time.
+        for target in pending:
+            args = ["-y", "install", *sources([target])]
+            returncode, _ = _apt(args, as_sudo=as_sudo)
+            report[target] = PASS if returncode == 0 else FAIL
+        break
+
+    return {target: report[target] for target in dict.fromkeys(targets)}
+
+
+def download_packages(
+    targets: list[str],
+    as_sudo: bool = True,
+    index: PackageIndex | None = None,
+) -> Text:
+    """Download packages into the apt cache without installing them.
+
+    Meant to run in the background while other steps work, so that a
+    later install_packages only has to unpack. Packages that are
+    already installed are left out, and nothing runs if that's all of
+    them. With a bundle active there's nothing to download.
+
+    Parameters
+    ----------
+    targets : list[str]
+        Names of the packages that will be installed later.
+    as_sudo : bool, optional
+        Run apt with sudo, by default True.
+    index : PackageIndex | None, optional
+        Index of installed packages to consult. By default a new one is
+        read from the dpkg status database.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    if index is None:
+        index = PackageIndex()
+    pending = index.missing(list(dict.fromkeys(targets)))
+    if not pending or active() is not None:
+        return PASS
+    args = ["-y", "install", "--download-only", *pending]
+    if DEBUG:
+        cmd = ["apt", *args]
+        print(f"\nRunning: {['sudo', *cmd] if as_sudo else cmd}")
+        return PASS
+    returncode, _ = _apt(args, as_sudo=as_sudo)
+    return PASS if returncode == 0 else FAIL
+
+
+def summarize(report: dict[str, Text]) -> Text:
+    """Reduce a per-package report to a single status.
+
+    Parameters
+    ----------
+    report : dict[str, Text]
+        Mapping of package name to PASS or FAIL.
+
+    Returns
+    -------
+    Text
+        PASS if every package passed, otherwise FAIL.
+    """
+    return PASS if all(r == PASS for r in report.values()) else FAIL
+
+
+def report_failures(report: dict[str, Text]) -> None:
+    """Print a status line for every package that failed to install.
+
+    Parameters
+    ----------
+    report : dict[str, Text]
+        Mapping of package name to PASS or FAIL.
+    """
+    failed = [name for name, result in report.items() if result == FAIL]
+    if not failed:
+        return
+    pad = len(max(failed, key=len)) + 3
+    print("\nThe following packages could not be installed:\n")
+    for name in failed:
+        print(f"{name:.<{pad}}{FAIL}")
+    return
+
+
+if __name__ == "__main__":
+    pass
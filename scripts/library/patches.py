@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""Declarative, atomic edits to configuration files.
+
+Edits are grouped by file, so each file is read once, has every edit
+applied in memory, and is written back once (atomically) only if its
+content actually changed. Re-applying the same edits is a no-op.
+
+Run as a script (normally under sudo), this module applies a JSON plan
+of edits and prints a JSON report of what changed. It only uses the
+standard library, so that it can be run directly by sudo without the
+rest of the package.
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess as sp
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+
+class Edit:
+    """A single line-level edit to a file.
+
+    Use the uncomment(), set(), ensure() and write() constructors rather
+    than creating an Edit directly.
+    """
+
+    def __init__(
+        self,
+        op: str,
+        path: str,
+        key: str,
+        value: str = "",
+        mode: int = 0o644,
+        check: str = "",
+    ) -> None:
+        """Create a new Edit object.
+
+        Parameters
+        ----------
+        op : str
+            One of 'uncomment', 'set', 'ensure' or 'write'.
+        path : str
+            Absolute path of the file to edit.
+        key : str
+            The line to uncomment or ensure, the key to set, or the
+            whole content for a 'write' edit.
+        value : str, optional
+            The value for a 'set' edit, by default "".
+        mode : int, optional
+            Permissions for a file created by an 'ensure' or 'write'
+            edit, by default 0o644.
+        check : str, optional
+            Command that must accept the new content before it replaces
+            the file (e.g. 'visudo -cf'). The path of the staged copy is
+            appended. By default "", no check.
+        """
+        self.op = op
+        self.path = path
+        self.key = key
+        self.value = value
+        self.mode = mode
+        self.check = check
+        return
+
+    @classmethod
+    def uncomment(cls, path: str, line: str) -> "Edit":
+        """Remove the leading '#' from a commented out line."""
+        return cls("uncomment", path, line)
+
+    @classmethod
+    def set(cls, path: str, key: str, value: str) -> "Edit":
+        """Make the line starting with key read 'key value'.
+
+        The line is appended if the key isn't in the file yet.
+        """
+        return cls("set", path, key, value)
+
+    @classmethod
+    def ensure(
+        cls,
+        path: str,
+        line: str,
+        mode: int = 0o644,
+        check: str = "",
+    ) -> "Edit":
+        """Append a line unless it's already present.
+
+        The file is created (with the given mode) if it doesn't exist.
+        """
+        return cls("ensure", path, line, mode=mode, check=check)
+
+    @classmethod
+    def write(
+        cls,
+        path: str,
+        content: str,
+        mode: int = 0o644,
+        check: str = "",
+    ) -> "Edit":
+        """Make the file hold exactly the given content.
+
+        For files that are generated whole, rather than patched. The
+        file is created (with the given mode) if it doesn't exist.
+        """
+        return cls("write", path, content, mode=mode, check=check)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the edit in a form that can be sent as JSON."""
+        return vars(self).copy()
+
+    def apply(self, lines: list[str]) -> str | None:
+        """Apply the edit to the lines of a file, in place.
+
+        Parameters
+        ----------
+        lines : list[str]
+            The lines of the file, without line endings.
+
+        Returns
+        -------
+        str | None
+            A description of the change, or None if the lines already
+            had the edit applied.
+        """
+        if self.op == "write":
+            if lines == (content := self.key.splitlines()):
+                return None
+            lines[:] = content
+            return f"wrote {self.path}"
+        if self.op == "uncomment":
+            if self.key in (line.strip() for line in lines):
+                return None
+            pattern = re.compile(rf"^\s*#+\s*{re.escape(self.key)}\s*$")
+            for i, line in enumerate(lines):
+                if pattern.match(line):
+                    lines[i] = self.key
+                    return f"uncommented {self.key!r}"
+            return None
+        wanted = f"{self.key} {self.value}" if self.op == "set" else self.key
+        if self.op == "set":
+            pattern = re.compile(rf"^\s*{re.escape(self.key)}(\s|$)")
+            for i, line in enumerate(lines):
+                if pattern.match(line):
+                    if line.strip() == wanted:
+                        return None
+                    lines[i] = wanted
+                    return f"set {self.key!r} to {self.value!r}"
+        elif wanted in (line.strip() for line in lines):
+            return None
+        lines.append(wanted)
+        return f"added {wanted!r}"
+
+
+def locate(path: str, root: Path) -> Path:
+    """Map an absolute path onto a (possibly fake) root directory.
+
+    Parameters
+    ----------
+    path : str
+        Absolute path, e.g. /etc/fuse.conf.
+    root : Path
+        The root to resolve it under, e.g. / or a temporary tree.
+
+    Returns
+    -------
+    Path
+        The location of the file under root.
+    """
+    return root / Path(path).relative_to("/")
+
+
+def _group(edits: list[Edit]) -> dict[str, list[Edit]]:
+    """Group edits by file, keeping their order."""
+    files: dict[str, list[Edit]] = {}
+    for edit in edits:
+        files.setdefault(edit.path, []).append(edit)
+    return files
+
+
+def _patch(file: Path, edits: list[Edit]) -> tuple[str | None, list[str]]:
+    """Compute the new content of a file.
+
+    Returns
+    -------
+    tuple[str | None, list[str]]
+        The new content (None if the file is unchanged) and the changes
+        made.
+
+    Raises
+    ------
+    OSError
+        If the file can't be read, or is missing and an edit needs it.
+    """
+    try:
+        old = file.read_text()
+    except FileNotFoundError:
+        if any(edit.op not in ("ensure", "write") for edit in edits):
+            raise
+        old = None
+    lines = (old or "").splitlines()
+    changes = [c for edit in edits if (c := edit.apply(lines)) is not None]
+    if not changes:
+        return None, []
+    return "\n".join(lines) + "\n", changes
+
+
+def write_file(
+    file: Path,
+    content: str,
+    mode: int = 0o644,
+    check: list[str] | None = None,
+) -> None:
+    """Atomically replace a file, keeping its owner and permissions.
+
+    The new content is staged next to the file and renamed over it, so
+    readers see either the old file or the new one. A symlink at file
+    is replaced, not followed, so pass the resolved path to write
+    through one.
+
+    Parameters
+    ----------
+    file : Path
+        The file to write.
+    content : str
+        Its new content.
+    mode : int, optional
+        Permissions if the file is new, by default 0o644.
+    check : list[str] | None, optional
+        Command run on the staged copy (its path appended). The file is
+        left alone unless it succeeds, by default None.
+
+    Raises
+    ------
+    OSError
+        If the file can't be written, or the check fails.
+    """
+    try:
+        st = os.stat(file)
+    except FileNotFoundError:
+        st = None
+    fd, tmp = tempfile.mkstemp(dir=file.parent, prefix=f".{file.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if st is not None:
+            os.chmod(tmp, st.st_mode & 0o7777)
+            if os.geteuid() == 0:
+                os.chown(tmp, st.st_uid, st.st_gid)
+        else:
+            os.chmod(tmp, mode)
+        if check:
+            proc = sp.run(
+                [*check, tmp],
+                stdout=sp.DEVNULL,
+                stderr=sp.PIPE,
+                text=True,
+                check=False,
+            )
+            if proc.returncode != 0:
+                detail = proc.stderr.strip() or f"exit code {proc.returncode}"
+                raise OSError(f"{shlex.join(check)} failed: {detail}")
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return
+
+
+def pending(edits: list[Edit], root: Path = Path("/")) -> list[str]:
+    """Find the files that still need editing, without changing them.
+
+    Parameters
+    ----------
+    edits : list[Edit]
+        The edits to check.
+    root : Path, optional
+        Root the paths are resolved under, by default /.
+
+    Returns
+    -------
+    list[str]
+        Paths of files that would change. Files that can't be read
+        (e.g. root only) are included, since they can't be checked.
+    """
+    files = []
+    for path, group in _group(edits).items():
+        try:
+            content, _ = _patch(locate(path, root), group)
+        except OSError:
+            content = ""
+        if content is not None:
+            files.append(path)
+    return files
+
+
+def apply_edits(edits: list[Edit], root: Path = Path("/")) -> dict[str, Any]:
+    """Apply edits, with one read and at most one write per file.
+
+    Edits with a check (see Edit) only have it run on the live system
+    (root /). Under a scratch root the file isn't in use, so it's
+    written as is.
+
+    Parameters
+    ----------
+    edits : list[Edit]
+        The edits to apply, in order.
+    root : Path, optional
+        Root the paths are resolved under, by default /.
+
+    Returns
+    -------
+    dict[str, Any]
+        For each file, the list of changes made (empty if it was already
+        up to date), or an error message if it could not be patched.
+    """
+    report: dict[str, Any] = {}
+    live = root == Path("/")
+    for path, group in _group(edits).items():
+        file = locate(path, root)
+        check = next((edit.check for edit in group if edit.check), "")
+        try:
+            content, changes = _patch(file, group)
+            if content is not None:
+                file.parent.mkdir(parents=True, exist_ok=True)
+                command = shlex.split(check) if live else None
+                write_file(file, content, group[-1].mode, command)
+            report[path] = changes
+        except OSError as e:
+            report[path] = f"{type(e).__name__}: {e}"
+    return report
+
+
+def main():
+    msg = """
+    Apply a JSON plan of file edits (as built by the ubuntu scripts) and
+    print a JSON report of what changed. Exits non-zero if any file
+    could not be patched.
+    """
+    parser = argparse.ArgumentParser(description=msg)
+    msg = """JSON list of edits."""
+    parser.add_argument("--plan", required=True, help=msg)
+    msg = """root the paths are resolved under (default /)."""
+    parser.add_argument("--root", type=Path, default=Path("/"), help=msg)
+    args = parser.parse_args()
+    edits = [Edit(**edit) for edit in json.loads(args.plan)]
+    report = apply_edits(edits, root=args.root)
+    print(json.dumps(report))
+    sys.exit(any(isinstance(r, str) for r in report.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Long-lived helper for running privileged commands.
+
+Run as a script (normally under sudo), this module is the helper: it
+reads JSON requests from stdin, runs each command, and writes JSON
+messages to stdout: the command's output, in chunks as it's produced,
+then its exit code. A request can also cancel a running command, which
+stops it along with everything it started. Imported, it provides the
+client side. The helper exits as soon as its stdin closes, so it never
+outlives the script that started it.
+
+This module only uses the standard library, so that it can be run
+directly by sudo without the rest of the package.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import signal
+import subprocess as sp
+import sys
+import threading
+from pathlib import Path
+from typing import Any
+from typing import Callable
+
+CHUNK = 64 * 1024
+
+# Seconds a cancelled command gets to exit after SIGTERM, before SIGKILL.
+GRACE = 5
+
+
+class PrivilegedHelper:
+    """Client for a privileged helper process.
+
+    Commands are sent over a pipe and run by the helper, which is
+    started (and authenticated) once. That saves a sudo fork, PAM
+    session and timestamp check per command, and means the sudo
+    timestamp can't expire part way through a run. Requests from several
+    threads can be in flight at the same time.
+    """
+
+    def __init__(self, command: list[str] | None = None) -> None:
+        """Create a new PrivilegedHelper object.
+
+        Parameters
+        ----------
+        command : list[str] | None, optional
+            How to start the helper. By default it's this file run by
+            python under non-interactive sudo, so sudo must already have
+            a valid timestamp (e.g. from sudo -v). A stand-in can be run
+            without sudo, e.g. [python, privileged.py, --root, tmpdir].
+        """
+        if command is None:
+            command = ["sudo", "-n", sys.executable, str(Path(__file__).resolve())]
+        self.command = command
+        self.proc: sp.Popen | None = None
+        self._ids = itertools.count()
+        self._queues: dict[int, queue.Queue] = {}
+        self._lock = threading.Lock()
+        return
+
+    def start(self) -> bool:
+        """Start the helper and wait until it's ready.
+
+        Returns
+        -------
+        bool
+            True if the helper is running and answered a ping.
+        """
+        try:
+            self.proc = sp.Popen(
+                self.command,
+                stdin=sp.PIPE,
+                stdout=sp.PIPE,
+                stderr=sp.DEVNULL,
+                text=True,
+            )
+        except OSError:
+            return False
+        threading.Thread(target=self._read, daemon=True).start()
+        try:
+            return self.run(["true"]) == 0
+        except OSError:
+            self.stop()
+            return False
+
+    def _read(self) -> None:
+        """Dispatch messages from the helper to waiting callers."""
+        assert self.proc is not None and self.proc.stdout is not None
+        for line in self.proc.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            with self._lock:
+                if (waiting := self._queues.get(message["id"])) is not None:
+                    waiting.put(message)
+        # The helper is gone. Wake anyone still waiting.
+        with self._lock:
+            for waiting in self._queues.values():
+                waiting.put(None)
+        return
+
+    def run(self, args: list[str]) -> int:
+        """Run a command as the helper's user, discarding its output.
+
+        Parameters
+        ----------
+        args : list[str]
+            The program and its arguments (without sudo).
+
+        Returns
+        -------
+        int
+            The command's exit code.
+
+        Raises
+        ------
+        OSError
+            If the helper isn't running or dies before answering.
+        """
+        return self.run_stream(args, lambda _: None)
+
+    def run_stream(
+        self,
+        args: list[str],
+        sink: Callable[[bytes], None],
+        stop: threading.Event | None = None,
+    ) -> int:
+        """Run a command, handing its output to sink as it arrives.
+
+        Output (stdout and stderr combined) comes in chunks, and sink is
+        called from the calling thread, so it can write to the current
+        step's output log.
+
+        Parameters
+        ----------
+        args : list[str]
+            The program and its arguments (without sudo).
+        sink : Callable[[bytes], None]
+            Called with each chunk of output.
+        stop : threading.Event | None, optional
+            When set, the helper terminates the command and everything
+            it started, since the caller can't signal root processes
+            itself. The exit code is still waited for. By default None.
+
+        Returns
+        -------
+        int
+            The command's exit code.
+
+        Raises
+        ------
+        OSError
+            If the helper isn't running or dies before answering.
+        """
+        proc = self.proc
+        if proc is None or proc.poll() is not None or proc.stdin is None:
+            raise OSError("Privileged helper is not running")
+        messages: queue.Queue = queue.Queue()
+        with self._lock:
+            request_id = next(self._ids)
+            self._queues[request_id] = messages
+            self._send(proc, {"id": request_id, "args": args})
+        cancelled = False
+        try:
+            while True:
+                # Commands like apt can take a long time, so wait
+                # indefinitely, but keep an eye on the helper in case
+                # it dies, and on the caller in case it gives up.
+                try:
+                    message = messages.get(timeout=0.2)
+                except queue.Empty:
+                    if proc.poll() is not None:
+                        message = None
+                    elif stop is not None and stop.is_set() and not cancelled:
+                        with self._lock:
+                            self._send(proc, {"id": request_id, "cancel": True})
+                        cancelled = True
+                        continue
+                    else:
+                        continue
+                if message is None:
+                    raise OSError("Privileged helper exited")
+                if "output" in message:
+                    # Sent as latin-1, which maps every byte to a
+                    # character and back unchanged.
+                    sink(message["output"].encode("latin-1"))
+                else:
+                    return message["code"]
+        finally:
+            with self._lock:
+                del self._queues[request_id]
+
+    @staticmethod
+    def _send(proc: sp.Popen, request: dict[str, Any]) -> None:
+        """Write a request to the helper. Call with the lock held."""
+        assert proc.stdin is not None
+        proc.stdin.write(json.dumps(request) + "\n")
+        proc.stdin.flush()
+        return
+
+    def stop(self) -> None:
+        """Shut the helper down."""
+        if self.proc is None:
+            return
+        if self.proc.stdin:
+            self.proc.stdin.close()
+        try:
+            self.proc.wait(timeout=10)
+        except sp.TimeoutExpired:
+            self.proc.kill()
+        self.proc = None
+        return
+
+
+def serve(root: Path | None = None) -> None:
+    """Answer requests on stdin until it closes.
+
+    Parameters
+    ----------
+    root : Path | None, optional
+        Working directory for commands, by default None (inherit).
+    """
+    lock = threading.Lock()
+    running: dict[int, sp.Popen] = {}
+
+    def send(message: dict[str, Any]) -> None:
+        with lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+    def handle(request: dict[str, Any]) -> None:
+        request_id = request["id"]
+        try:
+            proc = sp.Popen(
+                request["args"],
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE,
+                stderr=sp.STDOUT,
+                cwd=root,
+                process_group=0,
+            )
+        except OSError as e:
+            send({"id": request_id, "output": f"{e}\n"})
+            send({"id": request_id, "code": 127})
+            return
+        with lock:
+            running[request_id] = proc
+        # Pass output on as it's produced, so the caller can show it
+        # live, and neither side holds more than a chunk of it.
+        assert proc.stdout is not None
+        with proc.stdout:
+            while chunk := os.read(proc.stdout.fileno(), CHUNK):
+                send({"id": request_id, "output": chunk.decode("latin-1")})
+        code = proc.wait()
+        with lock:
+            del running[request_id]
+        send({"id": request_id, "code": code})
+
+    def kill(request_id: int, proc: sp.Popen, sig: int) -> None:
+        # The command leads its own process group, so this also stops
+        # anything it started. Once it's been reaped, the group id may
+        # belong to someone else.
+        with lock:
+            if running.get(request_id) is not proc:
+                return
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def cancel(request: dict[str, Any]) -> None:
+        request_id = request["id"]
+        with lock:
+            proc = running.get(request_id)
+        if proc is None:
+            return
+        kill(request_id, proc, signal.SIGTERM)
+        args = (request_id, proc, signal.SIGKILL)
+        timer = threading.Timer(GRACE, kill, args=args)
+        timer.daemon = True
+        timer.start()
+
+    threads = []
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        if request.get("cancel"):
+            cancel(request)
+            continue
+        thread = threading.Thread(target=handle, args=(request,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return
+
+
+def main():
+    msg = """
+    Privileged helper for the ubuntu scripts. Reads one JSON request
+    per line on stdin and writes JSON messages, one per line, on stdout.
+    Not meant to be run by hand.
+    """
+    parser = argparse.ArgumentParser(description=msg)
+    msg = """working directory for commands (used by stand-in helpers)."""
+    parser.add_argument("--root", type=Path, default=None, help=msg)
+    args = parser.parse_args()
+    if args.root:
+        os.makedirs(args.root, exist_ok=True)
+    serve(root=args.root)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""Dependency-aware step scheduler for ubuntu scripts."""
+
+import asyncio
+import concurrent.futures as cf
+import inspect
+import json
+import sys
+import textwrap
+import time
+import traceback
+from pathlib import Path
+from typing import Awaitable
+from typing import Callable
+from typing import Text
+
+from .classes import Labels
+from .environment import CACHE
+from .environment import DEBUG
+from .environment import EVENT
+from .environment import EVENTS
+from .environment import FAIL
+from .environment import OUTPUT_LINES
+from .environment import PASS
+from .environment import WORKERS
+from .journal import Journal
+from .journal import digest_inputs
+from .output import OUTPUT
+from .trace import TRACER
+
+
+class StepGraphError(Exception):
+    """Exception when a step graph is not well formed.
+
+    Parameters
+    ----------
+    Exception : Python Exception type
+        StepGraphError is a sub-class of Python's Exception class.
+    """
+
+    def __init__(self, message: str):
+        """Initialize a new step graph error."""
+        self.message = message
+        super().__init__(self.message)
+
+
+class Step:
+    """A single unit of work in a setup script."""
+
+    def __init__(
+        self,
+        label: str,
+        action: Callable[[], Text] | Callable[[], Awaitable[Text]],
+        needs: list[str] | None = None,
+        inputs: list[str | Path] | None = None,
+        timeout: float | None = None,
+        probe: Callable[[], bool] | None = None,
+        background: bool = False,
+    ) -> None:
+        """Create a new Step object.
+
+        Parameters
+        ----------
+        label : str
+            The status label printed for this step. Labels also serve as
+            the step's unique name when declaring dependencies.
+        action : Callable[[], Text] | Callable[[], Awaitable[Text]]
+            A function that performs the work for the step and returns
+            either PASS or FAIL. It may be a coroutine function, which
+            is run in its own event loop.
+        needs : list[str] | None, optional
+            Labels of the steps that must complete before this one can
+            start, by default None.
+        inputs : list[str | Path] | None, optional
+            Everything the step's outcome depends on: strings (package
+            names, URLs, settings) and files whose content it uses. A
+            resumed run skips the step if these haven't changed since it
+            last passed, by default None.
+        timeout : float | None, optional
+            Deadline for an async action, in seconds. When it passes,
+            the action is cancelled (stopping any commands it's running)
+            and the step is marked FAIL, by default None.
+        probe : Callable[[], bool] | None, optional
+            A quick check of whether the system is already in the state
+            the step would put it in, used to plan a converge run. It
+            must not change anything, by default None.
+        background : bool, optional
+            Run the step as a background job, by default False. Its
+            status line is held back until the other steps are done, so
+            a slow job (e.g. a large download) doesn't hold up the
+            progress shown for the steps after it.
+        """
+        self.label = label
+        self.action = action
+        self.needs = needs if needs else []
+        self.inputs = inputs if inputs else []
+        self.timeout = timeout
+        self.probe = probe
+        self.background = background
+        return
+
+    def satisfied(self) -> bool:
+        """Run the step's probe.
+
+        Returns
+        -------
+        bool
+            True if the probe says there is nothing to do. A step with
+            no probe, or whose probe raises, is never satisfied. The
+            error is printed, with a traceback in debug mode.
+        """
+        if self.probe is None:
+            return False
+        try:
+            return self.probe()
+        except Exception as e:  # noqa: BLE001
+            print(f"Could not check {self.label!r}: {type(e).__name__}: {e}")
+            if DEBUG:
+                traceback.print_exc()
+            return False
+
+    def execute(self) -> Text:
+        """Run the step's action.
+
+        Returns
+        -------
+        Text
+            PASS or FAIL. Any exception raised by the action is reported
+            as FAIL so that one broken step can't take down the run. Its
+            traceback goes in the step's output, which is shown when the
+            step fails, and is printed right away in debug mode.
+        """
+        try:
+            if inspect.iscoroutinefunction(self.action):
+                return asyncio.run(self._execute_async())
+            return self.action()  # type: ignore[return-value]
+        except Exception:  # noqa: BLE001
+            OUTPUT.write(f"\n{traceback.format_exc()}".encode())
+            if DEBUG:
+                traceback.print_exc()
+            return FAIL
+
+    async def _execute_async(self) -> Text:
+        """Run an async action, enforcing the step's deadline."""
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await self.action()  # type: ignore[misc]
+        except TimeoutError:
+            OUTPUT.write(f"\nStep timed out after {self.timeout}s\n".encode())
+            return FAIL
+
+
+class StepRunner:
+    """Run the steps of a script concurrently, honoring dependencies."""
+
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        journal: Journal | None = None,
+        resume: bool = False,
+        converge: bool = False,
+    ) -> None:
+        """Create a new StepRunner object.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Maximum number of steps that can run at the same time, by
+            default WORKERS.
+        journal : Journal | None, optional
+            Journal to record step outcomes in, by default None.
+        resume : bool, optional
+            Skip steps that the journal shows already passed with the
+            same inputs, by default False.
+        converge : bool, optional
+            Probe the current state first and only run the steps that
+            would change something, by default False. See plan().
+        """
+        self.steps: dict[str, Step] = {}
+        self.workers = max(1, workers)
+        self.journal = journal
+        self.resume = resume
+        self.converge = converge
+        self.planned: list[str] | None = None
+        return
+
+    def add(
+        self,
+        label: str,
+        action: Callable[[], Text] | Callable[[], Awaitable[Text]],
+        needs: list[str] | None = None,
+        inputs: list[str | Path] | None = None,
+        timeout: float | None = None,
+        probe: Callable[[], bool] | None = None,
+        background: bool = False,
+    ) -> None:
+        """Add a step to the graph.
+
+        Steps may only depend on steps that have already been added.
+        This keeps the graph free of cycles and means the order in which
+        steps are added is always a valid serial order.
+
+        Parameters
+        ----------
+        label : str
+            The status label for the step.
+        action : Callable[[], Text] | Callable[[], Awaitable[Text]]
+            The function (or coroutine function) that performs the step.
+        needs : list[str] | None, optional
+            Labels of prerequisite steps, by default None.
+        inputs : list[str | Path] | None, optional
+            What the step's outcome depends on, by default None.
+        timeout : float | None, optional
+            Deadline for the step in seconds, by default None. Only
+            async actions can be given one.
+        probe : Callable[[], bool] | None, optional
+            Check that returns True when the step has nothing to do, by
+            default None. See plan().
+        background : bool, optional
+            Start the step as soon as its prerequisites are done, but
+            report it after all the other steps, by default False. Steps
+            that need its result just list it in their needs.
+
+        Raises
+        ------
+        StepGraphError
+            If the label is a duplicate, if a prerequisite has not been
+            added yet, or if a timeout is given for a plain function.
+        """
+        if label in self.steps:
+            raise StepGraphError(f"Duplicate step: {label}")
+        if timeout is not None and not inspect.iscoroutinefunction(action):
+            raise StepGraphError(f"Only async steps can time out: {label}")
+        for need in needs if needs else []:
+            if need not in self.steps:
+                raise StepGraphError(f"Unknown prerequisite for {label}: {need}")
+        self.steps[label] = Step(
+            label=label,
+            action=action,
+            needs=needs,
+            inputs=inputs,
+            timeout=timeout,
+            probe=probe,
+            background=background,
+        )
+        return
+
+    def plan(self) -> list[str]:
+        """Work out which steps a converge run has to execute.
+
+        Every probe is run (concurrently), and steps whose probe says
+        the system is already in the desired state are left out. Steps
+        without a probe only do work on behalf of other steps, so they
+        are planned exactly when one of their prerequisites is.
+
+        Returns
+        -------
+        list[str]
+            Labels of the steps to run, in the order they were added.
+        """
+        with cf.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            probed = {
+                label: pool.submit(step.satisfied)
+                for label, step in self.steps.items()
+                if step.probe is not None
+            }
+            satisfied = {label: future.result() for label, future in probed.items()}
+        planned: list[str] = []
+        for label, step in self.steps.items():
+            if label in satisfied:
+                if not satisfied[label]:
+                    planned.append(label)
+            elif any(need in planned for need in step.needs):
+                planned.append(label)
+        self.planned = planned
+        return planned
+
+    def _execute(self, step: Step) -> Text:
+        """Run a step, consulting and updating the journal.
+
+        Parameters
+        ----------
+        step : Step
+            The step to run.
+
+        Returns
+        -------
+        Text
+            PASS or FAIL.
+        """
+        with TRACER.step(step.label), OUTPUT.step(step.label):
+            if self.journal is None or DEBUG:
+                return step.execute()
+            inputs = digest_inputs(step.label, step.inputs)
+            if self.resume and self.journal.is_done(step.label, inputs):
+                return PASS
+            start = time.monotonic()
+            result = step.execute()
+            duration = time.monotonic() - start
+        self.journal.record(step.label, inputs, result == PASS, duration)
+        return result
+
+    def run(self) -> dict[str, Text]:
+        """Run all steps and print their status.
+
+        Independent steps are dispatched to a worker pool as soon as
+        their prerequisites are done. Status lines are still printed in
+        the order the steps were added, so the output looks the same as
+        a serial run, except that background steps are reported after
+        all the others, with a status line while any are still running.
+        A step whose prerequisite failed is not run and is marked FAIL.
+        When resuming, steps that already passed with the same inputs
+        are marked PASS without running again. When converging, only
+        the planned steps are run and printed.
+
+        Returns
+        -------
+        dict[str, Text]
+            Mapping of step label to PASS or FAIL.
+        """
+        results: dict[str, Text] = {}
+        order = list(self.steps)
+        if self.converge:
+            if self.planned is None:
+                self.plan()
+            order = self.planned or []
+            # Steps left out of the plan are already in the desired state.
+            results = {label: PASS for label in self.steps if label not in order}
+            for label in results:
+                emit_event(label, PASS)
+        if not order:
+            return results
+        # Background steps are reported last, once the rest are done.
+        background = [label for label in order if self.steps[label].background]
+        order = [label for label in order if label not in background] + background
+        labels = Labels("\n".join(order))
+        waiting = {label: self.steps[label] for label in order}
+        running: dict[cf.Future, str] = {}
+        started: dict[str, float] = {}
+        printed = 0
+        status = BackgroundStatus()
+        if order[0] not in background:
+            labels.next()
+
+        with cf.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while waiting or running:
+                # Dispatch everything that is ready, background steps
+                # first so they get a worker early. Skipping a step can
+                # make its dependents ready too, so keep going until a
+                # pass over the waiting steps changes nothing.
+                changed = True
+                while changed:
+                    changed = False
+                    for label, step in sorted(
+                        waiting.items(), key=lambda item: not item[1].background
+                    ):
+                        if not all(need in results for need in step.needs):
+                            continue
+                        del waiting[label]
+                        changed = True
+                        if any(results[need] == FAIL for need in step.needs):
+                            results[label] = FAIL
+                        else:
+                            running[pool.submit(self._execute, step)] = label
+                            started[label] = time.monotonic()
+
+                if running:
+                    # While only background steps are left, wake up now
+                    # and then to keep their status line current.
+                    timeout = status.interval if status.active else None
+                    done, _ = cf.wait(
+                        running, timeout=timeout, return_when=cf.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+
+                # Report finished steps in declaration order.
+                while printed < len(order) and order[printed] in results:
+                    label = order[printed]
+                    if label in background:
+                        status.clear()
+                        labels.next()
+                    print(results[label])
+                    emit_event(label, results[label])
+                    printed += 1
+                    if printed < len(order) and order[printed] not in background:
+                        labels.next()
+
+                # Show what's still running in the background.
+                if printed < len(order) and order[printed] in background:
+                    outstanding = {
+                        label: started.get(label)
+                        for label in order[printed:]
+                        if label not in results
+                    }
+                    status.show(outstanding)
+
+        print_output(results)
+        return results
+
+
+class BackgroundStatus:
+    """A status line for the background steps still running.
+
+    On a terminal the line is redrawn in place as time passes. Anywhere
+    else (e.g. a log file) it is printed once.
+    """
+
+    # Seconds between redraws of the line.
+    interval = 1.0
+
+    def __init__(self) -> None:
+        """Create a new BackgroundStatus object."""
+        self.active = False
+        self.tty = sys.stdout.isatty()
+        return
+
+    def show(self, outstanding: dict[str, float | None]) -> None:
+        """Show the background steps that haven't finished.
+
+        Parameters
+        ----------
+        outstanding : dict[str, float | None]
+            Labels of the steps, with the monotonic time each one
+            started, or None if it hasn't started yet.
+        """
+        if self.active and not self.tty:
+            return
+        now = time.monotonic()
+        jobs = [
+            label if start is None else f"{label} [{now - start:.0f}s]"
+            for label, start in outstanding.items()
+        ]
+        line = f"Waiting on background jobs: {', '.join(jobs)}"
+        if self.tty:
+            print(f"\r\x1b[K{line}", end="", flush=True)
+        else:
+            print(line, flush=True)
+        self.active = True
+        return
+
+    def clear(self) -> None:
+        """Remove the status line before the next step is reported."""
+        if self.active and self.tty:
+            print("\r\x1b[K", end="", flush=True)
+        self.active = False
+        return
+
+
+def emit_event(label: str, result: Text) -> None:
+    """Print a machine readable step outcome, if UBUNTU_EVENTS is set.
+
+    Parameters
+    ----------
+    label : str
+        The step label.
+    result : Text
+        PASS or FAIL.
+    """
+    if EVENTS:
+        event = json.dumps({"label": label, "ok": result == PASS})
+        print(f"{EVENT}{event}", flush=True)
+    return
+
+
+def print_output(results: dict[str, Text]) -> None:
+    """Print the end of the output of every step that failed.
+
+    Parameters
+    ----------
+    results : dict[str, Text]
+        Mapping of step label to PASS or FAIL.
+    """
+    for label, result in results.items():
+        if result == FAIL and (tail := OUTPUT.tail(label).strip()):
+            lines = tail.splitlines()[-OUTPUT_LINES:]
+            print(f"\nOutput from: {label}\n")
+            print(textwrap.indent("\n".join(lines), "    "))
+    return
+
+
+def print_plan(plan: list[str]) -> None:
+    """Print the steps a converge run is about to execute.
+
+    Parameters
+    ----------
+    plan : list[str]
+        Labels of the planned steps, from StepRunner.plan().
+    """
+    if not plan:
+        print("Nothing to do. Everything is already up to date.")
+        return
+    print("The following steps will run to bring this machine up to date:\n")
+    for label in plan:
+        print(f"    {label}")
+    print()
+    return
+
+
+def print_timing(name: str) -> None:
+    """Print a timing summary of the run and save a Chrome trace.
+
+    Parameters
+    ----------
+    name : str
+        Name of the script. The trace is saved to
+        CACHE/traces/<name>-<timestamp>.json.
+    """
+    path = CACHE / "traces" / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    TRACER.export(path)
+    print(f"\n{TRACER.summary()}\n\nTrace saved to: {path}")
+    return
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,208 @@
+"""Batched GNOME settings, applied through dconf."""
+
+import tempfile
+from pathlib import Path
+from typing import Text
+
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import PASS
+from .utilities import spawn
+
+
+def parse_keyfile(text: str, base: str = "/") -> dict[str, dict[str, str]]:
+    """Parse settings in the format used by dconf dump and dconf load.
+
+    Parameters
+    ----------
+    text : str
+        The keyfile. Each [section] is a dconf directory relative to
+        base, with [/] meaning base itself.
+    base : str, optional
+        The dconf directory the keyfile was dumped from, by default /.
+
+    Returns
+    -------
+    dict[str, dict[str, str]]
+        Values (as GVariant text) keyed by absolute directory, then key.
+    """
+    keys: dict[str, dict[str, str]] = {}
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            name = line[1:-1]
+            path = base if name == "/" else f"{base}{name.strip('/')}/"
+            section = keys.setdefault(path, {})
+        elif section is not None and "=" in line:
+            key, value = line.split("=", 1)
+            section[key.strip()] = value.strip()
+    return keys
+
+
+def render_keyfile(keys: dict[str, dict[str, str]]) -> str:
+    """Build a keyfile that dconf can load at /.
+
+    Parameters
+    ----------
+    keys : dict[str, dict[str, str]]
+        Values keyed by absolute directory, then key.
+
+    Returns
+    -------
+    str
+        The keyfile.
+    """
+    sections = []
+    for path in sorted(keys):
+        name = path.strip("/") or "/"
+        lines = [f"[{name}]"]
+        lines += [f"{key}={value}" for key, value in sorted(keys[path].items())]
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections) + "\n"
+
+
+class DconfSettings:
+    """Collect GNOME settings and apply them in one dconf transaction.
+
+    Settings from every step are gathered here, compared with the
+    current database, and only the keys that differ are written, with a
+    single dconf load. Applying the same settings again is a no-op.
+    """
+
+    def __init__(self, dconf: str = "dconf") -> None:
+        """Create a new DconfSettings object.
+
+        Parameters
+        ----------
+        dconf : str, optional
+            The dconf program to run, by default 'dconf'. A stand-in
+            that keeps its state in a file can be used for testing.
+        """
+        self.dconf = dconf
+        self.keys: dict[str, dict[str, str]] = {}
+        self.resets: list[str] = []
+        return
+
+    def set(self, schema: str, key: str, value: str) -> None:
+        """Add a setting, named the way gsettings names it.
+
+        Parameters
+        ----------
+        schema : str
+            The schema id, e.g. org.gnome.desktop.session. Its dconf
+            directory is the id with dots turned into slashes.
+        key : str
+            The key, e.g. idle-delay.
+        value : str
+            The value as GVariant text, as shown by dconf dump (e.g.
+            uint32 0, or 'bottom-left' for a string).
+        """
+        path = f"/{schema.replace('.', '/')}/"
+        self.keys.setdefault(path, {})[key] = value
+        return
+
+    def load(self, base: str, file: Path, reset: str | None = None) -> None:
+        """Add every setting in a keyfile saved with dconf dump.
+
+        Parameters
+        ----------
+        base : str
+            The dconf directory the file was dumped from.
+        file : Path
+            The keyfile.
+        reset : str | None, optional
+            A directory to clear of any other keys, so it ends up
+            holding exactly what's in the file, by default None.
+        """
+        if DEBUG:
+            print(f"Opening: {file}")
+        for path, values in parse_keyfile(file.read_text(), base).items():
+            self.keys.setdefault(path, {}).update(values)
+        if reset is not None:
+            self.resets.append(reset)
+        return
+
+    def delta(
+        self, current: dict[str, dict[str, str]]
+    ) -> tuple[list[str], dict[str, dict[str, str]]]:
+        """Work out what has to change to reach the desired settings.
+
+        Parameters
+        ----------
+        current : dict[str, dict[str, str]]
+            The database as it is now, from parse_keyfile().
+
+        Returns
+        -------
+        tuple[list[str], dict[str, dict[str, str]]]
+            Directories that need clearing first, and the keys to load.
+        """
+        resets = []
+        for reset in self.resets:
+            for path, values in current.items():
+                wanted = self.keys.get(path, {})
+                if path.startswith(reset) and any(k not in wanted for k in values):
+                    resets.append(reset)
+                    break
+        changes: dict[str, dict[str, str]] = {}
+        for path, values in self.keys.items():
+            cleared = any(path.startswith(reset) for reset in resets)
+            for key, value in values.items():
+                if cleared or current.get(path, {}).get(key) != value:
+                    changes.setdefault(path, {})[key] = value
+        return resets, changes
+
+    def _current(self) -> dict[str, dict[str, str]] | None:
+        """Read the whole database with one dconf dump."""
+        with tempfile.TemporaryFile(mode="w+") as f:
+            if spawn([self.dconf, "dump", "/"], std_out=f) != 0:
+                return None
+            f.seek(0)
+            return parse_keyfile(f.read())
+
+    def is_current(self) -> bool:
+        """Determine if the database already holds every setting.
+
+        Returns
+        -------
+        bool
+            True if applying the settings would change nothing.
+        """
+        if (current := self._current()) is None:
+            return False
+        resets, changes = self.delta(current)
+        return not resets and not changes
+
+    def apply(self) -> Text:
+        """Apply the settings that differ from the current database.
+
+        Returns
+        -------
+        Text
+            Returns a unicode string representing either a green
+            checkmark (PASS) or a red X (FAIL).
+        """
+        if DEBUG:
+            print(f"\nLoading:\n{render_keyfile(self.keys)}")
+            return PASS
+        if (current := self._current()) is None:
+            return FAIL
+        resets, changes = self.delta(current)
+        for reset in resets:
+            if spawn([self.dconf, "reset", "-f", reset]) != 0:
+                return FAIL
+        if not changes:
+            return PASS
+        with tempfile.TemporaryFile(mode="w+") as f:
+            f.write(render_keyfile(changes))
+            f.seek(0)
+            if spawn([self.dconf, "load", "/"], std_in=f) != 0:
+                return FAIL
+        return PASS
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,397 @@
+"""Measure and speed up the startup of interactive shells.
+
+Startup is timed by running `<shell> -i -c exit` repeatedly. A separate
+run with xtrace turned on, and a timestamp in every trace line, shows
+which of the sourced files the time goes to. The optimizations move
+work that every shell would otherwise repeat (forking dircolors and
+lesspipe, compiling the zsh rc files, a second compinit) to install
+time. The shipped rc files pick up the results when they're present and
+fall back to doing the work themselves when they're not.
+"""
+
+import os
+import re
+import shutil
+import statistics
+import subprocess as sp
+import tempfile
+import time
+from pathlib import Path
+from typing import Text
+
+from .blocks import BlockEdit
+from .blocks import summarize_blocks
+from .blocks import update_blocks
+from .environment import CACHE
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import HOME
+from .environment import PASS
+from .utilities import run_one_command
+from .utilities import spawn
+
+# Shells that can be profiled, and the rc file each one reads.
+SHELLS = {"bash": ".bashrc", "zsh": ".zshrc"}
+
+# Startups timed per shell, unless told otherwise.
+RUNS = 10
+
+# Precomputed shell output. The rc files look for it under
+# ${UBUNTU_CACHE:-$HOME/.cache/ubuntu}/shell.
+SHELL_CACHE = CACHE / "shell"
+
+# Trace line prefixes set by the tracers below: a '+' per nesting level,
+# then the time and the file being run.
+TRACE_LINE = re.compile(r"^\++(\d+[.,]\d+) (.+?): ")
+
+# Replaces the usual rc files for a traced bash run. The trace goes to
+# its own descriptor so the shell's stderr is left alone.
+BASH_TRACER = """\
+exec {_fd}>"$UBUNTU_TRACE"
+BASH_XTRACEFD=$_fd
+PS4='+${EPOCHREALTIME} ${BASH_SOURCE[0]:-(shell)}: '
+set -x
+[ -f /etc/bash.bashrc ] && . /etc/bash.bashrc
+[ -f ~/.bashrc ] && . ~/.bashrc
+"""
+
+# Installed as $ZDOTDIR/.zshenv for a traced zsh run. Pointing ZDOTDIR
+# back at the home directory makes zsh go on to read the real files.
+ZSH_TRACER = """\
+exec 2>"$UBUNTU_TRACE"
+PS4='+%D{%s.%6.} %x: '
+setopt xtrace
+ZDOTDIR=$HOME
+[[ -f $ZDOTDIR/.zshenv ]] && source $ZDOTDIR/.zshenv
+"""
+
+# Stops /etc/zsh/zshrc from running compinit. OhMyZsh runs it anyway,
+# with a cached dump, so the global one is only extra work.
+COMPINIT = BlockEdit(
+    ".zshenv",
+    "compinit",
+    "skip_global_compinit=1",
+    replaces="skip_global_compinit=1",
+)
+
+
+def available() -> list[str]:
+    """List the shells that are installed.
+
+    Returns
+    -------
+    list[str]
+        Names of the shells in SHELLS that are on the PATH.
+    """
+    return [shell for shell in SHELLS if shutil.which(shell)]
+
+
+def _environment(home: Path, **extra: str) -> dict[str, str]:
+    """Build the environment for a shell started from a given home."""
+    env = dict(os.environ, HOME=str(home), LC_ALL="C", **extra)
+    env.setdefault("TERM", "xterm-256color")
+    env.pop("ZDOTDIR", None)
+    return env
+
+
+def _start(shell: str, env: dict[str, str], args: list[str] | None = None) -> float:
+    """Start an interactive shell that exits right away.
+
+    Returns
+    -------
+    float
+        Wall time in seconds, from fork to exit.
+    """
+    cmd = [shell, *(args if args else []), "-i", "-c", "exit"]
+    start = time.perf_counter()
+    spawn(cmd, std_in=sp.DEVNULL, std_out=sp.DEVNULL, std_err=sp.DEVNULL, env=env)
+    return time.perf_counter() - start
+
+
+def drop_caches() -> Text:
+    """Empty the page cache, so the next startup reads from disk.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    return run_one_command(cmd="sudo sh -c 'sync; echo 3 > /proc/sys/vm/drop_caches'")
+
+
+class StartupTimes:
+    """Startup times of one shell, in seconds."""
+
+    def __init__(self, shell: str) -> None:
+        """Create a new, empty StartupTimes object.
+
+        Parameters
+        ----------
+        shell : str
+            The shell.
+        """
+        self.shell = shell
+        self.first: float | None = None
+        self.warm: list[float] = []
+        self.cold: list[float] = []
+        return
+
+
+def time_startup(
+    shell: str,
+    runs: int = RUNS,
+    cold: bool = False,
+    home: Path = HOME,
+) -> StartupTimes:
+    """Time the startup of an interactive shell.
+
+    The first start is kept apart, since it may have to read files from
+    disk that later ones find in the page cache. The rest are warm.
+
+    Parameters
+    ----------
+    shell : str
+        The shell, e.g. zsh.
+    runs : int, optional
+        Number of warm starts, by default RUNS.
+    cold : bool, optional
+        Also time as many cold starts, each after emptying the page
+        cache, which needs sudo, by default False.
+    home : Path, optional
+        Home directory the shell starts in, by default HOME.
+
+    Returns
+    -------
+    StartupTimes
+        The times measured.
+    """
+    times = StartupTimes(shell)
+    if DEBUG:
+        print(f"\nTiming: {shell} -i -c exit ({runs} runs)")
+        return times
+    env = _environment(home)
+    times.first = _start(shell, env)
+    times.warm = [_start(shell, env) for _ in range(runs)]
+    for _ in range(runs if cold else 0):
+        if drop_caches() == FAIL:
+            break
+        times.cold.append(_start(shell, env))
+    return times
+
+
+def trace_startup(shell: str, home: Path = HOME) -> dict[str, float]:
+    """Break the startup time of a shell down by sourced file.
+
+    Each line of the trace is charged with the time until the next one,
+    to the file it came from. Time spent in a command that a file runs
+    (e.g. the fork of `pyenv init -`) is charged to that file. Tracing
+    slows the shell down, so the times are best read as shares.
+
+    Parameters
+    ----------
+    shell : str
+        The shell, bash or zsh.
+    home : Path, optional
+        Home directory the shell starts in, by default HOME.
+
+    Returns
+    -------
+    dict[str, float]
+        Seconds per file, slowest first. Time before the first traced
+        line (starting the shell itself, and for zsh /etc/zsh/zshenv),
+        and in commands that aren't from a file, is under '(shell)'.
+    """
+    if DEBUG:
+        print(f"\nTracing: {shell} -i -c exit")
+        return {}
+    with tempfile.TemporaryDirectory(prefix="ubuntu-trace-") as tmp:
+        trace = Path(tmp) / "trace"
+        env = _environment(home, UBUNTU_TRACE=str(trace))
+        if shell == "zsh":
+            (Path(tmp) / ".zshenv").write_text(ZSH_TRACER)
+            env["ZDOTDIR"] = tmp
+            args = []
+        else:
+            (Path(tmp) / "bashrc").write_text(BASH_TRACER)
+            args = ["--rcfile", str(Path(tmp) / "bashrc")]
+        start = time.time()
+        _start(shell, env, args)
+        end = time.time()
+        try:
+            lines = trace.read_text(errors="replace").splitlines()
+        except OSError:
+            return {}
+    marks = []
+    for line in lines:
+        if match := TRACE_LINE.match(line):
+            # The tracer's own lines count as part of starting the shell.
+            file = "(shell)" if match[2].startswith(tmp) else match[2]
+            marks.append((float(match[1].replace(",", ".")), file))
+    if not marks:
+        return {}
+    files = {"(shell)": marks[0][0] - start}
+    for (t, file), (t_next, _) in zip(marks, [*marks[1:], (end, "")]):
+        if file.startswith(str(home)):
+            file = f"~{file.removeprefix(str(home))}"
+        files[file] = files.get(file, 0.0) + max(0.0, t_next - t)
+    return dict(sorted(files.items(), key=lambda r: -r[1]))
+
+
+def _capture(cmd: list[str], dest: Path, env: dict[str, str]) -> bool:
+    """Save the output of a command to a file, atomically.
+
+    Returns
+    -------
+    bool
+        True if the command succeeded and its output was saved.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+    with os.fdopen(fd, "w") as f:
+        returncode = spawn(cmd, std_out=f, std_err=sp.DEVNULL, env=env)
+    if returncode != 0:
+        Path(tmp).unlink(missing_ok=True)
+        return False
+    os.replace(tmp, dest)
+    return True
+
+
+def precompute(home: Path = HOME, cache: Path = SHELL_CACHE) -> Text:
+    """Save the output of dircolors and lesspipe for the rc files to use.
+
+    Both only depend on a program and (for dircolors) ~/.dircolors, so
+    there's no need to fork them in every shell. The rc files use the
+    saved copy as long as it's newer than what it was made from.
+
+    Parameters
+    ----------
+    home : Path, optional
+        Home directory whose ~/.dircolors is used, by default HOME.
+    cache : Path, optional
+        Where the output is saved, by default SHELL_CACHE.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    if DEBUG:
+        print(f"\nPrecomputing: dircolors, lesspipe -> {cache}")
+        return PASS
+    env = _environment(home, SHELL="/bin/sh")
+    result = PASS
+    if shutil.which("dircolors"):
+        cmd = ["dircolors", "-b"]
+        if (dircolors := home / ".dircolors").is_file():
+            cmd.append(str(dircolors))
+        if not _capture(cmd, cache / "dircolors.sh", env):
+            result = FAIL
+    if shutil.which("lesspipe") and not _capture(
+        ["lesspipe"], cache / "lesspipe.sh", env
+    ):
+        result = FAIL
+    return result
+
+
+def compile_zsh(home: Path = HOME) -> Text:
+    """Speed up zsh startup for a home directory.
+
+    The rc files and completion dumps are compiled with zcompile. zsh
+    loads file.zwc in place of file whenever the .zwc is newer, so the
+    setup scripts remove it (see drop_compiled) when they replace the
+    file. The global compinit is also turned off in ~/.zshenv, since
+    OhMyZsh runs its own.
+
+    Parameters
+    ----------
+    home : Path, optional
+        The home directory, by default HOME.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    files = [home / ".zshrc", home / ".p10k.zsh", *sorted(home.glob(".zcompdump*"))]
+    files = [f for f in files if f.is_file() and f.suffix != ".zwc"]
+    if DEBUG:
+        print(f"\nCompiling: {[str(f) for f in files]}")
+        return PASS
+    report = update_blocks([COMPINIT], homes=[home])
+    if summarize_blocks(report) == FAIL:
+        return FAIL
+    if not files:
+        return PASS
+    script = 'for f in "$@"; do zcompile -R "$f"; done'
+    cmd = ["zsh", "-fc", script, "zsh", *map(str, files)]
+    returncode = spawn(cmd, std_out=sp.DEVNULL, std_err=sp.DEVNULL)
+    return PASS if returncode == 0 else FAIL
+
+
+def drop_compiled(files: list[Path]) -> None:
+    """Remove the zcompile'd copies of files that were just replaced.
+
+    A copied file keeps its source's mtime, which may be older than
+    file.zwc, and zsh would go on loading the old compiled copy.
+
+    Parameters
+    ----------
+    files : list[Path]
+        The files that were replaced.
+    """
+    for file in files:
+        Path(f"{file}.zwc").unlink(missing_ok=True)
+    return
+
+
+def print_times(results: dict[str, StartupTimes]) -> None:
+    """Print a table of startup times, in milliseconds.
+
+    Parameters
+    ----------
+    results : dict[str, StartupTimes]
+        The times to show, by row label.
+    """
+    pad = len(max(["Shell", *results], key=len)) + 3
+    columns = ["First", "Warm", "Best", "Cold"]
+    print(f"{'Shell':<{pad}}" + "".join(f"{c + '(ms)':>11}" for c in columns))
+    for label, r in results.items():
+        cells = [
+            r.first,
+            statistics.median(r.warm) if r.warm else None,
+            min(r.warm) if r.warm else None,
+            statistics.median(r.cold) if r.cold else None,
+        ]
+        row = [f"{'-':>11}" if c is None else f"{c * 1000:>11.1f}" for c in cells]
+        print(f"{label:.<{pad}}{''.join(row)}")
+    return
+
+
+def print_trace(shell: str, files: dict[str, float], limit: int = 10) -> None:
+    """Print where a shell's startup time goes, slowest files first.
+
+    Parameters
+    ----------
+    shell : str
+        The shell.
+    files : dict[str, float]
+        Seconds per file, from trace_startup().
+    limit : int, optional
+        Most files to show, by default 10.
+    """
+    if not files:
+        return
+    total = sum(files.values())
+    rows = list(files.items())[:limit]
+    pad = max(len(file) for file, _ in rows) + 3
+    print(f"\n{shell + ' (traced)':<{pad}}{'ms':>9}{'%':>7}")
+    for file, seconds in rows:
+        print(f"{file:.<{pad}}{seconds * 1000:>9.1f}{seconds / total:>7.0%}")
+    return
+
+
+if __name__ == "__main__":
+    pass
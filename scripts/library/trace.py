@@ -0,0 +1,163 @@
+"""Timing and resource tracing for ubuntu scripts."""
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Iterator
+
+
+class Tracer:
+    """Collect timings for steps and the commands they run.
+
+    Each step is recorded with its wall time, along with the CPU time
+    and peak RSS of every child process it launched. Results can be
+    exported as a Chrome trace (loadable in chrome://tracing or
+    Perfetto) and summarized as a table.
+    """
+
+    def __init__(self) -> None:
+        """Create a new, empty Tracer object."""
+        self.origin = time.perf_counter()
+        self.events: list[dict[str, Any]] = []
+        self.steps: dict[str, dict[str, float]] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        return
+
+    def _now(self) -> float:
+        """Microseconds since the tracer was created."""
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextlib.contextmanager
+    def step(self, label: str) -> Iterator[None]:
+        """Time a step. Commands run inside it are charged to it.
+
+        Parameters
+        ----------
+        label : str
+            The step label.
+        """
+        stats = {"wall": 0.0, "cpu": 0.0, "rss": 0.0, "commands": 0.0}
+        with self._lock:
+            self.steps[label] = stats
+        self._local.step = label
+        start = self._now()
+        try:
+            yield
+        finally:
+            end = self._now()
+            self._local.step = None
+            stats["wall"] = (end - start) / 1e6
+            self._event(label, "step", start, end, stats)
+        return
+
+    def command(self, cmd: str, start: float, rusage: Any) -> None:
+        """Record a finished child process.
+
+        Parameters
+        ----------
+        cmd : str
+            The command that was run.
+        start : float
+            When it started, from time.perf_counter().
+        rusage : Any
+            The child's resource usage, as returned by os.wait4, or None
+            if it's not available (e.g. the command ran in the
+            privileged helper).
+        """
+        start = (start - self.origin) * 1e6
+        end = self._now()
+        cpu = rusage.ru_utime + rusage.ru_stime if rusage else 0.0
+        rss = rusage.ru_maxrss / 1024 if rusage else 0.0  # KB on Linux
+        if (label := getattr(self._local, "step", None)) is not None:
+            stats = self.steps[label]
+            stats["cpu"] += cpu
+            stats["rss"] = max(stats["rss"], rss)
+            stats["commands"] += 1
+        args = {"cpu": round(cpu, 3), "rss": round(rss, 1), "step": label}
+        self._event(cmd, "command", start, end, args)
+        return
+
+    def _event(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        args: dict[str, Any],
+    ) -> None:
+        """Append a Chrome trace 'complete' event."""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round(start),
+            "dur": round(end - start),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": dict(args),
+        }
+        with self._lock:
+            self.events.append(event)
+        return
+
+    def export(self, path: Path) -> None:
+        """Write the trace in Chrome trace event format.
+
+        Parameters
+        ----------
+        path : Path
+            Where to write the JSON trace.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        with self._lock:
+            trace = {
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "otherData": {
+                    "cpu": round(own.ru_utime + own.ru_stime, 3),
+                    "rss": round(own.ru_maxrss / 1024, 1),
+                },
+            }
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        return
+
+    def summary(self) -> str:
+        """Build a table of steps, slowest first.
+
+        Returns
+        -------
+        str
+            One line per step with wall time, child CPU time, peak child
+            RSS, and number of commands run.
+        """
+        with self._lock:
+            rows = sorted(self.steps.items(), key=lambda r: -r[1]["wall"])
+        if not rows:
+            return ""
+        pad = len(max(self.steps, key=len)) + 3
+        lines = [f"{'Step':<{pad}}{'Wall(s)':>9}{'CPU(s)':>9}{'RSS(MB)':>9}{'Cmds':>6}"]
+        for label, stats in rows:
+            lines.append(
+                f"{label:.<{pad}}"
+                f"{stats['wall']:>9.2f}"
+                f"{stats['cpu']:>9.2f}"
+                f"{stats['rss']:>9.1f}"
+                f"{int(stats['commands']):>6}"
+            )
+        return "\n".join(lines)
+
+
+# Shared by the step runner and the command helpers in utilities.
+TRACER = Tracer()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,409 @@
+"""Performance profile for Ubuntu VMs.
+
+A stock install is tuned for bare metal with a physical disk. In a VM
+that costs idle CPU and I/O: the kernel swaps to a virtual disk, dirty
+pages build up and are flushed in large bursts, requests are scheduled
+twice (by the guest and again by the host), and background services
+index files, collect crash reports and check for updates.
+
+The profile is a set of generated files (a sysctl.d file, a zram
+generator config and a udev rule) plus masked systemd units. Everything
+is written under ROOT, so pointing UBUNTU_ROOT at a scratch tree shows
+exactly what would change. Only when ROOT is / are the settings also
+put into effect on the running system, and the snap refresh schedule
+(kept by snapd, not in a file) is set.
+"""
+
+import os
+import re
+import subprocess as sp
+import tempfile
+import time
+from pathlib import Path
+from typing import Text
+
+from .environment import CACHE
+from .environment import DEBUG
+from .environment import FAIL
+from .environment import PASS
+from .environment import ROOT
+from .patches import Edit
+from .patches import locate
+from .patches import pending
+from .utilities import patch_files
+from .utilities import run_one_command
+from .utilities import spawn
+
+# Package that turns the zram config below into a swap device at boot.
+ZRAM_PACKAGE = "systemd-zram-generator"
+
+# Kernel settings. Swap goes to compressed RAM (zram), which is much
+# cheaper than the virtual disk, so the kernel may swap as readily as it
+# drops file pages, and without reading ahead. Dirty pages are flushed
+# sooner and in smaller batches, so writes don't stall behind a large
+# flush to the host.
+SYSCTL = {
+    "vm.swappiness": "100",
+    "vm.page-cluster": "0",
+    "vm.dirty_background_ratio": "5",
+    "vm.dirty_ratio": "10",
+}
+
+# Half of RAM, up to 4 GiB, as compressed swap. It gets a higher
+# priority than any swap file, so it's used first.
+ZRAM = {
+    "zram-size": "min(ram / 2, 4096)",
+    "compression-algorithm": "zstd",
+}
+
+# Virtual disks. The host schedules the real I/O, so the guest passes
+# requests straight through.
+DISKS = re.compile(r"^(?:sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme\d+n\d+)$")
+SCHEDULER = "none"
+
+# Background services that are masked: crash reporting, file indexing,
+# and the apt timers. Automatic updates are already turned off in
+# 20auto-upgrades, but the timers still wake up to check. User units
+# are masked for every user.
+UNITS = [
+    ("system", "apport.service"),
+    ("system", "apport-autoreport.path"),
+    ("system", "apport-autoreport.timer"),
+    ("system", "apt-daily.timer"),
+    ("system", "apt-daily-upgrade.timer"),
+    ("system", "unattended-upgrades.service"),
+    ("user", "tracker-extract-3.service"),
+    ("user", "tracker-miner-fs-3.service"),
+]
+
+# snapd schedules its own refreshes (four a day by default), so there's
+# no timer unit to mask. Instead, snaps are refreshed once a month, on
+# the last Sunday at 03:00. They still get updates, which a hold would
+# stop altogether, and the setup scripts refresh them when they run.
+SNAP = {
+    "refresh.timer": "sun5,03:00",
+}
+
+# Where unit files installed by packages live.
+UNIT_DIRS = ["/usr/lib/systemd", "/lib/systemd"]
+
+SYSCTL_FILE = "/etc/sysctl.d/60-ubuntu-vm.conf"
+ZRAM_FILE = "/etc/systemd/zram-generator.conf"
+UDEV_FILE = "/etc/udev/rules.d/60-ubuntu-vm-scheduler.rules"
+
+# Before and after values from the last run.
+REPORT = CACHE / "vm_profile.txt"
+
+
+def profile_edits() -> list[Edit]:
+    """Build the files that make up the profile.
+
+    Returns
+    -------
+    list[Edit]
+        One write edit per file.
+    """
+    header = "# Generated by the ubuntu scripts. Changes will be overwritten."
+    sysctl = [header, *(f"{key} = {value}" for key, value in SYSCTL.items())]
+    zram = [header, "[zram0]", *(f"{key} = {value}" for key, value in ZRAM.items())]
+    kernels = "sd[a-z]*|vd[a-z]*|xvd[a-z]*|nvme[0-9]*n[0-9]*"
+    udev = [
+        header,
+        (
+            f'ACTION=="add|change", SUBSYSTEM=="block", KERNEL=="{kernels}", '
+            f'ATTR{{queue/scheduler}}="{SCHEDULER}"'
+        ),
+    ]
+    return [
+        Edit.write(SYSCTL_FILE, "\n".join(sysctl)),
+        Edit.write(ZRAM_FILE, "\n".join(zram)),
+        Edit.write(UDEV_FILE, "\n".join(udev)),
+    ]
+
+
+def _unit_path(scope: str, unit: str, root: Path) -> Path:
+    """Locate where masking a unit puts its symlink."""
+    return locate(f"/etc/systemd/{scope}/{unit}", root)
+
+
+def masked(scope: str, unit: str, root: Path = ROOT) -> bool:
+    """Determine if a unit is masked.
+
+    Parameters
+    ----------
+    scope : str
+        'system' or 'user'.
+    unit : str
+        Name of the unit, e.g. apport.service.
+    root : Path, optional
+        Root the paths are resolved under, by default ROOT.
+
+    Returns
+    -------
+    bool
+        True if the unit is linked to /dev/null.
+    """
+    link = _unit_path(scope, unit, root)
+    return link.is_symlink() and os.readlink(link) == os.devnull
+
+
+def mask_units(units: list[tuple[str, str]], root: Path = ROOT) -> Text:
+    """Mask systemd units, so nothing can start them.
+
+    Under /, systemctl masks the units, and the system units that are
+    installed are stopped. Under any other root, the symlinks are made
+    directly.
+
+    Parameters
+    ----------
+    units : list[tuple[str, str]]
+        Scope ('system' or 'user') and name of each unit.
+    root : Path, optional
+        Root the paths are resolved under, by default ROOT.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    if not (todo := [(s, u) for s, u in units if not masked(s, u, root)]):
+        return PASS
+    if DEBUG:
+        print(f"\nMasking: {[unit for _, unit in todo]}")
+        return PASS
+    if root != Path("/"):
+        for scope, unit in todo:
+            link = _unit_path(scope, unit, root)
+            try:
+                link.parent.mkdir(parents=True, exist_ok=True)
+                link.symlink_to(os.devnull)
+            except OSError:
+                return FAIL
+        return PASS
+    system = [unit for scope, unit in todo if scope == "system"]
+    user = [unit for scope, unit in todo if scope == "user"]
+    results = []
+    if system:
+        results.append(run_one_command(cmd=f"sudo systemctl mask {" ".join(system)}"))
+        # Stopping a unit that isn't installed fails, so skip those.
+        installed = [
+            unit
+            for unit in system
+            if any(locate(f"{d}/system/{unit}", root).exists() for d in UNIT_DIRS)
+        ]
+        if installed:
+            cmd = f"sudo systemctl stop {" ".join(installed)}"
+            results.append(run_one_command(cmd=cmd))
+    if user:
+        cmd = f"sudo systemctl --global mask {" ".join(user)}"
+        results.append(run_one_command(cmd=cmd))
+    return FAIL if FAIL in results else PASS
+
+
+def _read(path: str, root: Path) -> str:
+    """Read a one line value from /proc or /sys, or '?' if it can't be."""
+    try:
+        return locate(path, root).read_text().strip()
+    except OSError:
+        return "?"
+
+
+def snap_get(key: str, root: Path = ROOT) -> str:
+    """Read a snapd system setting.
+
+    Parameters
+    ----------
+    key : str
+        The setting, e.g. refresh.timer.
+    root : Path, optional
+        Root the profile is applied under, by default ROOT. snapd's
+        settings belong to the running system, so they're only read
+        under /.
+
+    Returns
+    -------
+    str
+        The value, '-' if it isn't set (snapd's default), or '?' if it
+        can't be read (e.g. under a scratch root, or without snapd).
+    """
+    if root != Path("/"):
+        return "?"
+    try:
+        with tempfile.TemporaryFile() as f:
+            returncode = spawn(
+                ["snap", "get", "system", key], std_out=f, std_err=sp.DEVNULL
+            )
+            f.seek(0)
+            value = f.read().decode(errors="replace").strip()
+    except OSError:
+        return "?"
+    # snap get fails for a setting that was never set.
+    return value if returncode == 0 and value else "-"
+
+
+def snapshot(root: Path = ROOT) -> dict[str, str]:
+    """Read the current value of every setting in the profile.
+
+    Parameters
+    ----------
+    root : Path, optional
+        Root the paths are resolved under, by default ROOT.
+
+    Returns
+    -------
+    dict[str, str]
+        Each setting and its value. Values that can't be read (e.g.
+        under a scratch root) are '?'.
+    """
+    values = {}
+    for key in SYSCTL:
+        values[key] = _read(f"/proc/sys/{key.replace(".", "/")}", root)
+    swaps = _read("/proc/swaps", root)
+    if swaps != "?":
+        swaps = "yes" if "/dev/zram" in swaps else "no"
+    values["zram swap"] = swaps
+    try:
+        disks = sorted(p.name for p in locate("/sys/block", root).iterdir())
+    except OSError:
+        disks = []
+    for disk in filter(DISKS.match, disks):
+        current = _read(f"/sys/block/{disk}/queue/scheduler", root)
+        if match := re.search(r"\[(\S+)\]", current):
+            current = match[1]
+        values[f"{disk} scheduler"] = current
+    for scope, unit in UNITS:
+        values[unit] = "masked" if masked(scope, unit, root) else "-"
+    for key in SNAP:
+        values[f"snap {key}"] = snap_get(key, root)
+    return values
+
+
+def _target(setting: str) -> str:
+    """Look up the value the profile sets for a setting."""
+    if setting in SYSCTL:
+        return SYSCTL[setting]
+    if setting == "zram swap":
+        return "yes"
+    if setting.endswith(" scheduler"):
+        return SCHEDULER
+    if setting.startswith("snap "):
+        return SNAP[setting.removeprefix("snap ")]
+    return "masked"
+
+
+def write_report(
+    before: dict[str, str],
+    after: dict[str, str],
+    root: Path = ROOT,
+    report: Path = REPORT,
+) -> None:
+    """Save a table of the settings before and after the profile.
+
+    Parameters
+    ----------
+    before : dict[str, str]
+        Values before the profile was applied, from snapshot().
+    after : dict[str, str]
+        Values after it was applied, from snapshot().
+    root : Path, optional
+        Root the profile was applied under, by default ROOT.
+    report : Path, optional
+        File the table is written to, by default REPORT.
+    """
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    rows = [("setting", "before", "profile", "after")]
+    for setting in dict.fromkeys([*before, *after]):
+        rows.append(
+            (
+                setting,
+                before.get(setting, "?"),
+                _target(setting),
+                after.get(setting, "?"),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    lines = [f"VM performance profile, {stamp} (root: {root})", ""]
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append("  ".join([*cells, row[3]]))
+    if DEBUG:
+        print(f"\nReport: {report}")
+        return
+    report.parent.mkdir(parents=True, exist_ok=True)
+    report.write_text("\n".join(lines) + "\n")
+    return
+
+
+def is_applied(root: Path = ROOT) -> bool:
+    """Determine if the profile's files and masks are all in place.
+
+    Parameters
+    ----------
+    root : Path, optional
+        Root the paths are resolved under, by default ROOT.
+
+    Returns
+    -------
+    bool
+        True if nothing would change.
+    """
+    if pending(profile_edits(), root=root):
+        return False
+    if not all(masked(scope, unit, root) for scope, unit in UNITS):
+        return False
+    return all(snap_get(key, root) in (value, "?") for key, value in SNAP.items())
+
+
+def apply_profile(root: Path = ROOT, report: Path = REPORT) -> Text:
+    """Write the profile under a root, and put it in effect under /.
+
+    Settings are read before and after, and saved to a report. Only
+    settings whose files changed are reloaded.
+
+    Parameters
+    ----------
+    root : Path, optional
+        Root the files are written under, by default ROOT.
+    report : Path, optional
+        File the before and after values are written to, by default
+        REPORT.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    before = snapshot(root)
+    edits = profile_edits()
+    changed = pending(edits, root=root)
+    if root != Path("/") and not DEBUG:
+        for edit in edits:
+            locate(edit.path, root).parent.mkdir(parents=True, exist_ok=True)
+    results = [patch_files(edits, root=root), mask_units(UNITS, root=root)]
+    if root == Path("/"):
+        commands = []
+        if SYSCTL_FILE in changed:
+            commands.append(f"sudo sysctl -p {SYSCTL_FILE}")
+        if UDEV_FILE in changed:
+            commands.append("sudo udevadm control --reload")
+            commands.append("sudo udevadm trigger -s block -c change")
+        if ZRAM_FILE in changed:
+            # The generator makes the swap unit when systemd reloads.
+            commands.append("sudo systemctl daemon-reload")
+            commands.append("sudo systemctl start dev-zram0.swap")
+        # A value of '?' means snapd isn't there to ask.
+        if snap := [
+            f"{key}={value}"
+            for key, value in SNAP.items()
+            if before[f"snap {key}"] not in (value, "?")
+        ]:
+            commands.append(f"sudo snap set system {' '.join(snap)}")
+        results += [run_one_command(cmd=cmd) for cmd in commands]
+    write_report(before, snapshot(root), root=root, report=report)
+    return FAIL if FAIL in results else PASS
+
+
+if __name__ == "__main__":
+    pass
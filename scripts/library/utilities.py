@@ -1,22 +1,67 @@
 #!/usr/bin/env python3
 """Utilities for ubuntu scripts."""
 
+import codecs
+import concurrent.futures as cf
+import contextlib
+import filecmp
+import fnmatch
+import grp
+import hashlib
+import http.client
+import io
+import json
 import os
 import pathlib
+import pwd
 import re
 import shlex
 import shutil
+import stat
 import subprocess as sp
 import sys
-import tempfile as tf
+import tempfile
+import threading
+import time
+import urllib.parse
 from typing import Any
+from typing import Callable
+from typing import Iterator
 from typing import Text
 
+from .bundle import Bundle
+from .bundle import active
+from .classes import CopyReport
+from .classes import PermissionReport
+from .classes import PermissionRule
+from .classes import RecordingBackend
+from .downloads import DownloadCache
 from .environment import DEBUG
 from .environment import FAIL
+from .environment import FAKE
 from .environment import MAJOR
 from .environment import MINOR
 from .environment import PASS
+from .environment import ROOT
+from .environment import SYSTEM
+from .environment import UBUNTU
+from .environment import WORKERS
+from .output import OUTPUT
+from .patches import Edit
+from .patches import apply_edits
+from .patches import locate
+from .patches import pending
+from .privileged import PrivilegedHelper
+from .trace import TRACER
+
+CHUNK = 64 * 1024
+REDIRECTS = (301, 302, 303, 307, 308)
+
+# Stand-in for process creation, see set_backend().
+_backend: Callable[..., int] | None = RecordingBackend(clones=True) if FAKE else None
+
+# Helper that runs sudo commands, see set_helper().
+_helper: PrivilegedHelper | None = None
 
 
 def clear() -> None:
@@ -78,6 +123,153 @@ def lean_text(str_in: str) -> str:
     return "\n".join(clean_lines)
 
 
+def set_backend(backend: Callable[..., int] | None) -> None:
+    """Replace process creation with a stand-in.
+
+    Every command the scripts run goes through spawn(). A backend is
+    called with the same arguments instead of starting a process, and
+    returns the exit code to report. This lets benchmarks and dry runs
+    drive whole scripts without touching the system.
+
+    Parameters
+    ----------
+    backend : Callable[..., int] | None
+        The stand-in (e.g. a RecordingBackend), or None to go back to
+        running real processes.
+    """
+    global _backend
+    _backend = backend
+    return
+
+
+def set_helper(helper: PrivilegedHelper | None) -> None:
+    """Route sudo commands through a privileged helper.
+
+    While a helper is set, spawn() hands any command starting with sudo
+    to it, rather than running sudo again.
+
+    Parameters
+    ----------
+    helper : PrivilegedHelper | None
+        A started helper, or None to go back to running sudo.
+    """
+    global _helper
+    _helper = helper
+    return
+
+
+@contextlib.contextmanager
+def privileged_session() -> Iterator[None]:
+    """Run privileged commands through one helper for a block of code.
+
+    The helper is started with non-interactive sudo, so sudo should be
+    primed (e.g. with "sudo ls") first. If the helper can't be started,
+    commands simply fall back to running sudo each time.
+    """
+    if DEBUG or _backend is not None:
+        yield
+        return
+    helper = PrivilegedHelper()
+    if helper.start():
+        set_helper(helper)
+    try:
+        yield
+    finally:
+        set_helper(None)
+        helper.stop()
+    return
+
+
+def _privileged(args: list[str]) -> bool:
+    """Determine if a command is a plain sudo the helper can run."""
+    return len(args) > 1 and args[0] == "sudo" and not args[1].startswith("-")
+
+
+def _sink(std_out: Any, std_err: Any) -> Callable[[bytes], None]:
+    """Pick where output from the privileged helper goes.
+
+    The helper merges stdout and stderr, so output goes to the first
+    stream that isn't being discarded, as it arrives.
+    """
+    for stream, default in ((std_out, sys.stdout), (std_err, sys.stderr)):
+        if stream is sp.PIPE:
+            return OUTPUT.write
+        if stream is sp.DEVNULL:
+            continue
+        target: Any = stream or default
+        if not isinstance(target, io.TextIOBase):
+            return target.write
+        # A chunk can end part way through a character, so decode
+        # incrementally.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        def write(chunk: bytes, target: Any = target) -> None:
+            target.write(decoder.decode(chunk))
+            target.flush()
+
+        return write
+    return lambda _: None
+
+
+def spawn(
+    args: list[str],
+    std_in: Any | None = None,
+    std_out: Any | None = None,
+    std_err: Any | None = None,
+    env: dict[str, str] | None = None,
+) -> int:
+    """Run a process to completion and record its resource usage.
+
+    The child is reaped with os.wait4, so its CPU time and peak RSS are
+    charged to the current step in the tracer. Output can go to a file,
+    DEVNULL, or the terminal. If std_out is PIPE, output is streamed
+    into the current step's OUTPUT log instead (pass STDOUT as std_err
+    to include stderr); other pipes are not drained here.
+
+    Parameters
+    ----------
+    args : list[str]
+        The program and its arguments.
+    std_in : Any | None, optional
+        File object (or DEVNULL) for stdin, by default None.
+    std_out : Any | None, optional
+        File object, DEVNULL or PIPE for stdout, by default None.
+    std_err : Any | None, optional
+        File object, DEVNULL or STDOUT for stderr, by default None.
+    env : dict[str, str] | None, optional
+        Environment for the process, or None to inherit this one. Only
+        used for commands that don't go through the privileged helper,
+        by default None.
+
+    Returns
+    -------
+    int
+        The exit code of the process.
+    """
+    if _backend is not None:
+        return _backend(args, std_in=std_in, std_out=std_out, std_err=std_err)
+    start = time.perf_counter()
+    if _privileged(args) and _helper is not None and std_in in (None, sp.DEVNULL):
+        try:
+            returncode = _helper.run_stream(args[1:], _sink(std_out, std_err))
+        except OSError:
+            pass  # The helper has gone away. Fall back to sudo.
+        else:
+            TRACER.command(shlex.join(args), start, None)
+            return returncode
+    proc = sp.Popen(args, stdin=std_in, stdout=std_out, stderr=std_err, env=env)
+    if proc.stdout is not None:
+        # Stream the output as it arrives, so a noisy command never has
+        # more than one chunk of it in memory.
+        with proc.stdout:
+            while chunk := os.read(proc.stdout.fileno(), CHUNK):
+                OUTPUT.write(chunk)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    TRACER.command(shlex.join(args), start, usage)
+    return proc.returncode
+
+
 def run_one_command(
     cmd: str,
     capture: bool = True,
@@ -92,8 +284,9 @@ def run_one_command(
         A shell command (with potentially options) saved as a Python
         string.
     capture : bool, optional
-        Determine if stdout should be suppressed (True) or displayed
-        (False), by default True.
+        Determine if output should be captured (True) or displayed
+        (False), by default True. Captured output isn't printed, but
+        its tail is shown if the step running the command fails.
     std_in : Any | None
         If stdin needs to be redirected on the command line you can
         pass an open file descriptor here for that purpose. It can be
@@ -113,13 +306,18 @@ def run_one_command(
         print(f"\nRunning: {shlex.split(cmd)}")
         return PASS
     else:
-        result = sp.run(
+        # Captured output is kept in a bounded buffer for the current
+        # step, so its tail can be shown if the step fails.
+        std_err = sp.DEVNULL if capture else None
+        if std_out is None and capture:
+            std_out, std_err = sp.PIPE, sp.STDOUT
+        returncode = spawn(
             shlex.split(cmd),
-            capture_output=capture,
-            stdin=std_in,
-            stdout=std_out,
+            std_in=std_in,
+            std_out=std_out,
+            std_err=std_err,
         )
-        if result.returncode != 0:
+        if returncode != 0:
             return FAIL
     return PASS
 
@@ -167,6 +365,10 @@ def run_shell_script(
 ) -> Text:
     """Run a remote shell script.
 
+    The script is fetched through the download cache, so a copy that is
+    already cached is only revalidated with the server rather than
+    downloaded again. With a bundle active, the bundled copy is run.
+
     Parameters
     ----------
     script : str
@@ -186,40 +388,699 @@ def run_shell_script(
         Returns a unicode string representing either a green checkmark
         (PASS) or a red X (FAIL).
     """
-    with tf.NamedTemporaryFile(mode="w+", delete=True) as f:
-        cmd = f"curl -sL {script}"
-        result = run_one_command(cmd, capture=False, std_out=f)
-        if result == PASS:
-            fname = f.name
-            cmd = f"{shell} {fname}"
-            if as_sudo:
-                cmd = f"sudo {cmd}"
-            if options != "":
-                cmd = f"{cmd} {options}"
-            result = run_one_command(cmd, capture=capture)
-    return result
+    if DEBUG:
+        print(f"\nFetching: {script}")
+        return PASS
+    if (cmd := _script_command(script, shell, as_sudo, options)) is None:
+        return FAIL
+    return run_one_command(cmd, capture=capture)
+
+
+def _script_command(
+    script: str, shell: str, as_sudo: bool, options: str
+) -> str | None:
+    """Build the command that runs a remote script.
+
+    The script comes from the active bundle if there is one, otherwise
+    from the download cache.
+
+    Returns
+    -------
+    str | None
+        The command, or None if the script could not be fetched.
+    """
+    if (bundle := active()) is not None:
+        path, env = bundle.file(script), bundle.env(script)
+    else:
+        path, env = DownloadCache().fetch(script), {}
+    if path is None:
+        return None
+    cmd = f"{shell} {shlex.quote(str(path))}"
+    if env:
+        assign = " ".join(shlex.quote(f"{k}={v}") for k, v in env.items())
+        cmd = f"env {assign} {cmd}"
+    if as_sudo:
+        cmd = f"sudo {cmd}"
+    if options != "":
+        cmd = f"{cmd} {options}"
+    return cmd
+
+
+def _writable(file: pathlib.Path) -> bool:
+    """Determine if a file can be replaced (or created) without sudo."""
+    if file.exists():
+        return os.access(file, os.W_OK) and os.access(file.parent, os.W_OK)
+    # Missing directories are created along with the file.
+    parent = file.parent
+    while not parent.exists():
+        parent = parent.parent
+    return os.access(parent, os.W_OK)
+
+
+def _log_changes(report: dict[str, Any]) -> bool:
+    """Write a patch report to the current step's output.
+
+    Returns
+    -------
+    bool
+        True if every file was patched (or already up to date).
+    """
+    ok = True
+    for path, changes in report.items():
+        if isinstance(changes, str):
+            OUTPUT.write(f"{path}: {changes}\n".encode())
+            ok = False
+            continue
+        for change in changes:
+            OUTPUT.write(f"{path}: {change}\n".encode())
+    return ok
+
+
+def patch_files(edits: list[Edit], root: pathlib.Path = ROOT) -> Text:
+    """Apply edits to configuration files.
+
+    Files that are already up to date are left alone, so re-running a
+    patch doesn't spawn anything. Under a scratch root we can write to,
+    files are patched in process. The live system (root /) is always
+    patched in one sudo call, even when running as root, so the edits
+    are made by the same standalone script either way. Each change (or
+    error) is written to the step's output.
+
+    Parameters
+    ----------
+    edits : list[Edit]
+        The edits to apply, see library.patches.
+    root : pathlib.Path, optional
+        Root the paths are resolved under, by default ROOT.
+
+    Returns
+    -------
+    Text
+        Returns a unicode string representing either a green checkmark
+        (PASS) or a red X (FAIL).
+    """
+    plan = [edit.as_dict() for edit in edits]
+    if DEBUG:
+        print(f"\nPatching: {plan}")
+        return PASS
+    if not (paths := pending(edits, root=root)):
+        return PASS
+    scratch = root.resolve() != pathlib.Path("/")
+    if scratch and all(_writable(locate(path, root)) for path in paths):
+        return PASS if _log_changes(apply_edits(edits, root=root)) else FAIL
+    script = pathlib.Path(__file__).with_name("patches.py")
+    args = ["sudo", sys.executable, str(script), "--root", str(root)]
+    args += ["--plan", json.dumps(plan)]
+    with tempfile.TemporaryFile() as f:
+        returncode = spawn(args, std_out=f, std_err=sp.DEVNULL)
+        f.seek(0)
+        try:
+            report = json.load(f)
+        except ValueError:
+            OUTPUT.write(b"Could not read the report from patches.py\n")
+            return FAIL
+    if not _log_changes(report) or returncode != 0:
+        return FAIL
+    return PASS
+
+
+def _get(
+    pool: dict[tuple[str, str], http.client.HTTPConnection],
+    url: str,
+    headers: dict[str, str],
+    max_redirects: int = 5,
+) -> http.client.HTTPResponse:
+    """Send a GET request over a pooled keep-alive connection.
+
+    Parameters
+    ----------
+    pool : dict[tuple[str, str], http.client.HTTPConnection]
+        Open connections, keyed by (scheme, host). New connections are
+        added as needed, and broken ones removed.
+    url : str
+        The URL to request.
+    headers : dict[str, str]
+        Extra request headers.
+    max_redirects : int, optional
+        Number of redirects to follow, by default 5.
+
+    Returns
+    -------
+    http.client.HTTPResponse
+        The final (non-redirect) response. Its body must be read in full
+        before the connection can be used again.
+
+    Raises
+    ------
+    http.client.HTTPException
+        If there are too many redirects, or the request fails.
+    """
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        if (conn := pool.get(key)) is None:
+            if parts.scheme == "https":
+                conn = http.client.HTTPSConnection(parts.netloc, timeout=60)
+            else:
+                conn = http.client.HTTPConnection(parts.netloc, timeout=60)
+            pool[key] = conn
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            pool.pop(key).close()
+            raise
+        location = response.getheader("Location")
+        if response.status not in REDIRECTS or not location:
+            return response
+        response.read()
+        url = urllib.parse.urljoin(url, location)
+    raise http.client.HTTPException(f"Too many redirects: {url}")
+
+
+def _place(src: pathlib.Path, dest: pathlib.Path) -> tuple[Text, bool]:
+    """Copy a file into place, atomically, unless dest already matches it.
+
+    Returns
+    -------
+    tuple[Text, bool]
+        PASS or FAIL, and whether the destination was changed.
+    """
+    if dest.exists() and filecmp.cmp(src, dest, shallow=False):
+        return PASS, False
+    part = dest.with_name(f".{dest.name}.part")
+    try:
+        shutil.copyfile(src, part)
+        os.replace(part, dest)
+    except OSError:
+        part.unlink(missing_ok=True)
+        return FAIL, False
+    return PASS, True
+
+
+def _download(
+    pool: dict[tuple[str, str], http.client.HTTPConnection],
+    cache: DownloadCache,
+    url: str,
+    dest: pathlib.Path,
+    retries: int,
+    backoff: float,
+) -> tuple[Text, bool]:
+    """Download one URL through the cache into place, retrying on failure.
+
+    A copy that's already cached is revalidated with a conditional
+    request, and the body is only downloaded if it changed. The body
+    goes to a partial file in the cache. If an attempt is cut short, the
+    next one resumes it with a Range request, guarded by If-Range so a
+    file that changed on the server in the meantime starts over instead
+    of being spliced onto the old part. Once complete, it's added to the
+    cache and copied to the destination if that differs. If the server
+    can't be reached, a cached copy is used (with a warning in the
+    step's output).
+
+    Parameters
+    ----------
+    pool : dict[tuple[str, str], http.client.HTTPConnection]
+        The calling thread's connection pool.
+    cache : DownloadCache
+        The download cache.
+    url : str
+        The URL to download.
+    dest : pathlib.Path
+        Where to put the file.
+    retries : int
+        Number of additional attempts after the first one fails.
+    backoff : float
+        Delay before the first retry, in seconds. It doubles with each
+        retry.
+
+    Returns
+    -------
+    tuple[Text, bool]
+        PASS or FAIL, and whether the destination was changed.
+    """
+    cached, entry = cache.lookup(url)
+    if cache.offline:
+        return _place(cached, dest) if cached else (FAIL, False)
+    part = cache.partial(url)
+    # Validator of the response the part came from, for If-Range.
+    validator = part.with_name(f"{part.name}.validator")
+    error = ""
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        headers: dict[str, str] = {}
+        offset = part.stat().st_size if part.exists() else 0
+        if offset and validator.exists():
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator.read_text()
+        elif offset:
+            # Nothing to check the part against, so it can't be resumed.
+            part.unlink()
+        if "Range" not in headers and cached:
+            if etag := entry.get("etag"):
+                headers["If-None-Match"] = etag
+            if modified := entry.get("modified"):
+                headers["If-Modified-Since"] = modified
+        try:
+            response = _get(pool, url, headers)
+            if response.status == 304 and cached:
+                response.read()
+                return _place(cached, dest)
+            if response.status == 416:
+                # The part doesn't fit the file on the server any more.
+                # Start over, without counting it as a failed attempt.
+                response.read()
+                part.unlink(missing_ok=True)
+                response = _get(pool, url, {})
+            if response.status not in (200, 206):
+                response.read()
+                part.unlink(missing_ok=True)
+                error = f"HTTP {response.status}"
+                # Client errors won't go away by asking again, apart
+                # from timeouts and rate limiting.
+                if response.status < 500 and response.status not in (408, 429):
+                    break
+                continue
+            etag = response.getheader("ETag")
+            modified = response.getheader("Last-Modified")
+            if response.status == 200:
+                # A strong ETag identifies the exact content, so it's
+                # the better validator. Weak ones can't be used.
+                if etag and not etag.startswith("W/"):
+                    validator.write_text(etag)
+                elif modified:
+                    validator.write_text(modified)
+                else:
+                    validator.unlink(missing_ok=True)
+            with open(part, "ab" if response.status == 206 else "wb") as f:
+                while chunk := response.read(CHUNK):
+                    f.write(chunk)
+            if response.length:
+                raise http.client.IncompleteRead(b"", response.length)
+        except (OSError, http.client.HTTPException) as e:
+            error = str(e)
+            continue
+        validator.unlink(missing_ok=True)
+        return _place(cache.store(url, part, etag=etag, modified=modified), dest)
+    else:
+        # The server couldn't be reached (as opposed to refusing the
+        # request), so a cached copy is better than nothing.
+        if cached:
+            msg = f"\nCould not download {url} ({error}), using the cached copy\n"
+            OUTPUT.write(msg.encode())
+            return _place(cached, dest)
+    OUTPUT.write(f"\nCould not download {url} ({error})\n".encode())
+    return FAIL, False
+
+
+def _unbundle(bundle: Bundle, url: str, dest: pathlib.Path) -> tuple[Text, bool]:
+    """Copy a file out of a bundle into place, if it differs.
+
+    Returns
+    -------
+    tuple[Text, bool]
+        PASS or FAIL, and whether the destination was changed.
+    """
+    if (src := bundle.file(url)) is None:
+        return FAIL, False
+    return _place(src, dest)
+
+
+def download_files(
+    targets: list[tuple[str, pathlib.Path]],
+    workers: int = WORKERS,
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> tuple[dict[pathlib.Path, Text], list[pathlib.Path]]:
+    """Download a batch of files concurrently.
+
+    Each worker thread keeps its own keep-alive connection per host, so
+    files from the same server reuse connections instead of opening a
+    new one (and a new TLS handshake) per file. Files go through the
+    download cache, so ones that are already cached are only
+    revalidated. With a bundle active, files are copied out of it
+    instead.
+
+    Parameters
+    ----------
+    targets : list[tuple[str, pathlib.Path]]
+        A list of tuples. Files will be downloaded from URL [0] to
+        destination [1].
+    workers : int, optional
+        Number of concurrent downloads, by default WORKERS.
+    retries : int, optional
+        Attempts per file after the first one fails, by default 3.
+    backoff : float, optional
+        Initial delay between attempts in seconds, by default 1.0.
+
+    Returns
+    -------
+    tuple[dict[pathlib.Path, Text], list[pathlib.Path]]
+        PASS or FAIL for each destination, and the destinations whose
+        content changed.
+    """
+    if DEBUG:
+        for url, dest in targets:
+            print(f"\nDownloading: {url}\nTo: {dest}")
+        return {dest: PASS for _, dest in targets}, []
+
+    bundle = active()
+    cache = DownloadCache()
+    local = threading.local()
+    pools: list[dict[tuple[str, str], http.client.HTTPConnection]] = []
+
+    def work(url: str, dest: pathlib.Path) -> tuple[Text, bool]:
+        if (pool := getattr(local, "pool", None)) is None:
+            pool = local.pool = {}
+            pools.append(pool)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if bundle is not None:
+            return _unbundle(bundle, url, dest)
+        return _download(pool, cache, url, dest, retries=retries, backoff=backoff)
+
+    with cf.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {dest: executor.submit(work, url, dest) for url, dest in targets}
+        outcome = {dest: future.result() for dest, future in futures.items()}
+    for pool in pools:
+        for conn in pool.values():
+            conn.close()
+
+    results = {dest: result for dest, (result, _) in outcome.items()}
+    changed = [dest for dest, (_, change) in outcome.items() if change]
+    return results, changed
+
+
+def _load_excludes(path: pathlib.Path) -> list[str]:
+    """Read rsync-style exclude patterns from a file.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        A file with one pattern per line. Blank lines and comments are
+        ignored.
+
+    Returns
+    -------
+    list[str]
+        The patterns, or an empty list if the file can't be read.
+    """
+    try:
+        with open(path, "r") as f:
+            return lean_text(f.read()).split("\n")
+    except OSError:
+        return []
+
+
+def _excluded(file: pathlib.Path, patterns: list[str]) -> bool:
+    """Determine if a source file matches an exclude pattern.
+
+    Patterns follow rsync conventions: a leading '/' anchors the pattern
+    to the root of the repo, a trailing '/' only matches directories,
+    and anything else is matched against the file's name.
+
+    Parameters
+    ----------
+    file : pathlib.Path
+        The source file.
+    patterns : list[str]
+        Exclude patterns.
+
+    Returns
+    -------
+    bool
+        True if the file should not be copied.
+    """
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            continue
+        if pattern.startswith("/"):
+            try:
+                relative = file.resolve().relative_to(UBUNTU)
+            except ValueError:
+                continue
+            if fnmatch.fnmatch(str(relative), pattern[1:]):
+                return True
+        elif fnmatch.fnmatch(file.name, pattern):
+            return True
+    return False
+
+
+def _same_file(src: pathlib.Path, dest: pathlib.Path, record: bool = True) -> bool:
+    """Determine if a destination already matches its source.
+
+    Size and modification time are checked first, since copies made by
+    copy_files carry over the source's mtime. Only when the sizes match
+    but the times differ are the contents hashed.
+
+    Parameters
+    ----------
+    src : pathlib.Path
+        The source file.
+    dest : pathlib.Path
+        The destination file.
+    record : bool, optional
+        When the contents match but the times don't, give dest the
+        source's mtime, so the next check can stop at the stat, by
+        default True.
+
+    Returns
+    -------
+    bool
+        True if dest exists and has the same content as src.
+    """
+    try:
+        s, d = src.stat(), dest.stat()
+    except OSError:
+        return False
+    if s.st_size != d.st_size:
+        return False
+    if s.st_mtime_ns == d.st_mtime_ns:
+        return True
+    with open(src, "rb") as f1, open(dest, "rb") as f2:
+        h1 = hashlib.file_digest(f1, "sha256").digest()
+        h2 = hashlib.file_digest(f2, "sha256").digest()
+    if h1 != h2:
+        return False
+    # Record the match so the next run can stop at the stat check.
+    if record:
+        os.utime(dest, ns=(d.st_atime_ns, s.st_mtime_ns))
+    return True
+
 
+def _copy_file(src: pathlib.Path, dest: pathlib.Path) -> None:
+    """Copy a file atomically, letting the kernel move the data.
 
-def copy_files(targets: list[tuple[pathlib.Path, pathlib.Path]]) -> None:
+    The content is written to a temporary file in the destination's
+    directory with os.copy_file_range (falling back to os.sendfile),
+    which avoids copying through user space. The temporary file gets the
+    source's mode and mtime, and is then renamed over the destination.
+
+    Parameters
+    ----------
+    src : pathlib.Path
+        The source file.
+    dest : pathlib.Path
+        The destination file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+    try:
+        with open(src, "rb") as f_in, os.fdopen(fd, "wb"):
+            remaining = os.fstat(f_in.fileno()).st_size
+            try:
+                while remaining > 0:
+                    if not (n := os.copy_file_range(f_in.fileno(), fd, remaining)):
+                        break
+                    remaining -= n
+            except OSError:
+                # Not supported across these filesystems. Start over
+                # with sendfile, which works anywhere on Linux.
+                f_in.seek(0)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                offset = 0
+                while n := os.sendfile(fd, f_in.fileno(), offset, CHUNK):
+                    offset += n
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+    return
+
+
+def copy_files(
+    targets: list[tuple[pathlib.Path, pathlib.Path]],
+    exclude: pathlib.Path | None = SYSTEM / "rsync_exclude.txt",
+    dry_run: bool = False,
+) -> CopyReport:
     """Copy files from source to destination.
 
+    Copies are incremental: a destination that already matches its
+    source is left alone. Changed files are replaced atomically, so a
+    reader never sees a half-written file.
+
     Parameters
     ----------
     targets : list[tuple[pathlib.Path, pathlib.Path]]
         A list of tuples. Files will be copied from source [0] to
-        destination [1].
+        destination [1]. If the source name contains a '*' it is
+        expanded as a glob, and the destination must be a directory.
+    exclude : pathlib.Path | None, optional
+        File of rsync-style patterns for source files that should never
+        be copied, by default SYSTEM/rsync_exclude.txt. None disables
+        exclusion.
+    dry_run : bool, optional
+        Only compare files. Those that would be copied are reported as
+        copied, but nothing is written, by default False.
+
+    Returns
+    -------
+    CopyReport
+        The files that were copied, skipped, or failed.
     """
+    report = CopyReport()
+    patterns = _load_excludes(exclude) if exclude else []
     for target in targets:
         copy_from, copy_to = target[0], target[1]
-        if DEBUG:
+        if DEBUG and not dry_run:
             print(f"\nCopying: {copy_from}\nTo: {copy_to}")
+            continue
+        if "*" in copy_from.name:
+            files = sorted(copy_from.parent.resolve().glob(copy_from.name))
         else:
-            if "*" in copy_from.name:
-                for file in copy_from.parent.resolve().glob(copy_from.name):
-                    shutil.copy(file, copy_to)
+            files = [copy_from]
+        into_dir = copy_to.is_dir()
+        for file in files:
+            dest = copy_to / file.name if into_dir else copy_to
+            # Write through symlinks, as shutil.copy would.
+            dest = dest.resolve()
+            try:
+                # A dry run is used as a probe, so it mustn't touch dest.
+                excluded = _excluded(file, patterns)
+                if excluded or _same_file(file, dest, record=not dry_run):
+                    report.skipped.append(file)
+                else:
+                    if not dry_run:
+                        _copy_file(file, dest)
+                    report.copied.append(file)
+            except OSError:
+                report.failed.append(file)
+    return report
+
+
+def _owner(spec: str) -> tuple[int, int]:
+    """Look up the ids for an owner given as 'user' or 'user:group'.
+
+    Parameters
+    ----------
+    spec : str
+        The owner. Either part may be empty to leave it unchanged.
+
+    Returns
+    -------
+    tuple[int, int]
+        The uid and gid, with -1 for a part that isn't given.
+
+    Raises
+    ------
+    KeyError
+        If the user or group doesn't exist.
+    """
+    user, _, group = spec.partition(":")
+    uid = pwd.getpwnam(user).pw_uid if user else -1
+    gid = grp.getgrnam(group).gr_gid if group else -1
+    return uid, gid
+
+
+def fix_permissions(
+    targets: list[tuple[pathlib.Path, list[PermissionRule]]],
+    dry_run: bool = False,
+) -> PermissionReport:
+    """Bring the modes and owners in directory trees in line with rules.
+
+    Each tree is walked in-process with os.scandir, and an entry is only
+    changed when its current mode or owner differs from what the first
+    matching rule calls for, so a tree that's already correct costs a
+    stat per entry and nothing more. Symlinks are never followed or
+    changed. A root that doesn't exist is skipped.
+
+    Parameters
+    ----------
+    targets : list[tuple[pathlib.Path, list[PermissionRule]]]
+        A list of tuples. Rules [1] are applied to the tree at root [0],
+        including the root itself.
+    dry_run : bool, optional
+        Only compare. Entries that would change are reported as changed,
+        but nothing is written, by default False.
+
+    Returns
+    -------
+    PermissionReport
+        The entries that were changed or failed, and how many were
+        checked.
+    """
+    report = PermissionReport()
+    owners: dict[str, tuple[int, int]] = {}
+    for root, rules in targets:
+        if DEBUG and not dry_run:
+            print(f"\nFixing permissions: {root}")
+            continue
+        try:
+            for rule in rules:
+                if rule.owner and rule.owner not in owners:
+                    owners[rule.owner] = _owner(rule.owner)
+            st = root.stat()
+        except (KeyError, OSError):
+            if root.exists():
+                report.failed.append(root)
+            continue
+        entries = [(root, root.name, "", st)]
+        folders = [(root, "")]
+        while folders:
+            folder, prefix = folders.pop()
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_symlink():
+                            continue
+                        relative = f"{prefix}{entry.name}"
+                        path = pathlib.Path(entry.path)
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append((path, f"{relative}/"))
+                        st = entry.stat(follow_symlinks=False)
+                        entries.append((path, entry.name, relative, st))
+            except OSError:
+                report.failed.append(folder)
+        for path, name, relative, st in entries:
+            report.checked += 1
+            is_dir = stat.S_ISDIR(st.st_mode)
+            for rule in rules:
+                if rule.matches(name, relative, is_dir):
+                    break
             else:
-                shutil.copy(copy_from, copy_to)
-    return
+                continue
+            mode = stat.S_IMODE(st.st_mode)
+            wanted = rule.wanted(mode)
+            uid, gid = owners[rule.owner] if rule.owner else (-1, -1)
+            chown = uid not in (-1, st.st_uid) or gid not in (-1, st.st_gid)
+            if wanted == mode and not chown:
+                continue
+            try:
+                if not dry_run and chown:
+                    os.chown(path, uid, gid, follow_symlinks=False)
+                if not dry_run and wanted != mode:
+                    os.chmod(path, wanted, follow_symlinks=False)
+                report.changed.append(path)
+            except OSError:
+                report.failed.append(path)
+    if not dry_run and report.checked:
+        summary = f"Changed {len(report.changed)} of {report.checked} entries\n"
+        OUTPUT.write(summary.encode())
+    return report
 
 
 def min_python_version() -> Text | None:
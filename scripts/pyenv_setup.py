@@ -9,117 +9,154 @@ RuntimeError
 
 import argparse
 import textwrap
-
-from library.classes import Labels
-from library.environment import HOME
+from pathlib import Path
+from typing import Text
+
+from library.artifacts import BUILD_DEPS
+from library.artifacts import PYENV_INSTALLER
+from library.blocks import BlockEdit
+from library.blocks import summarize_blocks
+from library.blocks import update_blocks
+from library.bundle import Bundle
+from library.bundle import set_bundle
 from library.environment import PASS
 from library.environment import SHELL
+from library.journal import Journal
+from library.packages import PackageIndex
+from library.packages import install_packages
+from library.packages import report_failures
+from library.packages import summarize
+from library.runner import StepRunner
+from library.runner import print_timing
 from library.utilities import clear
-from library.utilities import lean_text
 from library.utilities import min_python_version
-from library.utilities import run_many_arguments
+from library.utilities import privileged_session
 from library.utilities import run_one_command
 from library.utilities import run_shell_script
 
+# Version of the pyenv block in the rc files. Version 1 was the unmarked
+# copy of pyenvsupport.conf appended by older versions of this script.
+PYENV_BLOCK = 2
+
 
-def task_runner() -> None:
+def task_runner(args: argparse.Namespace) -> None:
     """Perform pyenv setup steps."""
     clear()
 
     # ------------------------------------------
 
-    # Setup status labels
+    # Steps are registered with a runner, along with the steps they
+    # depend on. Independent steps run at the same time. Each step also
+    # lists its inputs, so a resumed run can skip steps that already
+    # passed.
 
-    labels = Labels(
-        """
-        System initialization
-        Updating package index
-        Checking python build dependencies
-        Installing pyenv and tools
-        Adjusting shell environments
-        """
-    )
+    runner = StepRunner(journal=Journal("pyenv_setup"), resume=args.resume)
+    apt_report: dict[str, Text] = {}
+    index = PackageIndex()
 
-    # Step 0
+    # ------------------------------------------
 
-    msg = """Please enter your password if prompted."""
-    print(f"\n{msg}\n")
+    # Step 1: System initialization.
 
-    # Push a dummy sudo command just to force password entry before
-    # first ppa pull. This will avoid having the password prompt come in
-    # the middle of a label when providing status
+    def initialize() -> Text:
+        return PASS
 
-    run_one_command("sudo ls")
+    runner.add("System initialization", initialize)
 
     # ------------------------------------------
 
-    # Step 1: System initialization.
+    # Step 2: Update package index. There's nothing to update from
+    # when installing from a bundle.
+
+    def update_index() -> Text:
+        if args.bundle is not None:
+            return PASS
+        cmd = "sudo apt update"
+        return run_one_command(cmd=cmd)
 
-    labels.next()
-    print(PASS)
+    runner.add(
+        "Updating package index",
+        update_index,
+        needs=["System initialization"],
+    )
 
     # ------------------------------------------
 
-    # Step 2: Update package index
+    # Step 3: Check dependencies
+
+    def check_dependencies() -> Text:
+        apt_report.update(report := install_packages(targets=BUILD_DEPS, index=index))
+        return summarize(report)
 
-    labels.next()
-    cmd = "sudo apt update"
-    print(run_one_command(cmd=cmd))
+    runner.add(
+        "Checking python build dependencies",
+        check_dependencies,
+        needs=["Updating package index"],
+        inputs=list(BUILD_DEPS),
+    )
 
     # ------------------------------------------
 
-    # Step 3: Check dependencies
+    # Step 4: Install pyenv. The build dependencies are only needed
+    # when a python version is compiled, so this doesn't wait on apt.
 
-    labels.next()
-    cmd = "sudo apt install TARGET -y"
-    targets: list[str] = [
-        "make",
-        "build-essential",
-        "libssl-dev",
-        "zlib1g-dev",
-        "libbz2-dev",
-        "libreadline-dev",
-        "libsqlite3-dev",
-        "wget",
-        "curl",
-        "libncursesw5-dev",
-        "xz-utils",
-        "tk-dev",
-        "libxml2-dev",
-        "libxmlsec1-dev",
-        "libffi-dev",
-        "liblzma-dev",
-    ]
-    print(run_many_arguments(cmd=cmd, targets=targets))
+    def install_pyenv() -> Text:
+        return run_shell_script(PYENV_INSTALLER)
+
+    runner.add(
+        "Installing pyenv and tools",
+        install_pyenv,
+        needs=["System initialization"],
+        inputs=[PYENV_INSTALLER],
+    )
 
     # ------------------------------------------
 
-    # Step 4: Install pyenv
+    # Step 5: Adjust shell environments. The pyenv setup goes in a
+    # marked block in each rc file, so a newer version replaces it in
+    # place. By default, pyenv is only fully initialized the first time
+    # it's used, see shell/pyenvlazy.conf. A copy of the eager setup
+    # appended by older versions of this script is replaced as well.
+
+    support = SHELL / ("pyenvsupport.conf" if args.eager else "pyenvlazy.conf")
+    legacy = (SHELL / "pyenvsupport.conf").read_text()
+    blocks = [
+        BlockEdit(
+            rc,
+            "pyenv",
+            support.read_text(),
+            version=PYENV_BLOCK,
+            replaces=legacy,
+        )
+        for rc in (".bashrc", ".zshrc")
+    ]
+
+    def adjust_shells() -> Text:
+        return summarize_blocks(update_blocks(blocks))
 
-    labels.next()
-    print(run_shell_script("https://pyenv.run"))
+    runner.add(
+        "Adjusting shell environments",
+        adjust_shells,
+        needs=["System initialization"],
+        inputs=[support, str(PYENV_BLOCK)],
+    )
 
     # ------------------------------------------
 
-    # Step 5: Adjust shell environments
-
-    labels.next()
-
-    # Setup variables with file locations
-    support = SHELL / "pyenvsupport.conf"
-    bash = HOME / ".bashrc"
-    zsh = HOME / ".zshrc"
-    # Check to see if the adjustments have already been made, then
-    # proceed if not.
-    with open(zsh, "r") as f1, open(support, "r") as f2:
-        rc_str = f1.read()
-        sup_str = lean_text(f2.read())
-    if sup_str not in rc_str:
-        with open(support, "r") as f1, open(bash, "a") as f2, open(zsh, "a") as f3:
-            f2.write(f1.read())
-            f1.seek(0)
-            f3.write(f1.read())
-    print(PASS)
+    msg = """Please enter your password if prompted."""
+    print(f"\n{msg}\n")
+
+    # Push a dummy sudo command just to force password entry before
+    # first ppa pull. This will avoid having the password prompt come in
+    # the middle of a label when providing status
+
+    run_one_command("sudo ls")
+
+    with privileged_session():
+        runner.run()
+    report_failures(apt_report)
+    if args.timing:
+        print_timing("pyenv_setup")
 
     # ------------------------------------------
 
@@ -151,8 +188,51 @@ def main():
     epi = "Latest update: 11/27/24"
 
     parser = argparse.ArgumentParser(description=msg, epilog=epi)
-    parser.parse_args()
-    task_runner()
+
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """initialize pyenv in full in every new shell, as older
+    versions of this script did, instead of the first time pyenv or
+    python is used."""
+    parser.add_argument(
+        "-e",
+        "--eager",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """install from an offline bundle made with bundle.py, instead
+    of downloading from the internet."""
+    parser.add_argument(
+        "-b",
+        "--bundle",
+        type=Path,
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    if args.bundle is not None:
+        try:
+            set_bundle(Bundle.open(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
+    task_runner(args)
 
     return
 
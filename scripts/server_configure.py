@@ -11,129 +11,248 @@ import argparse
 import textwrap
 from pathlib import Path
 from typing import Any
+from typing import Text
 
-from library.classes import Labels
+from library.artifacts import AUTOUPDATE_REPO
+from library.artifacts import OHMYZSH_INSTALLER
+from library.artifacts import POWERLEVEL10K_REPO
+from library.bundle import Bundle
+from library.bundle import set_bundle
 from library.environment import DEBUG
+from library.environment import FAIL
 from library.environment import HOME
+from library.environment import OHMYZSH
 from library.environment import PASS
 from library.environment import SHELL
 from library.environment import VIM
+from library.journal import Journal
+from library.mirrors import MirrorStore
+from library.packages import PackageIndex
+from library.packages import install_packages
+from library.packages import summarize
+from library.runner import StepRunner
+from library.runner import print_plan
+from library.runner import print_timing
+from library.shell_profile import drop_compiled
+from library.tuning import REPORT
+from library.tuning import ZRAM_PACKAGE
+from library.tuning import apply_profile
+from library.tuning import is_applied
+from library.tuning import profile_edits
 from library.utilities import clear
 from library.utilities import copy_files
 from library.utilities import min_python_version
+from library.utilities import privileged_session
 from library.utilities import run_one_command
 from library.utilities import run_shell_script
 
 
-def task_runner(args) -> None:
+def task_runner(args: argparse.Namespace) -> None:
     """Perform VM configuration and setup."""
     clear()
 
     # ------------------------------------------
 
-    # Setup status labels
-
-    labels = Labels(
-        """
-        System initialization
-        Creating new directories
-        Setting up vim
-        Verifying zsh installation
-        Installing OhMyZsh
-        Installing OhMyZsh Full-autoupdate
-        Installing powerlevel10k theme
-        Copying dot files
-        """
+    # Steps are registered with a runner, along with the steps they
+    # depend on. Independent steps run at the same time. Each step also
+    # lists its inputs, so a resumed run can skip steps that already
+    # passed, and a probe, so a converge run can skip steps with nothing
+    # to change.
+
+    runner = StepRunner(
+        journal=Journal("server_configure"),
+        resume=args.resume,
+        converge=args.converge,
     )
+    index = PackageIndex()
+    custom_zsh_home = HOME / ".oh-my-zsh/custom"
+    mirrors = MirrorStore()
 
     # ------------------------------------------
 
-    # Step 1: Initialize lists for running many arguments. When running
-    # commands with generic string targets, the "targets" array will be
-    # used. Commands with special target-types are shown below.
+    # Step 1: System initialization.
+
+    def initialize() -> Text:
+        return PASS
 
-    labels.next()
-    dir_targets: list[Path] = []
-    file_targets: list[tuple[Any, Any]] = []
-    src: str | Path = ""
-    dest: str | Path = ""
-    target: str | Path = ""
-    print(PASS)
+    runner.add("System initialization", initialize)
 
     # ------------------------------------------
 
     # Step 2: Create new directories
 
-    labels.next()
-    dir_targets = [HOME / ".vim/colors"]
-    for target in dir_targets:
-        if DEBUG:
-            print(f"\nMaking: {target}")
-        else:
-            target.mkdir(parents=True, exist_ok=True)
-    print(PASS)
+    dir_targets: list[Path] = [HOME / ".vim/colors"]
+
+    def make_directories() -> Text:
+        for target in dir_targets:
+            if DEBUG:
+                print(f"\nMaking: {target}")
+            else:
+                target.mkdir(parents=True, exist_ok=True)
+        return PASS
+
+    runner.add(
+        "Creating new directories",
+        make_directories,
+        needs=["System initialization"],
+        probe=lambda: all(target.is_dir() for target in dir_targets),
+    )
 
     # ------------------------------------------
 
     # Step 3: Configure vim
 
-    labels.next()
-    file_targets = [
+    vim_files: list[tuple[Any, Any]] = [
         (VIM / "vimrc.conf", HOME / ".vimrc"),
         (VIM / "vimcolors/*", HOME / ".vim/colors"),
     ]
-    copy_files(targets=file_targets)
-    print(PASS)
+
+    def setup_vim() -> Text:
+        return copy_files(targets=vim_files).result()
+
+    runner.add(
+        "Setting up vim",
+        setup_vim,
+        needs=["Creating new directories"],
+        inputs=[src for src, _ in vim_files],
+        probe=lambda: not copy_files(targets=vim_files, dry_run=True).copied,
+    )
 
     # ------------------------------------------
 
     # Step 4: Verify zsh
 
-    labels.next()
-    cmd = "sudo apt install zsh -y"
-    print(run_one_command(cmd=cmd))
+    def verify_zsh() -> Text:
+        return summarize(install_packages(targets=["zsh"], index=index))
+
+    runner.add(
+        "Verifying zsh installation",
+        verify_zsh,
+        needs=["System initialization"],
+        inputs=["zsh"],
+        probe=lambda: not index.missing(["zsh"]),
+    )
 
     # ------------------------------------------
 
     # Step 5: Install OhMyZsh
 
-    labels.next()
-    src = "https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/"
-    cmd = f"{src}install.sh"
-    print(run_shell_script(shell="sh", script=cmd, options='"" --unattended'))
+    def install_ohmyzsh() -> Text:
+        return run_shell_script(
+            shell="sh", script=OHMYZSH_INSTALLER, options='"" --unattended'
+        )
+
+    runner.add(
+        "Installing OhMyZsh",
+        install_ohmyzsh,
+        needs=["Verifying zsh installation"],
+        inputs=[OHMYZSH_INSTALLER],
+        probe=OHMYZSH.is_dir,
+    )
 
     # ------------------------------------------
 
-    # Step 6: Install OhMyZsh Full-autoupdate
+    # Step 6: Install OhMyZsh Full-autoupdate. This and the theme below
+    # are cloned from mirrors in the local cache, so GitHub is only
+    # contacted when a mirror is created or due for a refresh. Re-runs
+    # update the existing checkout instead of failing.
 
-    labels.next()
-    custom_zsh_home = HOME / ".oh-my-zsh/custom"
-    src = "https://github.com/Pilaton/OhMyZsh-full-autoupdate.git"
-    dest = f"{custom_zsh_home}/plugins/ohmyzsh-full-autoupdate"
-    cmd = f"git clone --depth=1 {src} {dest}"
-    print(run_one_command(cmd=cmd))
+    autoupdate_dest = custom_zsh_home / "plugins/ohmyzsh-full-autoupdate"
+
+    def install_autoupdate() -> Text:
+        return mirrors.install(url=AUTOUPDATE_REPO, dest=autoupdate_dest)
+
+    runner.add(
+        "Installing OhMyZsh Full-autoupdate",
+        install_autoupdate,
+        needs=["Installing OhMyZsh"],
+        inputs=[AUTOUPDATE_REPO],
+        probe=lambda: mirrors.is_current(AUTOUPDATE_REPO, autoupdate_dest),
+    )
 
     # ------------------------------------------
 
     # Step 7: Install powerlevel10k theme
 
-    labels.next()
-    src = "https://github.com/romkatv/powerlevel10k.git"
-    dest = f"{custom_zsh_home}/themes/powerlevel10k"
-    cmd = f"git clone --depth=1 {src} {dest}"
-    print(run_one_command(cmd=cmd))
+    powerlevel10k_dest = custom_zsh_home / "themes/powerlevel10k"
+
+    def install_powerlevel10k() -> Text:
+        return mirrors.install(url=POWERLEVEL10K_REPO, dest=powerlevel10k_dest)
+
+    runner.add(
+        "Installing powerlevel10k theme",
+        install_powerlevel10k,
+        needs=["Installing OhMyZsh"],
+        inputs=[POWERLEVEL10K_REPO],
+        probe=lambda: mirrors.is_current(POWERLEVEL10K_REPO, powerlevel10k_dest),
+    )
 
     # ------------------------------------------
 
-    # Step 8: Copying dot files
+    # Step 8: Copying dot files. The OhMyZsh installer writes its own
+    # .zshrc, so this has to wait until it's done.
 
-    labels.next()
-    file_targets = [
+    dot_files: list[tuple[Any, Any]] = [
         (SHELL / "zshrc.conf", HOME / ".zshrc"),
         (SHELL / "p10k.conf", HOME / ".p10k.zsh"),
     ]
-    copy_files(targets=file_targets)
-    print(PASS)
+
+    def copy_dot_files() -> Text:
+        report = copy_files(targets=dot_files)
+        drop_compiled([dest for src, dest in dot_files if src in report.copied])
+        return report.result()
+
+    runner.add(
+        "Copying dot files",
+        copy_dot_files,
+        needs=["Installing OhMyZsh"],
+        inputs=[src for src, _ in dot_files],
+        probe=lambda: not copy_files(targets=dot_files, dry_run=True).copied,
+    )
+
+    # ------------------------------------------
+
+    # Step 9: Optionally, apply the VM performance profile (see
+    # library/tuning.py). It waits for the zsh install, since it
+    # installs the zram generator and apt can only run once at a time.
+
+    if args.performance:
+
+        def apply_performance_profile() -> Text:
+            report = install_packages(targets=[ZRAM_PACKAGE], index=index)
+            results = [summarize(report), apply_profile()]
+            return FAIL if FAIL in results else PASS
+
+        runner.add(
+            "Applying performance profile",
+            apply_performance_profile,
+            needs=["Verifying zsh installation"],
+            inputs=[ZRAM_PACKAGE, *(edit.key for edit in profile_edits())],
+            probe=lambda: is_applied() and not index.missing([ZRAM_PACKAGE]),
+        )
+
+    # ------------------------------------------
+
+    # In converge mode, show what's out of date and stop early if
+    # nothing is, before asking for a password.
+
+    if args.converge:
+        print_plan(plan := runner.plan())
+        if not plan:
+            return
+
+    # ------------------------------------------
+
+    # Push a dummy sudo command just to force password entry before any
+    # steps start. This will avoid having the password prompt come in
+    # the middle of a label when providing status
+
+    run_one_command(cmd="sudo ls")
+
+    with privileged_session():
+        runner.run()
+    if args.timing:
+        print_timing("server_configure")
 
     # ------------------------------------------
 
@@ -147,6 +266,8 @@ def task_runner(args) -> None:
     was an error during installation.
     """
     print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+    if args.performance:
+        print(f"Performance profile settings, before and after: {REPORT}\n")
 
     return
 
@@ -165,7 +286,58 @@ def main():
     epi = "Latest update: 11/27/24"
     parser = argparse.ArgumentParser(description=msg, epilog=epi)
 
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """check the current state first, then run only the steps that
+    would change something (e.g. from cron, to correct drift)."""
+    parser.add_argument(
+        "-c",
+        "--converge",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """also apply the VM performance profile: kernel memory and
+    writeback settings, zram swap, pass-through I/O scheduling for
+    virtual disks, and fewer background services."""
+    parser.add_argument(
+        "-p",
+        "--performance",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """install from an offline bundle made with bundle.py, instead
+    of downloading from the internet."""
+    parser.add_argument(
+        "-b",
+        "--bundle",
+        type=Path,
+        help=msg,
+    )
+
     args = parser.parse_args()
+    if args.bundle is not None:
+        try:
+            set_bundle(Bundle.open(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
     task_runner(args)
 
     return
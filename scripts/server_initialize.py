@@ -11,12 +11,22 @@ import argparse
 import tempfile
 import textwrap
 from pathlib import Path
+from typing import Text
 
-from library.classes import Labels
+from library.bundle import Bundle
+from library.bundle import set_bundle
 from library.environment import PASS
 from library.environment import SHELL
+from library.journal import Journal
+from library.packages import install_packages
+from library.packages import summarize
+from library.patches import Edit
+from library.runner import StepRunner
+from library.runner import print_timing
 from library.utilities import clear
 from library.utilities import min_python_version
+from library.utilities import patch_files
+from library.utilities import privileged_session
 from library.utilities import run_one_command
 
 
@@ -26,68 +36,89 @@ def task_runner(args: argparse.Namespace) -> None:
 
     # ------------------------------------------
 
-    # Setup status labels
-
-    labels = Labels(
-        f"""
-        System initialization
-        Creating user {args.user}
-        Adding user {args.user} to sudoers
-        Turn off password for {args.user} when using sudo
-        Installing zsh
-        Enabling remote login with ssh
-        """
-    )
+    # Steps are registered with a runner, along with the steps they
+    # depend on. Each step also lists its inputs, so a resumed run can
+    # skip steps that already passed.
+
+    runner = StepRunner(journal=Journal("server_initialize"), resume=args.resume)
 
     # ------------------------------------------
 
-    # Step 1: Initialize lists for running many arguments. When running
-    # commands with generic string targets, the "targets" array will be
-    # used. Commands with special target-types are shown below.
+    # Step 1: System initialization.
 
-    labels.next()
-    dest: str | Path = ""
-    target: str | Path = ""
-    print(PASS)
+    def initialize() -> Text:
+        return PASS
+
+    runner.add("System initialization", initialize)
 
     # ------------------------------------------
 
     # Step 2: Create new user
 
-    labels.next()
-    cmd = f"openssl passwd -1 {args.passwd}"
-    with tempfile.TemporaryFile(mode="w+") as f:
-        run_one_command(cmd=cmd, std_out=f, capture=False)
-        f.seek(0)
-        crypt_passwd = f.read()
-    cmd = f"sudo useradd -s /bin/bash -m -p {crypt_passwd} {args.user}"
-    print(run_one_command(cmd=cmd))
+    def create_user() -> Text:
+        cmd = f"openssl passwd -1 {args.passwd}"
+        with tempfile.TemporaryFile(mode="w+") as f:
+            run_one_command(cmd=cmd, std_out=f, capture=False)
+            f.seek(0)
+            crypt_passwd = f.read()
+        cmd = f"sudo useradd -s /bin/bash -m -p {crypt_passwd} {args.user}"
+        return run_one_command(cmd=cmd)
+
+    runner.add(
+        f"Creating user {args.user}",
+        create_user,
+        needs=["System initialization"],
+        inputs=[args.user],
+    )
 
     # ------------------------------------------
 
     # Step 3: Add new user to sudoers
 
-    labels.next()
-    cmd = f"sudo usermod -aG sudo {args.user}"
-    print(run_one_command(cmd=cmd))
+    def add_to_sudoers() -> Text:
+        cmd = f"sudo usermod -aG sudo {args.user}"
+        return run_one_command(cmd=cmd)
+
+    runner.add(
+        f"Adding user {args.user} to sudoers",
+        add_to_sudoers,
+        needs=[f"Creating user {args.user}"],
+        inputs=[args.user],
+    )
 
     # ------------------------------------------
 
     # Step 4: Turn off password requirement when using sudo
 
-    labels.next()
     patch = f"{args.user} ALL=(ALL) NOPASSWD:ALL"
-    target = "/etc/sudoers.d/90-cloud-init-users"
-    cmd = f"sudo sh -c 'echo \"{patch}\" >> {target}'"
-    print(run_one_command(cmd=cmd))
+
+    def disable_sudo_password() -> Text:
+        target = "/etc/sudoers.d/90-cloud-init-users"
+        # A bad line here would lock the user out of sudo, so visudo has
+        # to accept the new file before it goes in.
+        edit = Edit.ensure(target, patch, mode=0o440, check="visudo -cf")
+        return patch_files([edit])
+
+    runner.add(
+        f"Turn off password for {args.user} when using sudo",
+        disable_sudo_password,
+        needs=[f"Adding user {args.user} to sudoers"],
+        inputs=[patch],
+    )
 
     # ------------------------------------------
 
     # Step 5: Install zsh
 
-    labels.next()
-    cmd = "sudo apt install zsh -y"
-    print(run_one_command(cmd=cmd))
+    def install_zsh() -> Text:
+        return summarize(install_packages(targets=["zsh"]))
+
+    runner.add(
+        "Installing zsh",
+        install_zsh,
+        needs=["System initialization"],
+        inputs=["zsh"],
+    )
 
     # ------------------------------------------
 
@@ -100,15 +131,35 @@ def task_runner(args: argparse.Namespace) -> None:
     # metal installations on other hardware (e.g. Ubuntu Server on a
     # Dell Micro).
 
-    labels.next()
-    target = "60-cloudimg-settings.conf"
-    src = SHELL / target
-    dest = Path(f"/etc/ssh/sshd_config.d/{target}")
-    if dest.exists():
-        cmd = f"sudo cp {src} {dest}"
-        print(run_one_command(cmd=cmd))
-    else:
-        print(PASS)
+    ssh_conf = "60-cloudimg-settings.conf"
+
+    def enable_ssh() -> Text:
+        src = SHELL / ssh_conf
+        dest = Path(f"/etc/ssh/sshd_config.d/{ssh_conf}")
+        if dest.exists():
+            cmd = f"sudo cp {src} {dest}"
+            return run_one_command(cmd=cmd)
+        return PASS
+
+    runner.add(
+        "Enabling remote login with ssh",
+        enable_ssh,
+        needs=["System initialization"],
+        inputs=[SHELL / ssh_conf],
+    )
+
+    # ------------------------------------------
+
+    # Push a dummy sudo command just to force password entry before any
+    # steps start. This will avoid having the password prompt come in
+    # the middle of a label when providing status
+
+    run_one_command(cmd="sudo ls")
+
+    with privileged_session():
+        runner.run()
+    if args.timing:
+        print_timing("server_initialize")
 
     # ------------------------------------------
 
@@ -161,7 +212,39 @@ def main():
         help=msg,
     )
 
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """install from an offline bundle made with bundle.py, instead
+    of downloading from the internet."""
+    parser.add_argument(
+        "-b",
+        "--bundle",
+        type=Path,
+        help=msg,
+    )
+
     args = parser.parse_args()
+    if args.bundle is not None:
+        try:
+            set_bundle(Bundle.open(args.bundle))
+        except ValueError as e:
+            parser.error(str(e))
     task_runner(args)
 
     return
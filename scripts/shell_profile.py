@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Measure, and optionally speed up, interactive shell startup.
+
+Raises
+------
+RuntimeError
+    If Python is not at the minimum required version.
+"""
+
+import argparse
+import contextlib
+import textwrap
+
+from library.environment import FAIL
+from library.shell_profile import RUNS
+from library.shell_profile import SHELLS
+from library.shell_profile import StartupTimes
+from library.shell_profile import available
+from library.shell_profile import compile_zsh
+from library.shell_profile import precompute
+from library.shell_profile import print_times
+from library.shell_profile import print_trace
+from library.shell_profile import time_startup
+from library.shell_profile import trace_startup
+from library.utilities import min_python_version
+from library.utilities import privileged_session
+from library.utilities import run_one_command
+
+
+def measure(args: argparse.Namespace, shells: list[str]) -> list[StartupTimes]:
+    """Time each shell, then show where its startup time goes."""
+    results = [time_startup(shell, runs=args.runs, cold=args.cold) for shell in shells]
+    for shell in shells:
+        print_trace(shell, trace_startup(shell))
+    return results
+
+
+def task_runner(args: argparse.Namespace) -> None:
+    """Profile the shells, optimize, and profile them again."""
+    shells = [shell for shell in args.shell if shell in available()]
+    if not shells:
+        print("None of the shells are installed.")
+        return
+
+    with contextlib.ExitStack() as stack:
+        if args.cold:
+            print("\nPlease enter your password if prompted.\n")
+            # Emptying the page cache needs root. Ask for the password
+            # before any timing starts.
+            run_one_command(cmd="sudo ls")
+            stack.enter_context(privileged_session())
+        print(f"\nTiming {', '.join(shells)} startup ({args.runs} runs).\n")
+        before = measure(args, shells)
+        print()
+        print_times({r.shell: r for r in before})
+        if not args.optimize:
+            return
+
+        print("\nApplying optimizations.")
+        results = [precompute()]
+        if "zsh" in shells:
+            results.append(compile_zsh())
+        if FAIL in results:
+            print("Some optimizations could not be applied.")
+
+        print("\nTiming again.\n")
+        after = measure(args, shells)
+        print()
+        rows = {}
+        for b, a in zip(before, after):
+            rows[f"{b.shell} before"], rows[f"{a.shell} after"] = b, a
+        print_times(rows)
+
+    msg = """
+    Optimizations are kept up to date by re-running this script with
+    --optimize after changing ~/.dircolors, or installing a new version
+    of dircolors, lesspipe or zsh. Until then, shells fall back to
+    doing the work themselves.
+    """
+    print(f"\n{textwrap.fill(text=" ".join(msg.split()))}\n")
+
+    return
+
+
+def main():
+    if result := min_python_version():
+        raise RuntimeError(result)
+
+    msg = """
+    This script measures how long interactive bash and zsh shells take
+    to start, with and without a warm page cache, and which of the files
+    they read take the most time. With --optimize, it also moves work
+    that every shell repeats to now: the output of dircolors and
+    lesspipe is saved for the rc files to read, zsh rc files and
+    completion dumps are compiled, and the global compinit is turned
+    off. Startup is then measured again.
+    """
+
+    epi = "Latest update: 10/18/26"
+
+    parser = argparse.ArgumentParser(description=msg, epilog=epi)
+
+    msg = f"""number of times each shell is started (default: {RUNS})."""
+    parser.add_argument(
+        "-n",
+        "--runs",
+        type=int,
+        default=RUNS,
+        help=msg,
+    )
+
+    msg = """shell to profile. Can be given more than once (default:
+    bash and zsh, if installed)."""
+    parser.add_argument(
+        "-s",
+        "--shell",
+        action="append",
+        choices=list(SHELLS),
+        help=msg,
+    )
+
+    msg = """also time cold starts, emptying the page cache before each
+    one. Needs sudo."""
+    parser.add_argument(
+        "-c",
+        "--cold",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """apply the optimizations, then measure again."""
+    parser.add_argument(
+        "-o",
+        "--optimize",
+        action="store_true",
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    if not args.shell:
+        args.shell = list(SHELLS)
+    task_runner(args)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
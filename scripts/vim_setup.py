@@ -4,52 +4,69 @@
 import argparse
 import textwrap
 from typing import Any
+from typing import Text
 
-from library.classes import Labels
 from library.environment import DEBUG
 from library.environment import HOME
 from library.environment import PASS
 from library.environment import VIM
+from library.journal import Journal
+from library.runner import StepRunner
+from library.runner import print_timing
 from library.utilities import clear
 from library.utilities import copy_files
 from library.utilities import min_python_version
 
 
-def task_runner() -> None:
+def task_runner(args: argparse.Namespace) -> None:
     """Configure vim."""
     clear()
 
-    labels = Labels(
-        """
-        System initialization
-        Creating new directories
-        Copying files"""
-    )
+    runner = StepRunner(journal=Journal("vim_setup"), resume=args.resume)
 
     # Step 1. System initialization. Right now it's just a placeholder
     # for future capability.
 
-    labels.next()
-    print(PASS)
+    def initialize() -> Text:
+        return PASS
+
+    runner.add("System initialization", initialize)
 
     # Step 2. Creating new directory
 
-    labels.next()
-    p = HOME / ".vim/colors"
-    if DEBUG:
-        print(p)
-    else:
-        p.mkdir(parents=True, exist_ok=True)
-    print(PASS)
+    def make_directories() -> Text:
+        p = HOME / ".vim/colors"
+        if DEBUG:
+            print(p)
+        else:
+            p.mkdir(parents=True, exist_ok=True)
+        return PASS
+
+    runner.add(
+        "Creating new directories",
+        make_directories,
+        needs=["System initialization"],
+    )
 
     # Step 3. Copying files
 
-    labels.next()
     targets: list[tuple[Any, Any]] = []
     targets.append((VIM / "vimrc.conf", HOME / ".vimrc"))
     targets.append((VIM / "vimcolors/*", HOME / ".vim/colors"))
-    copy_files(targets=targets)
-    print(PASS)
+
+    def copy_vim_files() -> Text:
+        return copy_files(targets=targets).result()
+
+    runner.add(
+        "Copying files",
+        copy_vim_files,
+        needs=["Creating new directories"],
+        inputs=[src for src, _ in targets],
+    )
+
+    runner.run()
+    if args.timing:
+        print_timing("vim_setup")
 
     # Done
 
@@ -75,8 +92,27 @@ def main():
     epi = "Latest update: 11/27/24"
 
     parser = argparse.ArgumentParser(description=msg, epilog=epi)
-    parser.parse_args()
-    task_runner()
+
+    msg = """resume a previous run, skipping steps that already passed
+    and whose inputs have not changed."""
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help=msg,
+    )
+
+    msg = """print a per-step timing summary at the end of the run and
+    save a trace that can be loaded in chrome://tracing or Perfetto."""
+    parser.add_argument(
+        "-t",
+        "--timing",
+        action="store_true",
+        help=msg,
+    )
+
+    args = parser.parse_args()
+    task_runner(args)
 
     return
 